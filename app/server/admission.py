@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List
+
+import telemetry
+from configs import LLM_ADMISSION
+
+# меньше — важнее
+PRIORITY_ADMIN = 0
+PRIORITY_USER = 1
+PRIORITY_ANONYMOUS = 2
+PRIORITY_NAMES = {PRIORITY_ADMIN: "admin", PRIORITY_USER: "user", PRIORITY_ANONYMOUS: "anonymous"}
+
+
+class AdmissionRejected(Exception):
+    """Генерация не будет запущена: очередь полна, ожидание дольше SLA или место занял более важный запрос."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "evicted")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.evicted = False
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """
+    Ограничивает одновременные генерации LLM. Сверх max_concurrency запросы ждут
+    в очереди по приоритету (внутри приоритета — FIFO) не дольше sla секунд.
+    Если по оценке (длительность генерации EWMA * очередь впереди / слоты)
+    ожидание больше SLA, запрос отклоняется сразу. При полной очереди более
+    важный запрос вытесняет последний из наименее важных.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, sla: float, service_time: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.sla = sla
+        self._service_time = service_time  # EWMA длительности генерации, сек
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: List[_Ticket] = []  # heap
+        self._seq = itertools.count()
+
+    def estimated_wait(self, priority: int) -> float:
+        with self._cond:
+            return self._estimate(priority)
+
+    def _estimate(self, priority: int) -> float:
+        ahead = sum(1 for t in self._waiting if t.priority <= priority)
+        if self._active < self.max_concurrency and ahead == 0:
+            return 0.0
+        return (ahead + 1) * self._service_time / self.max_concurrency
+
+    def _evict_for(self, priority: int) -> bool:
+        worst = max(self._waiting, default=None)
+        if worst is None or worst.priority <= priority:
+            return False
+        self._waiting.remove(worst)
+        heapq.heapify(self._waiting)
+        worst.evicted = True
+        return True
+
+    def _reject(self, reason: str, priority: int) -> AdmissionRejected:
+        telemetry.LLM_ADMISSION.labels(reason, PRIORITY_NAMES[priority]).inc()
+        return AdmissionRejected(reason)
+
+    def _acquire(self, priority: int) -> None:
+        t0 = time.perf_counter()
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                telemetry.LLM_ADMISSION.labels("admitted", PRIORITY_NAMES[priority]).inc()
+                telemetry.LLM_QUEUE_WAIT.observe(0.0)
+                return
+            if self._estimate(priority) > self.sla:
+                raise self._reject("shed_estimate", priority)
+            if len(self._waiting) >= self.max_queue and not self._evict_for(priority):
+                raise self._reject("shed_queue_full", priority)
+
+            ticket = _Ticket(priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            telemetry.LLM_QUEUE_DEPTH.set(len(self._waiting))
+            self._cond.notify_all()  # вытесненный должен проснуться
+            deadline = t0 + self.sla
+            try:
+                while True:
+                    if ticket.evicted:
+                        raise self._reject("shed_evicted", priority)
+                    if self._waiting[0] is ticket and self._active < self.max_concurrency:
+                        heapq.heappop(self._waiting)
+                        self._active += 1
+                        break
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._waiting.remove(ticket)
+                        heapq.heapify(self._waiting)
+                        self._cond.notify_all()
+                        raise self._reject("shed_timeout", priority)
+                    self._cond.wait(remaining)
+            finally:
+                telemetry.LLM_QUEUE_DEPTH.set(len(self._waiting))
+        telemetry.LLM_ADMISSION.labels("admitted", PRIORITY_NAMES[priority]).inc()
+        telemetry.LLM_QUEUE_WAIT.observe(time.perf_counter() - t0)
+
+    def _release(self, service_sec: float) -> None:
+        with self._cond:
+            self._active -= 1
+            self._service_time = 0.8 * self._service_time + 0.2 * service_sec
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int) -> Iterator[None]:
+        """Слот генерации; AdmissionRejected — до начала, если ждать дольше SLA."""
+        self._acquire(priority)
+        telemetry.LLM_ACTIVE.inc()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            telemetry.LLM_ACTIVE.dec()
+            self._release(time.perf_counter() - t0)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "sla_s": self.sla,
+                "service_time_s": round(self._service_time, 3),
+            }
+
+
+llm_admission = AdmissionController(
+    max_concurrency=LLM_ADMISSION.max_concurrency,
+    max_queue=LLM_ADMISSION.max_queue,
+    sla=LLM_ADMISSION.queue_sla,
+    service_time=LLM_ADMISSION.service_time,
+)
@@ -1,13 +1,17 @@
 import os
-import base64
+import time
+import json
 import numpy as np
 from functools import lru_cache
 from typing import Optional, Dict, Any, List
-from configs import TOXICITY_CLASSIFIER, RUBERT_EMBEDDER, FACTORS_DEV, facts, JWT_c, QWEN
+from configs import TOXICITY_CLASSIFIER, SENTINEL_CLASSIFIER, MODERATION, GATEWAY_TOKENIZER, RUBERT_EMBEDDER, FACTORS_DEV, facts, JWT_c, QWEN, RETRIEVAL, CONTEXT, RERANKER
+from context import configured_tokenizer, pack_context
 from fastapi import status
+from fastapi.concurrency import run_in_threadpool
 
 import httpx
-from fastapi import FastAPI, Query, HTTPException
+from sqlalchemy import select
+from fastapi import FastAPI, Query, HTTPException, Request, Response
 import uvicorn
 import jwt
 from pydantic import BaseModel, Field, validator
@@ -15,10 +19,20 @@ from fastapi import Depends, Header
 from pydantic import BaseModel, Field
 
 import database.baseclasses as db
+import ingest
+import telemetry
+import upstream
+import prefilter
+import rerank
+import vectorstore
+import tokenization
+from admission import llm_admission, AdmissionRejected, PRIORITY_ADMIN, PRIORITY_USER, PRIORITY_ANONYMOUS
+from passwords import verifier as password_verifier, HasherSaturated
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime, timezone, timedelta
 
 import os
-from fastapi import Depends, HTTPException, Header, Security
+from fastapi import Depends, HTTPException, Header, Security, UploadFile, File
 from fastapi.openapi.utils import get_openapi
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
@@ -185,25 +199,41 @@ def get_db():
         yield session
     finally:
         session.close()
-        
+
 # --------- Примеры прикладных функций ---------
 
 
-def _infer_triton(prompts: list[str]) -> list[str]:
+def _gen_params() -> dict:
+    """Параметры генерации для GEN_PARAMS qwen_cpu: платим только за токены ответа."""
+    params = {"thinking": QWEN.thinking}
+    if QWEN.max_new_tokens:
+        params["max_new_tokens"] = QWEN.max_new_tokens
+    if QWEN.temperature is not None:
+        params["temperature"] = QWEN.temperature
+    if QWEN.stop:
+        params["stop"] = QWEN.stop
+    return params
+
+
+def _infer_triton(chats: list[list[dict]]) -> list[str]:
+    """Ответ на каждый чат: элемент батча qwen_cpu — весь чат JSON-строкой, одна генерация на чат."""
+    prompts = [json.dumps(messages, ensure_ascii=False) for messages in chats]
     payload = {
         "inputs": [
-            {"name": "TEXT", "shape": [len(prompts)], "datatype": "STRING", "data": prompts}
+            {"name": "TEXT", "shape": [len(prompts)], "datatype": "BYTES", "data": prompts},
+            {"name": "GEN_PARAMS", "shape": [1], "datatype": "BYTES",
+             "data": [json.dumps(_gen_params(), ensure_ascii=False)]},
         ],
         "outputs": [{"name": "OUTPUT_TEXT"}],
         "binary_data_output": False
     }
-    url = f"{TRITON_URL}/v2/models/{TRITON_MODEL}/infer"
-    r = requests.post(url, json=payload, timeout=TRITON_TIMEOUT, headers={"Connection": "close"})
     try:
-        r.raise_for_status()
-    except requests.HTTPError:
-       
-        raise HTTPException(status_code=r.status_code, detail=r.text)
+        # генерация дорогая и не идемпотентна по времени — без повторов
+        r = upstream.llm.request("POST", f"/v2/models/{QWEN.model}/infer", json=payload)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text) from e
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"LLM request failed: {e}") from e
     resp = r.json()
     out = resp["outputs"][0].get("data")
     if out is None:
@@ -214,7 +244,7 @@ def _infer_triton(prompts: list[str]) -> list[str]:
 def _after_reasoning(text: str) -> str:
     """
     Возвращает часть текста ПОСЛЕ тега </think>.
-    Если тега нет — возвращает исходный текст.
+    Если тега нет — возвращает исходный текст (так и бывает при QWEN_THINKING=false).
     """
     tag = "</think>"
     idx = text.find(tag)
@@ -275,31 +305,78 @@ def custom_openapi():
 app.openapi = custom_openapi
 
 
+@app.on_event("startup")
+def _start_password_pool() -> None:
+    password_verifier.warmup()
+
+
+@app.on_event("startup")
+def _start_tracing() -> None:
+    telemetry.setup_tracing()
+
+
+@app.on_event("startup")
+def _start_upstream_health_checks() -> None:
+    upstream.start_health_checks()
+
+
+@app.on_event("shutdown")
+def _stop_password_pool() -> None:
+    password_verifier.shutdown()
+
+
+@app.on_event("shutdown")
+def _stop_rerank_pool() -> None:
+    rerank.shutdown()
+
+
+@app.on_event("shutdown")
+def _close_upstream_client() -> None:
+    upstream.close()
+
+
+@app.on_event("shutdown")
+async def _dispose_async_engine() -> None:
+    if db.async_engine is not None:
+        await db.async_engine.dispose()
+
+
+@app.middleware("http")
+async def _observe_requests(request: Request, call_next):
+    telemetry.REQUESTS_IN_FLIGHT.inc()
+    t0 = time.perf_counter()
+    status_code = 500
+    try:
+        # серверный спан продолжает трассу клиента (traceparent), спаны стадий и Triton — его дети
+        with telemetry.span(f"{request.method} {request.url.path}", context=telemetry.extract_context(request.headers)):
+            response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        telemetry.REQUESTS_IN_FLIGHT.dec()
+        route = getattr(request.scope.get("route"), "path", "unmatched")  # шаблон пути, без id в метке
+        telemetry.REQUEST_SECONDS.labels(route, request.method, str(status_code)).observe(time.perf_counter() - t0)
+        telemetry.sync_caches()
+
+
 ### ----- Processing ------
 
 def _infer_classes(embedding: np.ndarray) -> list[str]:
     payload = {"embedding": embedding}
-    url = f"{FACTORS_DEV.host}/infer"
     try:
-        with httpx.Client(timeout=FACTORS_DEV.timeout) as client:
-            r = client.post(url, json=payload)
-            r.raise_for_status()
-            data = r.json()
-            if not isinstance(data, list) or len(data) < 2:
-                raise HTTPException(status_code=502, detail=f"Classifier returned unexpected payload: {data}")
-            return [str(data[0]), str(data[1])]
+        r = upstream.factors.request("POST", "/infer", json=payload)
+        data = r.json()
+        if not isinstance(data, list) or len(data) < 2:
+            raise HTTPException(status_code=502, detail=f"Classifier returned unexpected payload: {data}")
+        return [str(data[0]), str(data[1])]
     except httpx.HTTPError as e:
        
         raise HTTPException(status_code=502, detail=f"Classifier request failed: {e}") from e
 
-@lru_cache(maxsize=1)
-def _get_emb_meta() -> _EmbMeta:
-    url = f"{RUBERT_EMBEDDER.host}/v2/models/{RUBERT_EMBEDDER.model}"
+@lru_cache(maxsize=4)
+def _get_emb_meta(embedder: upstream.Upstream, model: str) -> _EmbMeta:
     try:
-        with httpx.Client(timeout=RUBERT_EMBEDDER.timeout) as client:
-            r = client.get(url)
-            r.raise_for_status()
-            md = r.json()
+        md = embedder.request("GET", f"/v2/models/{model}").json()
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Embeddings meta fetch failed: {e}") from e
 
@@ -311,12 +388,11 @@ def _get_emb_meta() -> _EmbMeta:
         raise HTTPException(status_code=500, detail=f"Unexpected embeddings model metadata: {e}") from e
     return _EmbMeta(in_name, in_dtype, out_name)
 
-def _embed_one(text: str) -> np.ndarray:
-    meta = _get_emb_meta()
-    if meta.in_dtype == "STRING":
+def _embed_one(text: str, embedder: Optional[upstream.Upstream] = None, model: str = RUBERT_EMBEDDER.model) -> np.ndarray:
+    embedder = embedder or upstream.embedder
+    meta = _get_emb_meta(embedder, model)
+    if meta.in_dtype in ("STRING", "BYTES"):
         data_field = [text]
-    elif meta.in_dtype == "BYTES":
-        data_field = [base64.b64encode(text.encode("utf-8")).decode("ascii")]
     else:
         raise HTTPException(status_code=500, detail=f"Unsupported embeddings input dtype: {meta.in_dtype}")
 
@@ -326,34 +402,63 @@ def _embed_one(text: str) -> np.ndarray:
         "binary_data_output": False,
     }
 
-    url = f"{RUBERT_EMBEDDER.host}/v2/models/{RUBERT_EMBEDDER.model}/infer"
     try:
-        with httpx.Client(timeout=RUBERT_EMBEDDER.timeout) as client:
-            r = client.post(url, json=payload)
-            r.raise_for_status()
-            out = r.json()["outputs"][0]
-            vec = np.array(out["data"], dtype=np.float32).reshape(out["shape"])[0]
+        r = embedder.request("POST", f"/v2/models/{model}/infer", json=payload)
+        out = r.json()["outputs"][0]
+        vec = np.array(out["data"], dtype=np.float32).reshape(out["shape"])[0]
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Embeddings inference failed: {e}") from e
     except (KeyError, IndexError, ValueError) as e:
         raise HTTPException(status_code=500, detail=f"Unexpected embeddings output: {e}") from e
 
+    return _normalize_embedding(vec)
+
+
+# Активное поколение chunks.embedding (reembed.py) — не реже раза в RUBERT_GENERATION_REFRESH секунд
+_generation: Dict[str, Any] = {"checked": float("-inf"), "value": None}
+
+
+def _active_generation() -> Optional[Dict[str, Any]]:
+    now = time.monotonic()
+    if now - _generation["checked"] >= RUBERT_EMBEDDER.generation_refresh:
+        _generation["value"] = db.active_generation()
+        _generation["checked"] = now
+    return _generation["value"]
+
+
+@lru_cache(maxsize=4)
+def _generation_embedder(host: str, model: str) -> upstream.Upstream:
+    return upstream.Upstream(f"{model}@{host}", [host], RUBERT_EMBEDDER.timeout)
+
+
+def _retrieval_embedding(text: str, vec: np.ndarray) -> tuple[List[float], Optional[int]]:
+    """
+    Вектор запроса для поиска по chunks.embedding и номер его поколения. Префильтр, factor-dev и
+    moderation-triton обучены на RUBERT_*, их вектор vec; после reembed.py на другую модель чанки
+    посчитаны ею — и запрос для поиска эмбеддится ею же.
+    """
+    gen = _active_generation()
+    if gen is None:
+        return vec.tolist(), None
+    hosts = {h.rstrip("/") for h in RUBERT_EMBEDDER.hosts}
+    if gen["model"] == RUBERT_EMBEDDER.model and gen["host"].rstrip("/") in hosts:
+        return vec.tolist(), gen["generation"]
+    with telemetry.stage("embed"):
+        return _embed_one(text, _generation_embedder(gen["host"], gen["model"]), gen["model"]).tolist(), gen["generation"]
+
+
+def _normalize_embedding(vec: np.ndarray) -> np.ndarray:
     if RUBERT_EMBEDDER.normalize:
         norm = float(np.linalg.norm(vec))
         if norm > 0:
             vec = vec / norm
-    return vec 
+    return vec
 
 
-@lru_cache(maxsize=1)
-def _get_meta() -> TritonMeta:
-    """Кэшируем метаданные модели Triton (имена/типы входов и выходов)."""
-    url = f"{TOXICITY_CLASSIFIER.host}/v2/models/{TOXICITY_CLASSIFIER.model}"
+def _fetch_triton_meta(service: upstream.Upstream, model: str) -> TritonMeta:
+    """Метаданные модели Triton (имена/типы входов и выходов)."""
     try:
-        with httpx.Client(timeout=TOXICITY_CLASSIFIER.timeout) as client:
-            r = client.get(url)
-            r.raise_for_status()
-            md = r.json()
+        md = service.request("GET", f"/v2/models/{model}").json()
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Triton meta fetch failed: {e}") from e
 
@@ -367,11 +472,31 @@ def _get_meta() -> TritonMeta:
     return TritonMeta(in_name, in_dtype, out_name)
 
 
+@lru_cache(maxsize=1)
+def _get_meta() -> TritonMeta:
+    return _fetch_triton_meta(upstream.toxicity, TOXICITY_CLASSIFIER.model)
+
+
+@lru_cache(maxsize=1)
+def _get_sentinel_meta() -> TritonMeta:
+    return _fetch_triton_meta(upstream.sentinel, SENTINEL_CLASSIFIER.model)
+
+
+@lru_cache(maxsize=1)
+def _get_moderation_meta() -> TritonMeta:
+    return _fetch_triton_meta(upstream.moderation, MODERATION.model)
+
+
+telemetry.register_cache("toxicity_meta", _get_meta)
+telemetry.register_cache("sentinel_meta", _get_sentinel_meta)
+telemetry.register_cache("moderation_meta", _get_moderation_meta)
+telemetry.register_cache("embeddings_meta", _get_emb_meta)
+telemetry.register_cache("ingest_embeddings_meta", ingest._emb_meta)
+
+
 def _make_payload(text: str, meta: TritonMeta) -> dict:
-    if meta.in_dtype == "STRING":
+    if meta.in_dtype in ("STRING", "BYTES"):
         data_field = [text]
-    elif meta.in_dtype == "BYTES":
-        data_field = [base64.b64encode(text.encode("utf-8")).decode("ascii")]
     else:
         raise HTTPException(status_code=500, detail=f"Unsupported Triton input dtype: {meta.in_dtype}")
 
@@ -383,22 +508,112 @@ def _make_payload(text: str, meta: TritonMeta) -> dict:
     return payload
 
 
-def _infer_toxicity(text: str) -> float:
-    meta = _get_meta()
-    payload = _make_payload(text, meta)
-    url = f"{TOXICITY_CLASSIFIER.host}/v2/models/{TOXICITY_CLASSIFIER.model}/infer"
+def _make_token_payload(ids: np.ndarray, meta: TritonMeta) -> dict:
+    """INPUT_IDS/ATTENTION_MASK вместо TEXT: токены уже посчитаны шлюзом (tokenization.py)."""
+    ids = ids.tolist()
+    return {
+        "inputs": [
+            {"name": "INPUT_IDS", "shape": [1, len(ids)], "datatype": "INT64", "data": ids},
+            {"name": "ATTENTION_MASK", "shape": [1, len(ids)], "datatype": "INT64", "data": [1] * len(ids)},
+        ],
+        "outputs": [{"name": meta.out_name}],
+        "binary_data_output": False,
+    }
+
+
+# None — токенизация на шлюзе выключена, модели получают TEXT
+_gateway_tokenizer = tokenization.load_configured()
+configured_tokenizer()  # токенизатор qwen для чанков без token_count — при старте, а не в первом запросе
+_vector_store = vectorstore.configured_store() if RETRIEVAL.mode == "vector" else None
+
+
+def _infer_score(service: upstream.Upstream, model: str, meta: TritonMeta, text: str,
+                 ids: Optional[np.ndarray] = None) -> float:
+    if ids is not None and model in GATEWAY_TOKENIZER.models:
+        payload = _make_token_payload(ids, meta)
+    else:
+        payload = _make_payload(text, meta)
     try:
-        with httpx.Client(timeout=TOXICITY_CLASSIFIER.timeout) as client:
-            r = client.post(url, json=payload)
-            r.raise_for_status()
-            out = r.json()["outputs"][0]
-            score = float(np.array(out["data"], dtype=np.float32).reshape(out["shape"])[0])
-            return score
+        r = service.request("POST", f"/v2/models/{model}/infer", json=payload)
+        out = r.json()["outputs"][0]
+        score = float(np.array(out["data"], dtype=np.float32).reshape(out["shape"])[0])
+        return score
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Triton inference failed: {e}") from e
     except (KeyError, IndexError, ValueError) as e:
         raise HTTPException(status_code=500, detail=f"Unexpected Triton output format: {e}") from e
 
+
+def _infer_toxicity(text: str, ids: Optional[np.ndarray] = None) -> float:
+    return _infer_score(upstream.toxicity, TOXICITY_CLASSIFIER.model, _get_meta(), text, ids)
+
+
+_toxicity_prefilter = prefilter.load_configured()
+
+
+def _prefilter_toxicity(vec: np.ndarray) -> tuple[float, str]:
+    """P(toxic) первого каскада и решение: clean / toxic — без xlmr_toxicity, escalate — в xlmr_toxicity."""
+    p = float(_toxicity_prefilter.score(vec)[0])
+    decision = _toxicity_prefilter.decide(p)
+    telemetry.TOXICITY_PREFILTER.labels(decision).inc()
+    return p, decision
+
+
+def _infer_jailbreak(text: str, ids: Optional[np.ndarray] = None) -> float:
+    return _infer_score(upstream.sentinel, SENTINEL_CLASSIFIER.model, _get_sentinel_meta(), text, ids)
+
+
+def _moderate(text: str) -> tuple[float, float, Optional[np.ndarray]]:
+    """
+    Один запрос к moderation-triton вместо xlmr_toxicity + sentinel (+ rubert):
+    (P_TOXIC, P_ATTACK, эмбеддинг или None, если MODERATION_EMBEDDINGS=false).
+    """
+    meta = _get_moderation_meta()
+    payload = _make_payload(text, meta)
+    wanted = ["P_TOXIC", "P_ATTACK"] + (["EMBEDDINGS"] if MODERATION.embeddings else [])
+    payload["outputs"] = [{"name": name} for name in wanted]
+    try:
+        r = upstream.moderation.request("POST", f"/v2/models/{MODERATION.model}/infer", json=payload)
+        outs = {o["name"]: o for o in r.json()["outputs"]}
+        toxic = float(np.array(outs["P_TOXIC"]["data"], dtype=np.float32)[0])
+        attack = float(np.array(outs["P_ATTACK"]["data"], dtype=np.float32)[0])
+        vec = None
+        if MODERATION.embeddings:
+            emb = outs["EMBEDDINGS"]
+            vec = _normalize_embedding(np.array(emb["data"], dtype=np.float32).reshape(emb["shape"])[0])
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Moderation inference failed: {e}") from e
+    except (KeyError, IndexError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected moderation output: {e}") from e
+    return toxic, attack, vec
+
+def _llm_priority(creds: Optional[HTTPAuthorizationCredentials]) -> int:
+    """Приоритет в очереди к LLM по роли из токена; без токена или с невалидным — анонимный (самый низкий)."""
+    if creds is None:
+        return PRIORITY_ANONYMOUS
+    try:
+        claims = _decode_token(creds.credentials)
+    except Exception:
+        # /pipeline открыт и без токена: просроченный токен не повод отказывать, только не даёт приоритета
+        telemetry.LLM_INVALID_TOKEN.inc()
+        return PRIORITY_ANONYMOUS
+    return PRIORITY_ADMIN if claims.get("role") == JWT_c.role_admin else PRIORITY_USER
+
+
+def _degraded_answer(topk: list, reason: str) -> dict:
+    """Ответ без генерации: самый релевантный фрагмент базы знаний."""
+    ctx = build_context_block([x["data"] for x in topk[:1]], max_chars_total=1200, max_chars_per_chunk=1200)
+    if not ctx:
+        return {
+            "text": "Сейчас слишком много обращений, попробуйте, пожалуйста, чуть позже.",
+            "info": f"LLM overloaded ({reason})",
+        }
+    return {
+        "text": f"Сейчас много обращений, поэтому отвечаю фрагментом из базы знаний:\n\n{ctx}",
+        "info": f"Degraded answer: LLM overloaded ({reason})",
+    }
+
+
 def build_context_block(chunks, max_chars_total=3500, max_chars_per_chunk=900):
     """Собираем до 5 чанков, каждый подсечём по длине; общий лимит на контекст."""
     clean = []
@@ -418,10 +633,37 @@ def build_context_block(chunks, max_chars_total=3500, max_chars_per_chunk=900):
 ### ----- Endpoints ------
 
 @app.get("/pipeline")
-def toxicity(text: str = Query(..., description="Текст для проверки на токсичность")):
-    toxity_score = _infer_toxicity(text)
+def toxicity(
+    text: str = Query(..., description="Текст для проверки на токсичность"),
+    creds: Optional[HTTPAuthorizationCredentials] = Security(bearer_scheme),
+):
+    priority = _llm_priority(creds)
+    vec = None
+    if upstream.moderation is not None:
+        with telemetry.stage("moderation"):
+            toxity_score, jailbreak_score, vec = _moderate(text)
+    else:
+        decision = prefilter.ESCALATE
+        ids = None
+        if _gateway_tokenizer is not None:
+            # один раз на классификаторы из GATEWAY_TOKENIZER_MODELS
+            with telemetry.stage("tokenize"):
+                ids = _gateway_tokenizer.encode(text)
+        if _toxicity_prefilter is not None:
+            # эмбеддинг нужен дальше в любом случае — считаем его до модерации
+            with telemetry.stage("embed"):
+                vec = _embed_one(text)
+            with telemetry.stage("prefilter"):
+                _, decision = _prefilter_toxicity(vec)
+        if decision == prefilter.ESCALATE:
+            with telemetry.stage("toxicity"):
+                toxity_score = _infer_toxicity(text, ids)
+        else:
+            # решение каскада окончательное: его P(toxic) с порогами low / high не округляем
+            toxity_score = 1.0 if decision == prefilter.TOXIC else 0.0
+        with telemetry.stage("jailbreak"):
+            jailbreak_score = _infer_jailbreak(text, ids)
     toxity_predict = int(round(toxity_score))
-    jailbreak_score = _infer_toxicity(text)
     jailbreak_predict = int(round(jailbreak_score))
 
     if toxity_predict or jailbreak_predict:
@@ -430,46 +672,96 @@ def toxicity(text: str = Query(..., description="Текст для провер
             "info": "Query is toxic or jailbreak",
         }
     
-    vec = _embed_one(text)
+    if vec is None:
+        with telemetry.stage("embed"):
+            vec = _embed_one(text)
     embedding = vec.tolist()
-    factors = _infer_classes(embedding)
+    with telemetry.stage("factors"):
+        factors = _infer_classes(embedding)
     if int(factors[facts["action_item"]]):
         return {
             "text": "Перевожу на оператора",
             "info": "Action item message",
         }
     
-    topk = db.knn_search(embedding)
+    category = factors[facts["category"]]
+    query_embedding, query_generation = _retrieval_embedding(text, vec)
+    # кандидатов больше, чем влезет: какие из них пойдут в контекст, решает pack_context по бюджету токенов
+    k = max(RETRIEVAL.top_k, CONTEXT.candidates)
+    if upstream.reranker is not None:
+        k = max(k, RERANKER.candidates)
+    with telemetry.stage("knn"):
+        if RETRIEVAL.mode == "hybrid":
+            topk = db.hybrid_search(query_embedding, text, k=k, category=category)
+        elif _vector_store is not None:
+            topk = _vector_store.knn_search(query_embedding, k=k, category=category, generation=query_generation)
+        else:
+            topk = db.knn_search(query_embedding, k=k, category=category)
+    max_fragments = None
+    if upstream.reranker is not None:
+        with telemetry.stage("rerank"):
+            ranked = rerank.rerank(text, topk)
+        if ranked is not None:
+            topk, max_fragments = ranked, RERANKER.top_n
+        else:
+            topk = topk[:max(RETRIEVAL.top_k, CONTEXT.candidates)]  # порядок поиска, как без переранжирования
     SYSTEM_PROMPT = (
         "Ты — русскоязычный помощник для корпоративных FAQ. "
         "Отвечай строго по предоставленному контексту. "
         "И пытайся дать правильный ответ на вопрос или решение"
         "Если точного ответа нет в контексте — так и скажи."
     )
-    ctx = build_context_block([x["data"] for x in topk], max_chars_total=3500, max_chars_per_chunk=900)
-    user_content = f"Контекст:\n{ctx}\n\nВопрос: {query_text}\n\nОтвети кратко и по делу."
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": user_content},
-    ]
-    outputs = _infer_triton(messages)
+    with telemetry.stage("context"):
+        ctx, packed = pack_context(topk, max_fragments=max_fragments)
+        telemetry.CONTEXT_TOKENS.observe(packed["tokens"])
+        telemetry.CONTEXT_DUPLICATES.inc(packed["duplicates"])
+        user_content = f"Контекст:\n{ctx}\n\nВопрос: {text}\n\nОтвети кратко и по делу."
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_content},
+        ]
+    try:
+        with llm_admission.slot(priority), telemetry.stage("llm"):
+            outputs = _infer_triton([messages])
+    except AdmissionRejected as e:
+        return _degraded_answer(topk, e.reason)
     raw_text = outputs[0] if outputs else ""
 
-    final_text = _after_reasoning(raw_text)
+    with telemetry.stage("postprocess"):
+        final_text = _after_reasoning(raw_text)
     
     return {
         "text": final_text,
         "info": "LLM answer",
     }
     
+def _find_user_by_email(email: str) -> Optional[db.User]:
+    with db.SessionLocal() as session:
+        return session.query(db.User).filter(db.User.email == email).first()
+
+
+async def _find_user(email: str) -> Optional[db.User]:
+    """С DATABASE_ASYNC=true — через asyncpg в event loop, иначе sync-запрос в threadpool."""
+    if db.AsyncSessionLocal is None:
+        return await run_in_threadpool(_find_user_by_email, email)
+    async with db.AsyncSessionLocal() as session:
+        result = await session.execute(select(db.User).where(db.User.email == email))
+        return result.scalars().first()
+
+
 @app.post("/login", response_model=LoginResponse, summary="Логин по email и паролю")
-def login(payload: LoginRequest, session=Depends(get_db)):
-    user = (
-        session.query(db.User)
-        .filter(db.User.email == payload.email)
-        .first()
-    )
-    if not user or not user.verify_password(payload.password):
+async def login(payload: LoginRequest):
+    # async: проверка bcrypt ждётся в event loop, поток threadpool занят только на время запроса к БД (или не занят вовсе)
+    user = await _find_user(payload.email)
+    try:
+        password_ok = bool(user) and await password_verifier.verify_async(payload.password, user.password_hash)
+    except (HasherSaturated, FutureTimeout):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": "1"},
+        )
+    if not password_ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
     toks = _make_tokens(user.id, user.role)
@@ -661,7 +953,7 @@ def user_dialog_messages(dialog_id: int, user: db.User = Depends(get_current_use
     )
 
 
-CATEGORIES = ("IT", "AD", "HR")
+CATEGORIES = db.CATEGORIES
 
 @app.post("/user/dialogs", response_model=DialogOut, summary="Создать новое обращение (диалог) для пользователя")
 def create_dialog_endpoint(
@@ -790,6 +1082,43 @@ def admin_stats(_: db.User = Depends(admin_required), session=Depends(get_db)):
         "mean_dweltime": [362, 298, 253, 221]
     }
 
+@app.post("/admin/documents", summary="Загрузка документов в базу знаний RAG (админ)")
+def admin_ingest_documents(
+    files: List[UploadFile] = File(..., description="Текстовые файлы (UTF-8)"),
+    category: Optional[str] = Query(None, description="IT / AD / HR; по умолчанию — по имени файла"),
+    _: db.User = Depends(admin_required),
+):
+    if category is not None and category not in CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"Unknown category: {category}")
+    try:
+        result = ingest.ingest_documents(((f.filename, f.file.read()) for f in files), category=category)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Embeddings inference failed: {e}") from e
+    if _vector_store is not None:
+        _vector_store.refresh()  # в этом процессе новые чанки ищутся сразу, в остальных — через VECTOR_STORE_REFRESH_SECONDS
+    return result
+
+@app.get("/admin/auth/stats", summary="Метрики проверки паролей (админ)")
+def admin_auth_stats(_: db.User = Depends(admin_required)):
+    return password_verifier.stats.snapshot()
+
+@app.get("/admin/llm/admission", summary="Очередь к LLM (админ)")
+def admin_llm_admission(_: db.User = Depends(admin_required)):
+    return llm_admission.snapshot()
+
+@app.get("/admin/upstreams", summary="Circuit breaker и реплики сервисов моделей (админ)")
+def admin_upstreams(_: db.User = Depends(admin_required)):
+    return upstream.snapshot()
+
+@app.get("/admin/db/pool", summary="Состояние пула соединений с БД (админ)")
+def admin_db_pool(_: db.User = Depends(admin_required)):
+    return db.pool_status()
+
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    body, content_type = telemetry.render()
+    return Response(content=body, media_type=content_type)
+
 # Healthcheck (полезно для оркестраторов)
 @app.get("/health")
 def health() -> dict:
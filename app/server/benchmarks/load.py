@@ -0,0 +1,350 @@
+"""
+Нагрузочный прогон шлюза на заглушках моделей (benchmarks.stubs).
+
+Поднимает Triton- и factor-dev-заглушки, запускает шлюз (uvicorn app:app),
+направленный на них, и гоняет смесь русских запросов (queries_ru.txt) в /pipeline
+и, по желанию, /login. Отчёт: пропускная способность, p50/p95/p99 по эндпоинтам
+и веткам /pipeline (по клиентским замерам) и по стадиям (по gateway_stage_seconds
+из /metrics), вызовы заглушек. Нужна только БД (DATABASE_*) — для стадии knn.
+
+    cd app/server
+    python -m benchmarks.load --duration 60 --concurrency 16
+    python -m benchmarks.load --rate 20 --duration 60 --json run.json --baseline prev.json
+    python -m benchmarks.load --gateway http://localhost:8080 --duration 30   # уже запущенный шлюз
+    python -m benchmarks.load --triton-replicas 3 --duration 60               # балансировка по репликам
+    python -m benchmarks.load --moderation --duration 60                      # moderation-triton вместо трёх вызовов
+    python -m benchmarks.load --rerank --latency chunk_reranker=const:500     # переранжирование сверх бюджета
+
+--rate — открытая модель нагрузки: запросы стартуют по расписанию, задержка
+считается от планового времени (без coordinated omission); без --rate —
+закрытая, --concurrency клиентов подряд.
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from typing import Dict, List, Optional
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries_ru.txt")
+
+
+# --------- Процессы ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawn(stack: ExitStack, args: List[str], env: Optional[dict] = None) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, *args], cwd=SERVER_DIR, env=env)
+
+    def stop() -> None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    stack.callback(stop)
+    return proc
+
+
+def _wait_ready(url: str, proc: Optional[subprocess.Popen], timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"Process for {url} exited with code {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{url} is not ready after {timeout}s")
+
+
+def _boot(stack: ExitStack, args) -> tuple[str, List[str], str]:
+    """Заглушки + шлюз. Возвращает (gateway, triton_stubs, factors_stub)."""
+    factors_port, gateway_port = _free_port(), _free_port()
+    latency = [a for spec in args.latency for a in ("--latency", spec)]
+    tritons = []
+    for _ in range(args.triton_replicas):
+        port = _free_port()
+        tritons.append(f"http://127.0.0.1:{port}")
+        p = _spawn(stack, ["-m", "benchmarks.stubs", "triton", "--port", str(port), *latency])
+        _wait_ready(f"{tritons[-1]}/v2/health/ready", p)
+    triton = ",".join(tritons)
+    factors = f"http://127.0.0.1:{factors_port}"
+    p = _spawn(stack, ["-m", "benchmarks.stubs", "factors", "--port", str(factors_port),
+                       "--action-rate", str(args.action_rate), *latency])
+    _wait_ready(f"{factors}/health", p)
+
+    env = dict(os.environ)
+    env.update({
+        "TOXICITY_CLASSIFIER_HOST": triton,
+        "SENTINEL_CLASSIFIER_HOST": triton,
+        "RUBERT_HOST": triton,
+        "QWEN_URL": triton,
+        "FACTORS_DEV_HOST": factors,
+        "MODERATION_HOST": triton if args.moderation else "",
+        "RERANKER_HOST": triton if args.rerank else "",
+    })
+    if args.workers > 1:
+        env["PROMETHEUS_MULTIPROC_DIR"] = stack.enter_context(tempfile.TemporaryDirectory())
+    gateway = f"http://127.0.0.1:{gateway_port}"
+    p = _spawn(stack, ["-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(gateway_port),
+                       "--workers", str(args.workers), "--log-level", "warning"], env=env)
+    _wait_ready(f"{gateway}/metrics", p)
+    return gateway, tritons, factors
+
+
+# --------- Нагрузка ----------
+def _load_queries(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class _Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def add(self, label: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.latency[label].append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+
+def _one(client: httpx.Client, args, queries: List[str], rnd: random.Random, results: _Results, started: float) -> None:
+    if args.login and rnd.random() < args.login_share:
+        email, _, password = args.login.partition(":")
+        try:
+            r = client.post("/login", json={"email": email, "password": password})
+            ok = r.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        results.add("/login", time.perf_counter() - started, ok)
+        return
+
+    try:
+        r = client.get("/pipeline", params={"text": rnd.choice(queries)})
+        ok = r.status_code == 200
+        branch = r.json().get("info", "?") if ok else f"HTTP {r.status_code}"
+    except (httpx.HTTPError, ValueError):
+        ok, branch = False, "transport error"
+    elapsed = time.perf_counter() - started
+    results.add("/pipeline", elapsed, ok)
+    results.add(f"/pipeline [{branch}]", elapsed, ok)
+
+
+def _run_load(gateway: str, args, queries: List[str]) -> tuple[_Results, float]:
+    results = _Results()
+    t_start = time.perf_counter()
+    deadline = t_start + args.duration
+    slots = itertools.count()
+    slots_lock = threading.Lock()
+    workers = args.concurrency
+
+    def worker(seed: int) -> None:
+        rnd = random.Random(seed)
+        with httpx.Client(base_url=gateway, timeout=args.timeout) as client:
+            while True:
+                if args.rate:
+                    with slots_lock:
+                        planned = t_start + next(slots) / args.rate
+                    if planned >= deadline:
+                        return
+                    time.sleep(max(0.0, planned - time.perf_counter()))
+                else:
+                    planned = time.perf_counter()
+                    if planned >= deadline:
+                        return
+                _one(client, args, queries, rnd, results, planned)
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,), daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - t_start
+
+
+def _warmup(gateway: str, queries: List[str], n: int) -> None:
+    with httpx.Client(base_url=gateway, timeout=120) as client:
+        for q in queries[:n]:
+            client.get("/pipeline", params={"text": q})
+
+
+# --------- /metrics ----------
+def _scrape(gateway: str) -> dict:
+    text = httpx.get(f"{gateway}/metrics", timeout=10).text
+    out: dict = {"stage": defaultdict(dict), "upstream": {}, "retries": {}}
+    for family in text_string_to_metric_families(text):
+        for s in family.samples:
+            if s.name == "gateway_stage_seconds_bucket":
+                out["stage"][s.labels["stage"]][float(s.labels["le"])] = s.value
+            elif s.name == "gateway_stage_seconds_sum":
+                out["stage"][s.labels["stage"]]["sum"] = s.value
+            elif s.name == "gateway_upstream_requests_total":
+                out["upstream"][(s.labels["upstream"], s.labels["status"])] = s.value
+            elif s.name == "gateway_upstream_retries_total":
+                out["retries"][s.labels["upstream"]] = s.value
+    return out
+
+
+def _bucket_quantile(q: float, buckets: List[tuple[float, float]]) -> Optional[float]:
+    """Как histogram_quantile в Prometheus: линейная интерполяция внутри бакета."""
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return None
+    rank = q * total
+    prev_le, prev_count = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if le == float("inf"):
+                return prev_le
+            if count == prev_count:
+                return le
+            return prev_le + (le - prev_le) * (rank - prev_count) / (count - prev_count)
+        prev_le, prev_count = le, count
+    return prev_le
+
+
+def _stage_report(before: dict, after: dict) -> Dict[str, dict]:
+    report = {}
+    for stage, hist in after["stage"].items():
+        base = before["stage"].get(stage, {})
+        buckets = sorted((le, v - base.get(le, 0.0)) for le, v in hist.items() if le != "sum")
+        count = buckets[-1][1] if buckets else 0
+        if count <= 0:
+            continue
+        mean = (hist.get("sum", 0.0) - base.get("sum", 0.0)) / count
+        report[stage] = {
+            "count": int(count),
+            "mean_ms": mean * 1000,
+            **{f"p{int(q * 100)}_ms": _bucket_quantile(q, buckets) * 1000 for q in (0.5, 0.95, 0.99)},
+        }
+    return report
+
+
+# --------- Отчёт ----------
+def _pct(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+
+def _endpoint_report(results: _Results, elapsed: float) -> Dict[str, dict]:
+    report = {}
+    for label, values in sorted(results.latency.items()):
+        report[label] = {
+            "count": len(values),
+            "errors": results.errors.get(label, 0),
+            "rps": len(values) / elapsed,
+            "p50_ms": _pct(values, 0.50),
+            "p95_ms": _pct(values, 0.95),
+            "p99_ms": _pct(values, 0.99),
+        }
+    return report
+
+
+def _print_table(title: str, rows: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None) -> None:
+    print(f"\n{title}")
+    print(f"{'':<42} {'count':>7} {'rps':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  {'Δp95':>7}")
+    for name, r in rows.items():
+        delta = ""
+        if baseline and name in baseline and baseline[name].get("p95_ms"):
+            delta = f"{(r['p95_ms'] / baseline[name]['p95_ms'] - 1) * 100:+.0f}%"
+        rps = f"{r['rps']:.1f}" if "rps" in r else ""
+        errors = f" ({r['errors']} err)" if r.get("errors") else ""
+        print(f"{name + errors:<42} {r['count']:>7} {rps:>7} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}  {delta:>7}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gateway", default=None, help="URL запущенного шлюза (без поднятия заглушек)")
+    parser.add_argument("--duration", type=float, default=30, help="секунд нагрузки")
+    parser.add_argument("--concurrency", type=int, default=8, help="клиентских потоков")
+    parser.add_argument("--rate", type=float, default=None, help="запросов/с (открытая модель)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--workers", type=int, default=1, help="UVICORN_WORKERS шлюза")
+    parser.add_argument("--latency", action="append", default=[], help="model=dist:params, см. benchmarks.stubs")
+    parser.add_argument("--action-rate", type=float, default=0.1)
+    parser.add_argument("--moderation", action="store_true", help="модерация и эмбеддинг одним вызовом moderation")
+    parser.add_argument("--rerank", action="store_true", help="переранжирование фрагментов chunk_reranker")
+    parser.add_argument("--triton-replicas", type=int, default=1, help="сколько Triton-заглушек за шлюзом")
+    parser.add_argument("--queries", default=QUERIES)
+    parser.add_argument("--login", default=None, help="EMAIL:PASSWORD — добавить /login в смесь")
+    parser.add_argument("--login-share", type=float, default=0.05)
+    parser.add_argument("--warmup", type=int, default=5, help="запросов до начала замеров")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--json", default=None, help="сохранить отчёт")
+    parser.add_argument("--baseline", default=None, help="отчёт прошлого прогона для сравнения p95")
+    args = parser.parse_args()
+    if args.rate:
+        # в открытой модели потоки — только исполнители расписания, их должно хватать на пик
+        args.concurrency = max(args.concurrency, int(args.rate * 4))
+
+    queries = _load_queries(args.queries)
+    with ExitStack() as stack:
+        if args.gateway:
+            gateway, tritons, factors = args.gateway.rstrip("/"), [], None
+        else:
+            gateway, tritons, factors = _boot(stack, args)
+        _warmup(gateway, queries, args.warmup)
+        before = _scrape(gateway)
+        results, elapsed = _run_load(gateway, args, queries)
+        after = _scrape(gateway)
+        stub_calls = {}
+        for i, triton in enumerate(tritons):
+            prefix = f"triton{i}." if len(tritons) > 1 else ""
+            stub_calls.update({prefix + k: v for k, v in httpx.get(f"{triton}/stats").json().items()})
+        if factors:
+            stub_calls.update({f"factor-dev.{k}": v for k, v in httpx.get(f"{factors}/stats").json().items()})
+
+    report = {
+        "elapsed_s": elapsed,
+        "endpoints": _endpoint_report(results, elapsed),
+        "stages": _stage_report(before, after),
+        "upstream": {f"{u} {s}": after["upstream"][(u, s)] - before["upstream"].get((u, s), 0.0)
+                     for (u, s) in sorted(after["upstream"])},
+        "retries": {u: v - before["retries"].get(u, 0.0) for u, v in after["retries"].items()},
+        "stub_calls": stub_calls,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    mode = f"open loop {args.rate} rps" if args.rate else f"closed loop, concurrency {args.concurrency}"
+    print(f"{elapsed:.1f}s, {mode}")
+    _print_table("Endpoints (client side)", report["endpoints"], baseline and baseline.get("endpoints"))
+    _print_table("Stages (gateway_stage_seconds, bucket-interpolated)", report["stages"], baseline and baseline.get("stages"))
+    print("\nUpstream calls: " + ", ".join(f"{k}={v:.0f}" for k, v in report["upstream"].items() if v))
+    if any(report["retries"].values()):
+        print("Retries: " + ", ".join(f"{k}={v:.0f}" for k, v in report["retries"].items() if v))
+    if stub_calls:
+        print("Stub calls: " + ", ".join(f"{k}={v}" for k, v in sorted(stub_calls.items())))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Обучение и оценка каскада модерации (prefilter.ToxicityPrefilter): логистическая
+регрессия на эмбеддинге rubert-tiny2 перед xlmr_toxicity.
+
+Данные — текстовый файл: «текст<TAB>метка» (1 — токсично, 0 — нет) или просто
+текст по строке с --teacher: тогда метка — округлённый скор xlmr_toxicity
+(дистилляция на своих логах). С --teacher скоры xlmr используются и для
+эскалированных сообщений в отчёте; без него считается, что xlmr прав на всех
+эскалированных (верхняя оценка точности каскада).
+
+Отчёт на отложенной части: для сетки порогов low / high — доля эскалаций в
+xlmr, точность и полнота по токсичным всего каскада. Выбираются пороги с
+минимальной эскалацией, при которых точность и полнота не ниже, чем у одного
+xlmr, больше чем на --max-drop. Нужен rubert-tiny2-embeddings (RUBERT_HOST), для
+--teacher — xlmr_toxicity (TOXICITY_CLASSIFIER_HOST).
+
+    cd app/server
+    python -m benchmarks.prefilter --file toxic_ru.tsv --out prefilter.npz
+    python -m benchmarks.prefilter --file messages.txt --teacher --out prefilter.npz
+    python -m benchmarks.prefilter --file toxic_ru.tsv --teacher --eval prefilter.npz
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+from configs import INGEST, TOXICITY_CLASSIFIER
+from ingest import embed_batch
+from prefilter import ToxicityPrefilter
+
+LOWS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3)
+HIGHS = (0.7, 0.8, 0.9, 0.95, 0.98, 0.99, 0.995)
+
+
+def _load(path: str) -> tuple[List[str], Optional[np.ndarray]]:
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            text, sep, label = line.rpartition("\t")
+            if sep and label.strip() in ("0", "1"):
+                texts.append(text)
+                labels.append(int(label))
+            else:
+                texts.append(line)
+    if labels and len(labels) != len(texts):
+        raise SystemExit(f"{path}: метки есть не у всех строк")
+    return texts, (np.array(labels, dtype=np.int8) if labels else None)
+
+
+def _batches(texts: List[str], size: int):
+    for i in range(0, len(texts), size):
+        yield texts[i:i + size]
+
+
+def _embed_all(texts: List[str], batch_size: int) -> np.ndarray:
+    with httpx.Client(timeout=60) as client:
+        return np.concatenate([embed_batch(b, client=client) for b in _batches(texts, batch_size)])
+
+
+def _teacher_scores(texts: List[str], batch_size: int) -> np.ndarray:
+    """P_TOXIC xlmr_toxicity батчами (та же модель, что за каскадом в /pipeline)."""
+    url = f"{TOXICITY_CLASSIFIER.host}/v2/models/{TOXICITY_CLASSIFIER.model}/infer"
+    scores = []
+    with httpx.Client(timeout=TOXICITY_CLASSIFIER.timeout) as client:
+        for batch in _batches(texts, batch_size):
+            payload = {
+                "inputs": [{
+                    "name": "TEXT", "shape": [len(batch)], "datatype": "BYTES",
+                    "data": list(batch),
+                }],
+                "outputs": [{"name": "P_TOXIC"}],
+                "binary_data_output": False,
+            }
+            r = client.post(url, json=payload)
+            r.raise_for_status()
+            scores.append(np.asarray(r.json()["outputs"][0]["data"], dtype=np.float32))
+    return np.concatenate(scores)
+
+
+# --------- Обучение ----------
+def fit_logistic(x: np.ndarray, y: np.ndarray, l2: float = 1.0, iters: int = 30, balanced: bool = True) -> tuple[np.ndarray, float]:
+    """Логистическая регрессия методом Ньютона (IRLS) с L2; 312 признаков — гессиан 313x313."""
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    x = np.hstack([x / np.where(norms > 0, norms, 1.0), np.ones((len(x), 1), dtype=x.dtype)]).astype(np.float64)
+    y = y.astype(np.float64)
+    sample_w = np.ones_like(y)
+    if balanced and 0 < y.sum() < len(y):
+        pos = y.mean()
+        sample_w = np.where(y == 1, 0.5 / pos, 0.5 / (1 - pos))
+    reg = np.full(x.shape[1], l2)
+    reg[-1] = 0.0  # свободный член не штрафуем
+    theta = np.zeros(x.shape[1])
+    for _ in range(iters):
+        p = 1.0 / (1.0 + np.exp(-(x @ theta)))
+        grad = x.T @ (sample_w * (p - y)) + reg * theta
+        hess = (x * (sample_w * p * (1 - p))[:, None]).T @ x + np.diag(reg)
+        step = np.linalg.solve(hess, grad)
+        theta -= step
+        if np.abs(step).max() < 1e-6:
+            break
+    return theta[:-1].astype(np.float32), float(theta[-1])
+
+
+# --------- Оценка ----------
+def _metrics(pred: np.ndarray, y: np.ndarray) -> dict:
+    toxic = y == 1
+    return {
+        "accuracy": float((pred == y).mean()),
+        "toxic_recall": float(pred[toxic].mean()) if toxic.any() else 1.0,
+    }
+
+
+def cascade_report(p: np.ndarray, y: np.ndarray, xlmr: np.ndarray, low: float, high: float) -> dict:
+    escalate = (p >= low) & (p <= high)
+    pred = np.where(p > high, 1, 0)
+    pred[escalate] = xlmr[escalate]
+    return {"low": low, "high": high, "escalation": float(escalate.mean()), **_metrics(pred, y)}
+
+
+def _dominates(a: dict, b: dict) -> bool:
+    keys = (("escalation", -1), ("accuracy", 1), ("toxic_recall", 1))
+    return all(sign * a[k] >= sign * b[k] for k, sign in keys) and any(sign * a[k] > sign * b[k] for k, sign in keys)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", required=True)
+    parser.add_argument("--teacher", action="store_true", help="скоры xlmr_toxicity: метки для неразмеченных и отчёт")
+    parser.add_argument("--out", default="prefilter.npz", help="куда сохранить веса и выбранные пороги")
+    parser.add_argument("--eval", default=None, help="только оценить готовый .npz на всём файле")
+    parser.add_argument("--test-share", type=float, default=0.3)
+    parser.add_argument("--l2", type=float, default=1.0)
+    parser.add_argument("--max-drop", type=float, default=0.005, help="допустимая потеря точности/полноты против xlmr")
+    parser.add_argument("--batch-size", type=int, default=INGEST.batch_size)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--json", default=None, help="сохранить отчёт")
+    args = parser.parse_args()
+
+    texts, labels = _load(args.file)
+    if labels is None and not args.teacher:
+        raise SystemExit("Нет меток: добавьте «<TAB>0/1» к строкам или запустите с --teacher")
+    t0 = time.perf_counter()
+    x = _embed_all(texts, args.batch_size)
+    print(f"{len(texts)} texts embedded in {time.perf_counter() - t0:.1f}s")
+    teacher = _teacher_scores(texts, args.batch_size) if args.teacher else None
+    y = labels if labels is not None else (teacher >= 0.5).astype(np.int8)
+
+    idx = list(range(len(texts)))
+    if args.eval:
+        model = ToxicityPrefilter.load(args.eval)
+        test = np.array(idx)
+    else:
+        random.Random(args.seed).shuffle(idx)
+        n_test = max(1, int(len(idx) * args.test_share))
+        test, train = np.array(idx[:n_test]), np.array(idx[n_test:])
+        if len(set(y[train].tolist())) < 2:
+            raise SystemExit("В обучающей части только один класс")
+        weights, bias = fit_logistic(x[train], y[train], l2=args.l2)
+        model = ToxicityPrefilter(weights, bias, low=0.0, high=1.0)
+
+    y_test = y[test]
+    xlmr_test = (teacher[test] >= 0.5).astype(np.int8) if teacher is not None else y_test
+    t0 = time.perf_counter()
+    p = model.score(x[test])
+    score_us = (time.perf_counter() - t0) / len(test) * 1e6
+    reference = _metrics(xlmr_test, y_test)
+    prefilter_only = _metrics((p >= 0.5).astype(np.int8), y_test)
+
+    grid = [(model.low, model.high)] if args.eval else [(lo, hi) for lo in LOWS for hi in HIGHS]
+    rows = [cascade_report(p, y_test, xlmr_test, lo, hi) for lo, hi in grid]
+    ok = [r for r in rows
+          if r["accuracy"] >= reference["accuracy"] - args.max_drop
+          and r["toxic_recall"] >= reference["toxic_recall"] - args.max_drop]
+    chosen = min(ok, key=lambda r: (r["escalation"], -r["accuracy"])) if ok else max(rows, key=lambda r: r["accuracy"])
+
+    print(f"test: {len(test)} texts, {int(y_test.sum())} toxic; prefilter score {score_us:.1f} us/text")
+    print(f"xlmr only:      escalation 1.000  accuracy {reference['accuracy']:.4f}  toxic recall {reference['toxic_recall']:.4f}"
+          + ("" if teacher is not None else "  (xlmr = разметка, без --teacher)"))
+    print(f"prefilter only: escalation 0.000  accuracy {prefilter_only['accuracy']:.4f}  "
+          f"toxic recall {prefilter_only['toxic_recall']:.4f}")
+    # в таблице только парето-фронт: меньше эскалаций ценой точности или полноты
+    front, seen = [], set()
+    for r in rows:
+        key = (r["escalation"], r["accuracy"], r["toxic_recall"])
+        if r is chosen or (key not in seen and not any(_dominates(o, r) for o in rows)):
+            front.append(r)
+            seen.add(key)
+    print(f"\n{'low':>7} {'high':>7} {'escalate':>9} {'accuracy':>9} {'recall':>8}")
+    for r in sorted(front, key=lambda r: r["escalation"]):
+        mark = "  <- chosen" if r is chosen else ""
+        print(f"{r['low']:>7.3f} {r['high']:>7.3f} {r['escalation']:>9.3f} {r['accuracy']:>9.4f} "
+              f"{r['toxic_recall']:>8.4f}{mark}")
+
+    if not args.eval:
+        model.low, model.high = chosen["low"], chosen["high"]
+        model.save(args.out)
+        print(f"\nsaved {args.out}: low={model.low} high={model.high} "
+              f"(TOXICITY_PREFILTER_PATH, пороги переопределяются TOXICITY_PREFILTER_LOW / _HIGH)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"reference": reference, "prefilter_only": prefilter_only, "chosen": chosen, "grid": rows,
+                       "score_us_per_text": score_us}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Сравнение векторного (knn_search) и гибридного (hybrid_search) поиска.
+
+Запросы берутся из самих FAQ-чанков: «N) Вопрос? — Ответ» -> запрос «Вопрос?»,
+релевантны чанки с этим вопросом. Свой набор — --file, TSV «запрос<TAB>подстрока
+релевантного чанка» (коды форм, названия систем и т.п.). Считаются hit-rate@k,
+MRR и латентность запроса к БД. Нужны БД и rubert-tiny2-embeddings (DATABASE_*, RUBERT_HOST).
+
+    cd app/server
+    python -m benchmarks.retrieval --queries 200 --k 5
+    python -m benchmarks.retrieval --file it_queries.tsv
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import text
+
+import database.baseclasses as db
+from ingest import embed_batch
+
+_QUESTION = re.compile(r"^\s*\d+\)\s*(?P<q>[^\n]*?\?)\s*—")
+
+
+def _load_eval_set(n: int, seed: int) -> List[Dict]:
+    with db.SessionLocal() as session:
+        rows = session.execute(text("SELECT id, data FROM chunks ORDER BY id")).all()
+    # один и тот же вопрос встречается в нескольких документах — релевантны все такие чанки
+    relevant: Dict[str, set] = {}
+    for chunk_id, data in rows:
+        m = _QUESTION.match(data or "")
+        if m:
+            relevant.setdefault(m.group("q"), set()).add(chunk_id)
+    items = [{"query": q, "relevant": ids} for q, ids in sorted(relevant.items())]
+    random.Random(seed).shuffle(items)
+    return items[:n]
+
+
+def _load_file(path: str) -> List[Dict]:
+    items = []
+    with db.SessionLocal() as session, open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or "\t" not in line:
+                continue
+            query, needle = line.rstrip("\n").split("\t", 1)
+            ids = session.execute(
+                text("SELECT id FROM chunks WHERE strpos(lower(data), lower(:needle)) > 0"), {"needle": needle}
+            ).scalars().all()
+            items.append({"query": query, "relevant": set(ids)})
+    return items
+
+
+def _run(name: str, search: Callable[[Dict], List[Dict]], items: List[Dict], k: int) -> Dict:
+    lat_ms, hits, rr = [], 0, 0.0
+    for it in items:
+        t0 = time.perf_counter()
+        found = [r["id"] for r in search(it)][:k]
+        lat_ms.append((time.perf_counter() - t0) * 1000)
+        ranks = [i for i, chunk_id in enumerate(found) if chunk_id in it["relevant"]]
+        if ranks:
+            hits += 1
+            rr += 1.0 / (ranks[0] + 1)
+    lat_ms.sort()
+    return {
+        "name": name,
+        f"hit@{k}": hits / len(items),
+        "mrr": rr / len(items),
+        "p50_ms": statistics.median(lat_ms),
+        "p95_ms": lat_ms[min(len(lat_ms) - 1, int(0.95 * len(lat_ms)))],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--file", default=None, help="TSV: запрос<TAB>подстрока релевантного чанка")
+    args = parser.parse_args()
+
+    items = _load_file(args.file) if args.file else _load_eval_set(args.queries, args.seed)
+    if not items:
+        raise SystemExit("No FAQ-style chunks found to build queries from")
+    vecs = embed_batch([it["query"] for it in items])
+    for it, vec in zip(items, vecs):
+        it["embedding"] = vec.tolist()
+
+    # прогрев соединения и кэша страниц
+    db.knn_search(items[0]["embedding"], k=args.k)
+    db.hybrid_search(items[0]["embedding"], items[0]["query"], k=args.k)
+
+    results = [
+        _run("vector", lambda it: db.knn_search(it["embedding"], k=args.k), items, args.k),
+        _run("hybrid", lambda it: db.hybrid_search(it["embedding"], it["query"], k=args.k), items, args.k),
+    ]
+    print(f"{len(items)} queries, k={args.k}")
+    print(f"{'retriever':<10} {'hit@' + str(args.k):>8} {'mrr':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for r in results:
+        print(f"{r['name']:<10} {r[f'hit@{args.k}']:>8.3f} {r['mrr']:>7.3f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
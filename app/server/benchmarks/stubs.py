@@ -0,0 +1,250 @@
+"""
+Заглушки Triton (KServe v2) и factor-dev для нагрузочных прогонов без моделей.
+
+Triton-заглушка отвечает на /v2/health/ready, /v2/models/{name} и
+/v2/models/{name}/infer для xlmr_toxicity, prompt_injection_sentinel,
+rubert_tiny2_embeddings, qwen_cpu, chunk_reranker и moderation (P_TOXIC + P_ATTACK +
+EMBEDDINGS из запрошенных outputs, как BLS moderation-triton); задержка каждой модели берётся из
+распределения (--latency model=dist:params, миллисекунды):
+
+    const:5            всегда 5 мс
+    uniform:5:15       равномерно от 5 до 15 мс
+    lognormal:40:120   логнормальное с медианой 40 мс и p95 120 мс
+
+Токсичность / jailbreak определяются по словарю маркеров, эмбеддинг —
+детерминированный псевдослучайный вектор от текста, релевантность фрагмента —
+доля слов вопроса в нём, factor-dev выбирает
+action_item и категорию по хэшу эмбеддинга. /stats — счётчики вызовов.
+
+    cd app/server
+    python -m benchmarks.stubs triton --port 18000 --latency qwen_cpu=lognormal:800:2000
+    python -m benchmarks.stubs factors --port 18081 --action-rate 0.1
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+from collections import Counter
+from typing import Any, Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+EMBEDDING_DIM = 312
+
+TOXIC_MARKERS = ("идиот", "дурак", "тупой", "тупая", "заткнись", "урод")
+ATTACK_MARKERS = ("игнорируй", "забудь все инструкции", "системный промпт", "ignore previous", "режим разработчика")
+
+DEFAULT_LATENCY = {
+    "xlmr_toxicity": "lognormal:40:120",
+    "prompt_injection_sentinel": "lognormal:30:90",
+    "rubert_tiny2_embeddings": "lognormal:8:20",
+    "qwen_cpu": "lognormal:800:2000",
+    # кросс-энкодер на 50 кандидатах
+    "chunk_reranker": "lognormal:120:300",
+    # подмодели идут параллельно: примерно самая медленная из xlmr / sentinel
+    "moderation": "lognormal:45:130",
+    "factor-dev": "lognormal:3:8",
+}
+
+
+class Latency:
+    """Распределение задержки в миллисекундах, см. формат в описании модуля."""
+
+    def __init__(self, spec: str):
+        kind, *params = spec.split(":")
+        values = [float(p) for p in params]
+        if kind == "const" and len(values) == 1:
+            self._sample = lambda: values[0]
+        elif kind == "uniform" and len(values) == 2:
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == "lognormal" and len(values) == 2:
+            median, p95 = values
+            mu = math.log(median)
+            sigma = max(0.0, math.log(p95 / median) / 1.645)
+            self._sample = lambda: random.lognormvariate(mu, sigma)
+        else:
+            raise ValueError(f"Bad latency spec: {spec!r}")
+        self.spec = spec
+
+    def sample(self) -> float:
+        return max(0.0, self._sample()) / 1000.0
+
+
+def parse_latencies(specs: List[str]) -> Dict[str, Latency]:
+    merged = dict(DEFAULT_LATENCY)
+    for item in specs or []:
+        name, _, spec = item.partition("=")
+        merged[name] = spec
+    return {name: Latency(spec) for name, spec in merged.items()}
+
+
+def _text(value: Any) -> str:
+    # BYTES в JSON-протоколе — строки как есть, как у Triton; не-строку (число, объект) приводим к str
+    return value if isinstance(value, str) else str(value)
+
+
+def _score(text: str, markers: tuple) -> float:
+    low = text.lower()
+    return 0.97 if any(m in low for m in markers) else 0.03
+
+
+def _embedding(text: str) -> List[float]:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vec = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def _relevance(query: str, texts: List[str]) -> List[float]:
+    words = set(query.lower().split())
+    return [len(words & set(t.lower().split())) / max(1, len(words)) for t in texts]
+
+
+def _answer(text: str, thinking: bool = True) -> str:
+    answer = "Ответ по контексту: обратитесь в сервис-деск, приложив номер заявки."
+    return f"<think>\nЗаглушка рассуждений.\n</think>\n\n{answer}" if thinking else answer
+
+
+_OUTPUTS = {
+    "P_TOXIC": ("FP32", lambda t: _score(t, TOXIC_MARKERS)),
+    "P_ATTACK": ("FP32", lambda t: _score(t, ATTACK_MARKERS)),
+    "EMBEDDINGS": ("FP32", _embedding),
+    "OUTPUT_TEXT": ("BYTES", _answer),
+    "SCORES": ("FP32", None),
+}
+
+_MODELS = {
+    "xlmr_toxicity": ["P_TOXIC"],
+    "prompt_injection_sentinel": ["P_ATTACK"],
+    "rubert_tiny2_embeddings": ["EMBEDDINGS"],
+    "qwen_cpu": ["OUTPUT_TEXT"],
+    "chunk_reranker": ["SCORES"],
+    "moderation": ["P_TOXIC", "P_ATTACK", "EMBEDDINGS"],
+}
+
+
+def _output(name: str, texts: List[str], params: dict, query: str = "") -> dict:
+    dtype, fn = _OUTPUTS[name]
+    if name == "SCORES":
+        results = _relevance(query, texts)
+    elif name == "OUTPUT_TEXT":
+        # как qwen_cpu: без GEN_PARAMS — с рассуждениями (так отвечал бэкенд до GEN_PARAMS)
+        results = [_answer(t, params.get("thinking", True)) for t in texts]
+    else:
+        results = [fn(t) for t in texts]
+    if name == "EMBEDDINGS":
+        shape, data = [len(texts), EMBEDDING_DIM], [x for vec in results for x in vec]
+    else:
+        shape, data = [len(texts)], results
+    return {"name": name, "datatype": dtype, "shape": shape, "data": data}
+
+
+def build_triton_app(latencies: Dict[str, Latency]) -> FastAPI:
+    app = FastAPI(title="Triton stub")
+    stats: Counter = Counter()
+
+    @app.get("/v2/health/ready")
+    async def ready() -> dict:
+        return {}
+
+    @app.get("/v2/models/{name}")
+    async def metadata(name: str) -> dict:
+        if name not in _MODELS:
+            raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+        return {
+            "name": name,
+            "versions": ["1"],
+            "platform": "python",
+            "inputs": [{"name": "TEXT", "datatype": "BYTES", "shape": [-1]}],
+            "outputs": [
+                {"name": out, "datatype": _OUTPUTS[out][0], "shape": [-1, EMBEDDING_DIM] if out == "EMBEDDINGS" else [-1]}
+                for out in _MODELS[name]
+            ],
+        }
+
+    @app.post("/v2/models/{name}/infer")
+    async def infer(name: str, request: Request) -> dict:
+        if name not in _MODELS:
+            raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+        body = await request.json()
+        inputs = {i["name"]: i for i in body["inputs"]}
+        if "INPUT_IDS" in inputs:
+            # токены от шлюза: по строке на элемент батча (скор заглушки от них не зависит)
+            ids = inputs["INPUT_IDS"]
+            width = ids["shape"][-1]
+            texts = [" ".join(map(str, ids["data"][i:i + width])) for i in range(0, len(ids["data"]), width)]
+            stats[f"{name}.pretokenized"] += len(texts)
+        else:
+            texts = [_text(x) for x in (inputs.get("TEXT") or body["inputs"][0])["data"]]
+        params = json.loads(_text(inputs["GEN_PARAMS"]["data"][0])) if "GEN_PARAMS" in inputs else {}
+        if params:
+            stats[f"{name}.gen_params"] += 1
+        query = _text(inputs["QUERY"]["data"][0]) if "QUERY" in inputs else ""
+        stats[f"{name}.requests"] += 1
+        stats[f"{name}.items"] += len(texts)
+        await asyncio.sleep(latencies[name].sample())
+
+        # как Triton: без "outputs" в запросе — все выходы модели
+        wanted = [o["name"] for o in body.get("outputs") or []] or _MODELS[name]
+        unknown = set(wanted) - set(_MODELS[name])
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown outputs for {name}: {sorted(unknown)}")
+        return {"model_name": name, "outputs": [_output(out, texts, params, query) for out in wanted]}
+
+    @app.get("/stats")
+    async def get_stats() -> dict:
+        return dict(stats)
+
+    return app
+
+
+def build_factors_app(latency: Latency, action_rate: float) -> FastAPI:
+    app = FastAPI(title="factor-dev stub")
+    stats: Counter = Counter()
+    categories = ("IT", "AD", "HR")
+
+    @app.get("/health")
+    async def health() -> dict:
+        return {"status": "ok"}
+
+    @app.post("/infer")
+    async def infer(request: Request) -> List[str]:
+        body = await request.json()
+        stats["requests"] += 1
+        await asyncio.sleep(latency.sample())
+        digest = hashlib.blake2b(np.asarray(body["embedding"], dtype=np.float32).tobytes(), digest_size=8).digest()
+        h = int.from_bytes(digest, "little")
+        action = "1" if (h % 10_000) / 10_000 < action_rate else "0"
+        return [action, categories[(h >> 16) % len(categories)]]
+
+    @app.get("/stats")
+    async def get_stats() -> dict:
+        return dict(stats)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=("triton", "factors"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency", action="append", default=[], help="model=dist:params, можно несколько раз")
+    parser.add_argument("--action-rate", type=float, default=0.1, help="доля action_item у factor-dev")
+    args = parser.parse_args()
+
+    latencies = parse_latencies(args.latency)
+    if args.kind == "triton":
+        app = build_triton_app(latencies)
+    else:
+        app = build_factors_app(latencies["factor-dev"], args.action_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Сжатый индекс чанков (vectorstore.py): память на миллион чанков и recall@k
+против точного L2-поиска по полным эмбеддингам, с точным пересчётом
+кандидатов (shortlist) и без него.
+
+Векторы — chunks.embedding из БД (DATABASE_*) или --synthetic N: смесь
+анизотропных кластеров на сфере размерности эмбеддинга rubert-tiny2 — для
+корпуса больше загруженного. Запросы — случайные векторы корпуса с шумом
+(--noise, доля нормы), эталон — их точный top-k по всему корпусу. Полные
+векторы для пересчёта берутся из памяти: латентность — без запроса к БД за
+shortlist (в шлюзе это один SELECT по первичному ключу).
+
+    cd app/server
+    python -m benchmarks.vectorstore
+    python -m benchmarks.vectorstore --synthetic 200000 --pca 32,64,128 --pq 12x8,24x8,52x8 --json vs.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from vectorstore import CompressedIndex, PCACodec, PQCodec, _iter_chunks
+
+EMBEDDING_DIM = 312
+MILLION = 1_000_000
+_ROW_BYTES = 8 + 1  # id int64 + категория int8 на чанк сверх кода
+
+
+def _synthetic(n: int, dim: int, seed: int, clusters: int = 256) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(np.arange(1, dim + 1))  # убывающий спектр, как у настоящих эмбеддингов
+    centers = rng.standard_normal((clusters, dim)) * scale
+    x = centers[rng.integers(clusters, size=n)] + 0.5 * rng.standard_normal((n, dim)) * scale
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _from_db() -> np.ndarray:
+    batches = [b[2] for b in _iter_chunks()]
+    if not batches:
+        raise SystemExit("No chunks in the database: ingest documents or use --synthetic N")
+    return np.concatenate(batches)
+
+
+def _queries(x: np.ndarray, n: int, noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    base = x[rng.choice(len(x), size=min(n, len(x)), replace=False)]
+    norms = np.linalg.norm(base, axis=1, keepdims=True)
+    q = base + noise * norms * rng.standard_normal(base.shape) / np.sqrt(x.shape[1])
+    return q.astype(np.float32)
+
+
+def _exact_topk(x: np.ndarray, queries: np.ndarray, k: int) -> Tuple[np.ndarray, List[float]]:
+    """L2² до k-го соседа каждого запроса и латентность точного поиска."""
+    full = x.astype(np.float64)
+    sq = (full * full).sum(1)
+    kth, lat_ms = [], []
+    for q in queries.astype(np.float64):
+        t0 = time.perf_counter()
+        d = sq - 2.0 * full @ q + q @ q
+        kth.append(np.partition(d, k - 1)[k - 1])
+        lat_ms.append((time.perf_counter() - t0) * 1000)
+    return np.asarray(kth), lat_ms
+
+
+def _recall(found: List[np.ndarray], x: np.ndarray, queries: np.ndarray, kth: np.ndarray, k: int) -> float:
+    # найденный чанк верен, если он не дальше k-го точного соседа: одинаковые чанки (повторы FAQ) — равноправны
+    hits = []
+    for f, q, limit in zip(found, queries.astype(np.float64), kth):
+        d = ((x[f[:k]].astype(np.float64) - q) ** 2).sum(1)
+        hits.append(int((d <= limit * (1 + 1e-9) + 1e-12).sum()) / k)
+    return statistics.mean(hits)
+
+
+def _measure(search: Callable[[np.ndarray], np.ndarray], queries: np.ndarray) -> Tuple[List[np.ndarray], float]:
+    found, lat_ms = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        found.append(np.asarray(search(q)))
+        lat_ms.append((time.perf_counter() - t0) * 1000)
+    return found, statistics.median(lat_ms)
+
+
+def _evaluate(name: str, codec, train_s: float, x: np.ndarray, queries: np.ndarray, kth: np.ndarray,
+              k: int, shortlist: int) -> Dict:
+    rows = np.arange(len(x), dtype=np.int64)
+    index = CompressedIndex(codec, lambda ids: (ids, x[ids]))
+    t0 = time.perf_counter()
+    index.add(rows, np.full(len(x), -1, dtype=np.int8), x)
+    encode_s = time.perf_counter() - t0
+    plain, plain_ms = _measure(lambda q: index.shortlist(q, k), queries)
+    reranked, rerank_ms = _measure(lambda q: [i for i, _ in index.search(q, k, shortlist)], queries)
+    return {
+        "name": name,
+        "bytes_per_chunk": codec.code_bytes + _ROW_BYTES,
+        "mib_per_million": (codec.code_bytes + _ROW_BYTES) * MILLION / 2**20,
+        "index_mib": index.nbytes / 2**20,
+        "train_s": train_s,
+        "encode_s": encode_s,
+        f"recall@{k}": _recall(plain, x, queries, kth, k),
+        f"recall@{k}_rerank": _recall(reranked, x, queries, kth, k),
+        "p50_ms": plain_ms,
+        "p50_ms_rerank": rerank_ms,
+    }
+
+
+def _pq_spec(spec: str) -> Tuple[int, int]:
+    m, _, bits = spec.partition("x")
+    return int(m), int(bits or 8)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0, help="N синтетических векторов вместо chunks.embedding")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.3, help="шум запроса относительно нормы вектора")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--shortlist", type=int, default=50, help="VECTOR_STORE_SHORTLIST")
+    parser.add_argument("--pca", default="32,64,128", help="VECTOR_STORE_PCA_DIM через запятую")
+    parser.add_argument("--pq", default="12x8,24x8,52x8", help="SUBSPACESxBITS через запятую")
+    parser.add_argument("--train-size", type=int, default=20000, help="VECTOR_STORE_TRAIN_SIZE")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--json", default=None, help="сохранить отчёт")
+    args = parser.parse_args()
+
+    x = _synthetic(args.synthetic, EMBEDDING_DIM, args.seed) if args.synthetic else _from_db()
+    queries = _queries(x, args.queries, args.noise, args.seed)
+    kth, exact_ms = _exact_topk(x, queries, args.k)
+    rng = np.random.default_rng(args.seed)
+    train = x[rng.choice(len(x), size=min(args.train_size, len(x)), replace=False)]
+
+    k = args.k
+    full_bytes = x.shape[1] * 8 + _ROW_BYTES  # chunks.embedding: double precision[]
+    results = [{
+        "name": "float64 exact", "bytes_per_chunk": full_bytes, "mib_per_million": full_bytes * MILLION / 2**20,
+        "index_mib": (x.shape[1] * 8 + _ROW_BYTES) * len(x) / 2**20, "train_s": 0.0, "encode_s": 0.0,
+        f"recall@{k}": 1.0, f"recall@{k}_rerank": 1.0, "p50_ms": statistics.median(exact_ms),
+        "p50_ms_rerank": statistics.median(exact_ms),
+    }]
+    specs = [(f"pca{d} f16", lambda d=d: PCACodec.fit(train, d)) for d in map(int, filter(None, args.pca.split(",")))]
+    specs += [(f"pq{m}x{bits}", lambda m=m, bits=bits: PQCodec.fit(train, m, bits, seed=args.seed))
+              for m, bits in map(_pq_spec, filter(None, args.pq.split(",")))]
+    for name, fit in specs:
+        t0 = time.perf_counter()
+        codec = fit()
+        results.append(_evaluate(name, codec, time.perf_counter() - t0, x, queries, kth, k, args.shortlist))
+
+    print(f"{len(x)} chunks x {x.shape[1]} dims ({'synthetic' if args.synthetic else 'chunks.embedding'}), "
+          f"{len(queries)} queries, noise {args.noise}, k={k}, shortlist={args.shortlist}")
+    print(f"{'index':<14} {'B/chunk':>8} {'MiB/1M':>8} {'train s':>8} {'recall@' + str(k):>9} {'+rerank':>8} "
+          f"{'p50 ms':>8} {'+rerank':>8}")
+    for r in results:
+        print(f"{r['name']:<14} {r['bytes_per_chunk']:>8} {r['mib_per_million']:>8.1f} {r['train_s']:>8.2f} "
+              f"{r[f'recall@{k}']:>9.3f} {r[f'recall@{k}_rerank']:>8.3f} {r['p50_ms']:>8.2f} {r['p50_ms_rerank']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"chunks": len(x), "dim": x.shape[1], "synthetic": bool(args.synthetic), "noise": args.noise,
+                       "k": k, "shortlist": args.shortlist, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
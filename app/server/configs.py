@@ -1,22 +1,116 @@
 import os
 
+def _hosts(env: str, default: str) -> list:
+    """Реплики сервиса: один URL или несколько через запятую."""
+    return [h.strip().rstrip("/") for h in os.getenv(env, default).split(",") if h.strip()]
+
 class ToxicityClassifier:
-    host = os.getenv("TOXICITY_CLASSIFIER_HOST", "http://localhost:8000")
+    hosts = _hosts("TOXICITY_CLASSIFIER_HOST", "http://localhost:8000")
+    host = hosts[0]
     model = os.getenv("TOXICITY_CLASSIFIER_MODEL", "xlmr_toxicity")
     timeout = float(os.getenv("TOXICITY_CLASSIFIER_TIMEOUT", "30"))
     
 TOXICITY_CLASSIFIER = ToxicityClassifier()
 
+class SentinelClassifier:
+    hosts = _hosts("SENTINEL_CLASSIFIER_HOST", "http://localhost:8000")
+    host = hosts[0]
+    model = os.getenv("SENTINEL_CLASSIFIER_MODEL", "prompt_injection_sentinel")
+    timeout = float(os.getenv("SENTINEL_CLASSIFIER_TIMEOUT", "30"))
+    
+SENTINEL_CLASSIFIER = SentinelClassifier()
+
+class Moderation:
+    # moderation-triton: P_TOXIC + P_ATTACK (+ EMBEDDINGS) одним запросом; без хоста — отдельные сервисы
+    hosts = _hosts("MODERATION_HOST", "")
+    model = os.getenv("MODERATION_MODEL", "moderation")
+    timeout = float(os.getenv("MODERATION_TIMEOUT", "30"))
+    embeddings = os.getenv("MODERATION_EMBEDDINGS", "true").lower() == "true"
+    
+MODERATION = Moderation()
+
+class Prefilter:
+    # каскад перед xlmr_toxicity: логистическая регрессия на эмбеддинге rubert (python -m benchmarks.prefilter)
+    path = os.getenv("TOXICITY_PREFILTER_PATH", "")
+    # пороги уверенности; без переменных — подобранные при обучении и сохранённые в файле
+    low = float(os.environ["TOXICITY_PREFILTER_LOW"]) if os.getenv("TOXICITY_PREFILTER_LOW") else None
+    high = float(os.environ["TOXICITY_PREFILTER_HIGH"]) if os.getenv("TOXICITY_PREFILTER_HIGH") else None
+    
+PREFILTER = Prefilter()
+
+class GatewayTokenizer:
+    # токенизация на шлюзе: tokenizer.json, каталог с ним или id в hub; пусто — модели токенизируют TEXT сами
+    source = os.getenv("GATEWAY_TOKENIZER", "")
+    max_length = int(os.getenv("GATEWAY_TOKENIZER_MAX_LENGTH", "512"))
+    # кому вместо TEXT отправлять INPUT_IDS/ATTENTION_MASK: у этих моделей должен быть тот же токенизатор, что в source.
+    # sentinel — только если сверили его tokenizer.json с xlmr: иначе классификатор jailbreak получит чужие id
+    models = [m.strip() for m in os.getenv("GATEWAY_TOKENIZER_MODELS", "xlmr_toxicity").split(",") if m.strip()]
+    
+GATEWAY_TOKENIZER = GatewayTokenizer()
+
 class RubertEmbedder:
-    host = os.getenv("RUBERT_HOST", "http://localhost:8000")
+    hosts = _hosts("RUBERT_HOST", "http://localhost:8000")
+    host = hosts[0]
     model = os.getenv("RUBERT_MODEL", "rubert_tiny2_embeddings")
     timeout = float(os.getenv("RUBERT_TIMEOUT", "30"))
     normalize = os.getenv("RUBERT_NORMALIZE", "true").lower() == "true"
+    generation_refresh = float(os.getenv("RUBERT_GENERATION_REFRESH", "5"))  # сек между чтениями embedding_generations
     
 RUBERT_EMBEDDER = RubertEmbedder()
 
+class Ingest:
+    chunk_size = int(os.getenv("INGEST_CHUNK_SIZE", "800"))      # символов в чанке
+    chunk_overlap = int(os.getenv("INGEST_CHUNK_OVERLAP", "150"))  # перекрытие соседних чанков
+    batch_size = int(os.getenv("INGEST_BATCH_SIZE", "64"))        # текстов в одном запросе к rubert
+    
+INGEST = Ingest()
+
+class Retrieval:
+    mode = os.getenv("RETRIEVAL_MODE", "hybrid").lower()        # vector | hybrid
+    top_k = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+    candidates = int(os.getenv("RETRIEVAL_CANDIDATES", "50"))   # top-k каждого ретривера до слияния
+    rrf_k = int(os.getenv("RETRIEVAL_RRF_K", "60"))             # константа reciprocal rank fusion
+    
+RETRIEVAL = Retrieval()
+
+class VectorStore:
+    # сжатый индекс chunks.embedding в памяти шлюза (vectorstore.py) для RETRIEVAL_MODE=vector: pca | pq; пусто — SQL
+    kind = os.getenv("VECTOR_STORE", "").lower()
+    path = os.getenv("VECTOR_STORE_PATH", "")                            # обученный кодек .npz; пусто — обучить при старте
+    pca_dim = int(os.getenv("VECTOR_STORE_PCA_DIM", "64"))              # компонент PCA, float16
+    pq_subspaces = int(os.getenv("VECTOR_STORE_PQ_SUBSPACES", "24"))    # байт кода PQ на чанк
+    pq_bits = int(os.getenv("VECTOR_STORE_PQ_BITS", "8"))               # центроидов в подпространстве: 2**bits
+    shortlist = int(os.getenv("VECTOR_STORE_SHORTLIST", "50"))          # кандидатов на точный пересчёт L2
+    train_size = int(os.getenv("VECTOR_STORE_TRAIN_SIZE", "20000"))     # векторов для обучения кодека
+    refresh_seconds = float(os.getenv("VECTOR_STORE_REFRESH_SECONDS", "60"))  # дописывать новые чанки; 0 — нет
+    
+VECTOR_STORE = VectorStore()
+
+class Context:
+    # контекст LLM в токенах Qwen (context.py): tokenizer.json qwen (файл, каталог из model-cache или id в hub);
+    # им же считается chunks.token_count при загрузке. Пусто — токены чанков без token_count оцениваются по символам
+    tokenizer = os.getenv("CONTEXT_TOKENIZER", "")
+    max_tokens = int(os.getenv("CONTEXT_MAX_TOKENS", "1024"))           # бюджет фрагментов в промпте
+    candidates = int(os.getenv("CONTEXT_CANDIDATES", "8"))              # сколько чанков из поиска рассматривать
+    dedup_threshold = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))  # доля общих шинглов у почти-дубликатов
+    chars_per_token = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "2.5"))  # оценка без токенизатора (кириллица)
+    
+CONTEXT = Context()
+
+class Reranker:
+    # кросс-энкодер reranker-triton (rerank.py): пусто — фрагменты идут в контекст в порядке поиска
+    hosts = _hosts("RERANKER_HOST", "")
+    model = os.getenv("RERANKER_MODEL", "chunk_reranker")
+    candidates = int(os.getenv("RERANKER_CANDIDATES", "50"))  # сколько чанков из поиска переоценивать
+    top_n = int(os.getenv("RERANKER_TOP_N", "3"))             # сколько лучших передавать в pack_context
+    budget = float(os.getenv("RERANKER_BUDGET", "0.3"))       # секунд на переранжирование, дальше — порядок поиска
+    workers = int(os.getenv("RERANKER_WORKERS", "16"))
+    
+RERANKER = Reranker()
+
 class FactorsDev:
-    host = os.getenv("FACTORS_DEV_HOST", "http://localhost:8081")
+    hosts = _hosts("FACTORS_DEV_HOST", "http://localhost:8081")
+    host = hosts[0]
     timeout = float(os.getenv("FACTORS_DEV_TIMEOUT", "15"))
     
 FACTORS_DEV = FactorsDev()
@@ -31,9 +125,25 @@ class DataBase:
     password = os.getenv("DATABASE_PASSWORD", "1231234")
     host = os.getenv("DATABASE_HOST", "localhost:5432")
     name = os.getenv("DATABASE_NAME", "ai_atom")
+    # Пул на один процесс uvicorn: суммарно workers * (pool_size + max_overflow) < max_connections
+    pool_size = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+    max_overflow = int(os.getenv("DATABASE_MAX_OVERFLOW", "5"))
+    pool_timeout = float(os.getenv("DATABASE_POOL_TIMEOUT", "10"))
+    pool_recycle = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+    # pre-ping — лишний round trip на каждый checkout, зато соединения, оборванные рестартом или failover
+    # Postgres, не доходят до запросов; выключать — только если pool_recycle их и так закрывает
+    pool_pre_ping = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() == "true"
+    statement_cache_size = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "500"))
+    use_async = os.getenv("DATABASE_ASYNC", "false").lower() == "true"
     
     def url(self):
         return f"postgresql+psycopg2://{self.user}:{self.password}@{self.host}/{self.name}"
+
+    def async_url(self):
+        return (
+            f"postgresql+asyncpg://{self.user}:{self.password}@{self.host}/{self.name}"
+            f"?prepared_statement_cache_size={self.statement_cache_size}"
+        )
     
 DATABASE = DataBase()
 
@@ -44,10 +154,62 @@ class JWT:
     
 JWT_c = JWT()
 
+class PasswordHashing:
+    workers = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+    max_queue = int(os.getenv("AUTH_HASH_MAX_QUEUE", "16"))  # сверх workers, дальше — 503
+    timeout = float(os.getenv("AUTH_HASH_TIMEOUT", "10"))
+    
+AUTH_HASHING = PasswordHashing()
+
 class Qwen:
-    host = os.getenv("QWEN_URL", "http://localhost:8000")
+    hosts = _hosts("QWEN_URL", "http://localhost:8000")
+    host = hosts[0]
     model = os.getenv("QWEN_MODEL", "qwen_cpu")
     timeout = int(os.getenv("QWEN_TIMEOUT", "600"))  # генерация на CPU может быть долгой
+    # GEN_PARAMS запроса к qwen_cpu; пустые — умолчания бэкенда (MAX_NEW_TOKENS, TEMPERATURE)
+    max_new_tokens = int(os.getenv("QWEN_MAX_NEW_TOKENS", "0"))
+    temperature = float(os.environ["QWEN_TEMPERATURE"]) if os.getenv("QWEN_TEMPERATURE") else None
+    stop = [s for s in os.getenv("QWEN_STOP", "").split("|") if s]  # стоп-строки через |
+    thinking = os.getenv("QWEN_THINKING", "false").lower() == "true"  # рассуждения Qwen3 до ответа
+    
+    
+QWEN = Qwen()
+
+class LLMAdmission:
+    # на процесс uvicorn; ждущие занимают потоки threadpool FastAPI (40), поэтому concurrency + queue < 40
+    max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+    max_queue = int(os.getenv("LLM_MAX_QUEUE", "16"))
+    queue_sla = float(os.getenv("LLM_QUEUE_SLA", "30"))         # секунд в очереди, дальше — ответ фрагментом
+    service_time = float(os.getenv("LLM_SERVICE_TIME", "15"))   # начальная оценка длительности генерации
     
+LLM_ADMISSION = LLMAdmission()
+
+class Upstream:
+    # повтор только при ошибке соединения и 502/503/504; генерацию Qwen не повторяем
+    retries = int(os.getenv("UPSTREAM_RETRIES", "1"))
+    retry_backoff = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.05"))  # секунд, удваивается
+    # повторы и хеджи всех сервисов за 10 с: не больше ratio от запросов + min_per_sec
+    retry_budget_ratio = float(os.getenv("UPSTREAM_RETRY_BUDGET_RATIO", "0.1"))
+    retry_budget_min_per_sec = float(os.getenv("UPSTREAM_RETRY_BUDGET_MIN_PER_SEC", "1"))
+    connect_timeout = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "2"))
+    breaker_failures = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))          # ошибок подряд до размыкания
+    breaker_open_seconds = float(os.getenv("UPSTREAM_BREAKER_OPEN_SECONDS", "10"))
+    # хедж модерации/эмбеддингов на другую реплику, если ответа нет дольше квантиля латентности
+    hedge_quantile = float(os.getenv("UPSTREAM_HEDGE_QUANTILE", "0.95"))
+    hedge_min_delay = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.02"))
+    hedge_workers = int(os.getenv("UPSTREAM_HEDGE_WORKERS", "32"))
+    # реплики: p2c (две случайные, меньше запросов в работе) или least_outstanding
+    balancer = os.getenv("UPSTREAM_BALANCER", "p2c")
+    eject_failures = int(os.getenv("UPSTREAM_EJECT_FAILURES", "3"))             # ошибок подряд до исключения реплики
+    eject_seconds = float(os.getenv("UPSTREAM_EJECT_SECONDS", "30"))
+    health_interval = float(os.getenv("UPSTREAM_HEALTH_INTERVAL", "5"))         # 0 — без активных проверок
+    health_timeout = float(os.getenv("UPSTREAM_HEALTH_TIMEOUT", "1"))
+    
+UPSTREAM = Upstream()
+
+class Telemetry:
+    # остальные OTEL_* (заголовки, сэмплирование) читает сам OpenTelemetry SDK
+    otlp_endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+    service_name = os.getenv("OTEL_SERVICE_NAME", "gateway")
     
-QWEN = Qwen()
\ No newline at end of file
+TELEMETRY = Telemetry()
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Контекст для LLM в пределах бюджета токенов Qwen, а не символов.
+
+Чанки приходят из поиска со счётом (score гибридного поиска; у knn — по рангу,
+как в RRF) и числом токенов (chunks.token_count считается при загрузке, ingest.py;
+у старых чанков — токенизатором CONTEXT_TOKENIZER на лету или оценкой по символам).
+Почти одинаковые фрагменты (повторы FAQ в разных документах) схлопываются в
+лучший по счёту; из оставшихся берётся набор с наибольшей суммой счёта, который
+помещается в CONTEXT_MAX_TOKENS вместе с заголовками фрагментов (0/1-рюкзак), в
+порядке релевантности.
+"""
+from __future__ import annotations
+
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from configs import CONTEXT, RETRIEVAL
+from tokenization import GatewayTokenizer
+
+FRAGMENT = "[ФРАГМЕНТ {i}]\n{text}"
+SEPARATOR = "\n\n"
+FRAGMENT_OVERHEAD = 8  # заголовок фрагмента и разделитель, токенов Qwen (с запасом)
+_MAX_CHUNK_TOKENS = 1 << 16  # обрезки при подсчёте нет: чанки ingest.py короче
+_SHINGLE = 3
+_WORD = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1)
+def configured_tokenizer() -> Optional[GatewayTokenizer]:
+    """Токенизатор qwen из CONTEXT_TOKENIZER; None — не задан."""
+    if not CONTEXT.tokenizer:
+        return None
+    return GatewayTokenizer.load(CONTEXT.tokenizer, _MAX_CHUNK_TOKENS)
+
+
+def count_tokens(texts: List[str]) -> Optional[List[int]]:
+    """Точное число токенов для chunks.token_count; None — токенизатор не задан (оценки в БД не пишем)."""
+    tokenizer = configured_tokenizer()
+    if tokenizer is None:
+        return None
+    return tokenizer.count(texts) if texts else []
+
+
+def _estimate(text: str) -> int:
+    return math.ceil(len(text) / CONTEXT.chars_per_token)
+
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + _SHINGLE]) for i in range(max(1, len(words) - _SHINGLE + 1))}
+
+
+def _dedupe(texts: Sequence[str], threshold: float) -> List[int]:
+    """Индексы без почти-дубликатов: доля общих шинглов от меньшего фрагмента < threshold. Порядок — по релевантности."""
+    kept: List[int] = []
+    shingles: List[Set[Tuple[str, ...]]] = []
+    for i, text in enumerate(texts):
+        own = _shingles(text)
+        if any(len(own & other) >= threshold * min(len(own), len(other)) for other in shingles):
+            continue
+        kept.append(i)
+        shingles.append(own)
+    return kept
+
+
+def _knapsack(weights: Sequence[int], values: Sequence[float], capacity: int) -> List[int]:
+    """0/1-рюкзак: индексы с наибольшей суммой values при сумме weights <= capacity."""
+    best = np.zeros(capacity + 1)
+    take = np.zeros((len(weights), capacity + 1), dtype=bool)
+    for i, (w, v) in enumerate(zip(weights, values)):
+        if w > capacity:
+            continue
+        with_item = best[:capacity + 1 - w] + v  # из значений до предмета i — каждый берётся не больше раза
+        better = with_item > best[w:]
+        take[i, w:] = better
+        best[w:] = np.where(better, with_item, best[w:])
+    chosen, c = [], capacity
+    for i in reversed(range(len(weights))):
+        if take[i, c]:
+            chosen.append(i)
+            c -= weights[i]
+    return sorted(chosen)
+
+
+def pack_context(chunks: List[Dict[str, Any]], max_tokens: int = CONTEXT.max_tokens,
+                 max_fragments: Optional[int] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    chunks — результат knn_search / hybrid_search (или rerank) в порядке релевантности;
+    max_fragments — сколько первых фрагментов после удаления дубликатов рассматривать.
+    Возвращает блок контекста и {"candidates", "duplicates", "fragments", "tokens"}.
+    """
+    items = [c for c in chunks if (c.get("data") or "").strip()]
+    texts = [c["data"].strip() for c in items]
+    kept = _dedupe(texts, CONTEXT.dedup_threshold)
+    stats = {"candidates": len(items), "duplicates": len(items) - len(kept), "fragments": 0, "tokens": 0}
+    kept = kept[:max_fragments]
+    if not kept:
+        return "", stats
+
+    tokens = [items[i].get("token_count") for i in kept]
+    missing = [j for j, t in enumerate(tokens) if t is None]
+    if missing:
+        counted = count_tokens([texts[kept[j]] for j in missing])
+        if counted is None:
+            counted = [_estimate(texts[kept[j]]) for j in missing]
+        for j, n in zip(missing, counted):
+            tokens[j] = n
+    weights = [int(t) + FRAGMENT_OVERHEAD for t in tokens]
+    values = [float(items[i].get("score") or 1.0 / (RETRIEVAL.rrf_k + rank)) for rank, i in enumerate(kept, start=1)]
+
+    chosen = _knapsack(weights, values, max_tokens)
+    if chosen:
+        parts = [texts[kept[j]] for j in chosen]
+        used = sum(weights[j] for j in chosen)
+    else:
+        # ни один фрагмент не влезает целиком — начало самого релевантного
+        budget = max(0, max_tokens - FRAGMENT_OVERHEAD)
+        text = texts[kept[0]]
+        parts = [text[:int(len(text) * budget / max(1, tokens[0]))]]
+        used = max_tokens
+    stats.update(fragments=len(parts), tokens=used)
+    return SEPARATOR.join(FRAGMENT.format(i=i, text=t) for i, t in enumerate(parts, start=1)), stats
@@ -1,46 +1,139 @@
 from __future__ import annotations
 
+import threading
+import time
+from collections import deque
 from functools import wraps
 from typing import Callable, TypeVar, Any, Optional
 
 from sqlalchemy import (
     create_engine, ForeignKey, Text, Integer, BigInteger, DateTime,
-    func, Index, select, or_
+    func, Index, Identity, select, or_
 )
 from sqlalchemy.orm import (
     DeclarativeBase, Mapped, mapped_column, relationship,
     Session, sessionmaker
 )
+from sqlalchemy.exc import ProgrammingError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy import text
 from typing import Optional, List, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import text, bindparam
 from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION
-from configs import DATABASE
+from configs import DATABASE, RETRIEVAL
 
 from pydantic import BaseModel, Field, validator
 from fastapi import Depends, Header
-from passlib.context import CryptContext
 from pydantic import BaseModel, Field, EmailStr
 from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION
 from sqlalchemy import BigInteger, Text, LargeBinary, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-
-pwd_ctx = CryptContext(
-    schemes=["bcrypt_sha256", "bcrypt"],
-    default="bcrypt_sha256",
-    deprecated="auto",
-)
+from passwords import pwd_ctx
 
 DATABASE_URL = DATABASE.url()
 
+
+# --------- Пул соединений ----------
+class PoolStats:
+    """Сколько ждали свободное соединение из пула (окно последних checkout'ов)."""
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._wait_sec: deque[float] = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def record(self, wait_sec: float, timed_out: bool) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += int(timed_out)
+            self._wait_sec.append(wait_sec)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._wait_sec)
+            checkouts, timeouts = self.checkouts, self.timeouts
+        pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 3) if waits else None
+        return {
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "wait_ms": {"p50": pick(0.50), "p95": pick(0.95), "max": pick(1.0)},
+        }
+
+
+def _timed_pool(base: type[QueuePool]) -> type[QueuePool]:
+    class _TimedPool(base):
+        stats = PoolStats()
+
+        def _do_get(self):
+            t0 = time.perf_counter()
+            timed_out = False
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                timed_out = True
+                raise
+            finally:
+                self.stats.record(time.perf_counter() - t0, timed_out)
+
+    _TimedPool.__name__ = f"Timed{base.__name__}"
+    return _TimedPool
+
+
+def _pool_kwargs() -> Dict[str, Any]:
+    return dict(
+        pool_size=DATABASE.pool_size,
+        max_overflow=DATABASE.max_overflow,
+        pool_timeout=DATABASE.pool_timeout,
+        pool_recycle=DATABASE.pool_recycle,
+        pool_pre_ping=DATABASE.pool_pre_ping,
+        query_cache_size=DATABASE.statement_cache_size,
+    )
+
+
 engine = create_engine(
     DATABASE_URL,
-    pool_pre_ping=True,
+    poolclass=_timed_pool(QueuePool),
+    **_pool_kwargs(),
 )
 
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False, class_=Session)
 
+# Опциональный asyncpg-путь для async-эндпоинтов (DATABASE_ASYNC=true)
+async_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal: Optional[async_sessionmaker[AsyncSession]] = None
+if DATABASE.use_async:
+    async_engine = create_async_engine(
+        DATABASE.async_url(),
+        poolclass=_timed_pool(AsyncAdaptedQueuePool),
+        **_pool_kwargs(),
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+def pool_status() -> Dict[str, Any]:
+    """Снимок состояния пулов: занятые соединения, overflow, ожидание checkout."""
+    def one(pool) -> Dict[str, Any]:
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "max_overflow": DATABASE.max_overflow,
+            **pool.stats.snapshot(),
+        }
+
+    out = {"sync": one(engine.pool)}
+    if async_engine is not None:
+        out["async"] = one(async_engine.sync_engine.pool)
+    return out
+
+
+# Категории factor-dev (dialog.category, documents.category, chunks.category)
+CATEGORIES = ("IT", "AD", "HR")
+
 
 # --------- Базовый класс ----------
 class Base(DeclarativeBase):
@@ -142,6 +235,7 @@ class Document(Base):
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     name: Mapped[str] = mapped_column(Text, nullable=False)
     data: Mapped[bytes | None] = mapped_column(LargeBinary)
+    category: Mapped[str | None] = mapped_column(Text)
 
     chunks: Mapped[list["Chunk"]] = relationship(
         back_populates="document",
@@ -153,6 +247,18 @@ class Chunk(Base):
     __tablename__ = "chunks"
     __table_args__ = (
         Index("idx_chunks_document_id", "document_id"),
+        Index("idx_chunks_data_fts", text("to_tsvector('russian', data)"), postgresql_using="gin"),
+        Index("idx_chunks_category", "category"),
+        # по одному полнотекстовому под-индексу на категорию, общий idx_chunks_data_fts — fallback
+        *(
+            Index(
+                f"idx_chunks_data_fts_{cat.lower()}",
+                text("to_tsvector('russian', data)"),
+                postgresql_using="gin",
+                postgresql_where=text(f"category = '{cat}'"),
+            )
+            for cat in CATEGORIES
+        ),
     )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
@@ -161,15 +267,34 @@ class Chunk(Base):
     )
     data: Mapped[str] = mapped_column(Text, nullable=False)
     embedding: Mapped[list[float]] = mapped_column(ARRAY(DOUBLE_PRECISION), nullable=False)
+    category: Mapped[str | None] = mapped_column(Text)  # копия documents.category для поиска по шарду
+    token_count: Mapped[int | None] = mapped_column(Integer)  # токены Qwen (context.py), NULL — не посчитано
 
     document: Mapped[Document] = relationship("Document", back_populates="chunks")
 
 
+class EmbeddingGeneration(Base):
+    """Какой моделью посчитаны chunks.embedding (slot='active') и chunks.embedding_prev (slot='previous'); пишет reembed.py."""
+    __tablename__ = "embedding_generations"
+
+    slot: Mapped[str] = mapped_column(Text, primary_key=True)
+    generation: Mapped[int] = mapped_column(BigInteger, Identity(), nullable=False)  # новый номер на каждый flip
+    label: Mapped[str] = mapped_column(Text, nullable=False)
+    host: Mapped[str] = mapped_column(Text, nullable=False)
+    model: Mapped[str] = mapped_column(Text, nullable=False)
+    activated_at: Mapped[Any] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
 # Инициализация схемы (один раз при старте сервиса)
 def init_models() -> None:
     Base.metadata.create_all(engine)
 
 
+def ensure_generation_table() -> None:
+    """embedding_generations для reembed.py и ingest.py в уже развёрнутой схеме."""
+    EmbeddingGeneration.__table__.create(engine, checkfirst=True)
+
+
 # --------- Декораторы для запросов ----------
 F = TypeVar("F", bound=Callable[..., Any])
 
@@ -224,22 +349,156 @@ def db_update(func: F) -> F:
     return wrapper 
 
 
+def _shard(category: Optional[str]) -> Optional[str]:
+    return category if category in CATEGORIES else None
+
+
 @db_query
-def knn_search(embedding: List[float], k: int = 5, session: Session | None = None) -> List[Dict[str, Any]]:
+def knn_search(
+    embedding: List[float],
+    k: int = 5,
+    category: Optional[str] = None,
+    session: Session | None = None,
+) -> List[Dict[str, Any]]:
     """
-    Top-k ближайших чанков по L2 расстоянию.
-    Возвращает [{"id": <chunk_id>, "data": <chunk_text>}, ...]
+    Top-k ближайших чанков по L2 расстоянию (полный перебор).
+    С category перебираем только чанки этой категории (фильтр по idx_chunks_category,
+    векторного под-индекса нет); если категория неизвестна или в шарде меньше k
+    чанков — глобальный поиск.
+    Возвращает [{"id": <chunk_id>, "data": <chunk_text>, "token_count": <int | None>}, ...]
     """
     if not embedding:
         return []
 
-    dim = len(embedding)
+    shard = _shard(category)
+    params = {"dim": len(embedding), "k": k, "category": shard}
+    rows = session.execute(_knn_sql(embedding), params).mappings().all()
+    if shard is not None and len(rows) < k:
+        rows = session.execute(_knn_sql(embedding), {**params, "category": None}).mappings().all()
+    return [{"id": r["id"], "data": r["data"], "token_count": r["token_count"]} for r in rows]
+
+
+@db_query
+def active_generation(session: Session | None = None) -> Optional[Dict[str, Any]]:
+    """
+    Активное поколение chunks.embedding: generation, label, host, model.
+    None — начальное (reembed.py ещё не переключал): эмбеддинги посчитаны RUBERT_*.
+    """
+    try:
+        row = session.execute(
+            text("SELECT generation, label, host, model FROM embedding_generations WHERE slot = 'active'")
+        ).mappings().first()
+    except ProgrammingError:  # таблицы ещё нет
+        session.rollback()
+        return None
+    return dict(row) if row else None
+
+
+@db_query
+def hybrid_search(
+    embedding: List[float],
+    query: str,
+    k: int = RETRIEVAL.top_k,
+    candidates: int = RETRIEVAL.candidates,
+    rrf_k: int = RETRIEVAL.rrf_k,
+    category: Optional[str] = None,
+    session: Session | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Гибридный поиск за один запрос: векторный top-N по L2 и лексический top-N
+    по GIN-индексу to_tsvector('russian', data) (слова запроса через OR, ранжирование
+    ts_rank_cd с нормировкой на длину), слитые reciprocal rank fusion.
+    category сужает поиск до шарда категории (с fallback на глобальный, как в knn_search).
+    Возвращает [{"id": <chunk_id>, "data": <chunk_text>, "score": <rrf>, "token_count": <int | None>}, ...]
+    """
+    if not embedding:
+        return []
 
     sql = text("""
+        WITH q AS (
+            SELECT :emb AS e,
+                   NULLIF(replace(plainto_tsquery('russian', :query)::text, '&', '|'), '')::tsquery AS tsq
+        ),
+        vec AS (
+            SELECT d.id, row_number() OVER (ORDER BY d.dist, d.id) AS rnk
+            FROM (
+                SELECT c.id, (
+                    SELECT SUM( (c.embedding[i] - q.e[i]) * (c.embedding[i] - q.e[i]) )
+                    FROM generate_subscripts(c.embedding, 1) AS i
+                ) AS dist
+                FROM chunks c, q
+                WHERE array_length(c.embedding, 1) = :dim
+                  AND (CAST(:category AS text) IS NULL OR c.category = :category)
+                ORDER BY dist ASC
+                LIMIT :candidates
+            ) d
+        ),
+        lex AS (
+            SELECT l.id, row_number() OVER (ORDER BY l.rank DESC, l.id) AS rnk
+            FROM (
+                SELECT c.id, ts_rank_cd(to_tsvector('russian', c.data), q.tsq, 1) AS rank
+                FROM chunks c, q
+                WHERE q.tsq IS NOT NULL
+                  AND to_tsvector('russian', c.data) @@ q.tsq
+                  AND (CAST(:category AS text) IS NULL OR c.category = :category)
+                ORDER BY rank DESC
+                LIMIT :candidates
+            ) l
+        ),
+        fused AS (
+            SELECT COALESCE(v.id, l.id) AS id,
+                   COALESCE(1.0 / (:rrf_k + v.rnk), 0) + COALESCE(1.0 / (:rrf_k + l.rnk), 0) AS score
+            FROM vec v
+            FULL OUTER JOIN lex l ON l.id = v.id
+        )
+        SELECT c.id, c.data, c.token_count, f.score
+        FROM fused f
+        JOIN chunks c ON c.id = f.id
+        ORDER BY f.score DESC, c.id
+        LIMIT :k
+    """).bindparams(
+        bindparam("emb", value=embedding, type_=ARRAY(DOUBLE_PRECISION))
+    )
+
+    shard = _shard(category)
+    params = {
+        "query": query or "", "dim": len(embedding), "k": k,
+        "candidates": candidates, "rrf_k": rrf_k, "category": shard,
+    }
+    rows = session.execute(sql, params).mappings().all()
+    if shard is not None and len(rows) < k:
+        rows = session.execute(sql, {**params, "category": None}).mappings().all()
+    return [{"id": r["id"], "data": r["data"], "score": float(r["score"]), "token_count": r["token_count"]} for r in rows]
+
+
+@db_query
+def fetch_chunks(ids: List[int], session: Session | None = None) -> List[Dict[str, Any]]:
+    """Чанки по id (порядок не сохраняется): [{"id", "data", "token_count"}, ...]."""
+    if not ids:
+        return []
+    rows = session.execute(
+        text("SELECT id, data, token_count FROM chunks WHERE id = ANY(:ids)"), {"ids": list(ids)}
+    ).mappings().all()
+    return [{"id": r["id"], "data": r["data"], "token_count": r["token_count"]} for r in rows]
+
+
+@db_query
+def fetch_chunk_embeddings(ids: List[int], session: Session | None = None) -> List[tuple]:
+    """[(id, embedding), ...] по первичному ключу — точный пересчёт кандидатов сжатого индекса (vectorstore.py)."""
+    if not ids:
+        return []
+    return [tuple(r) for r in session.execute(
+        text("SELECT id, embedding FROM chunks WHERE id = ANY(:ids)"), {"ids": list(ids)}
+    ).all()]
+
+
+def _knn_sql(embedding: List[float]):
+    return text("""
         WITH q AS (SELECT :emb AS e)
-        SELECT c.id, c.data
+        SELECT c.id, c.data, c.token_count
         FROM chunks c, q
         WHERE array_length(c.embedding, 1) = :dim
+          AND (CAST(:category AS text) IS NULL OR c.category = :category)
         ORDER BY (
             SELECT SUM( (c.embedding[i] - q.e[i]) * (c.embedding[i] - q.e[i]) )
             FROM generate_subscripts(c.embedding, 1) AS i
@@ -249,7 +508,4 @@ def knn_search(embedding: List[float], k: int = 5, session: Session | None = Non
         bindparam("emb", value=embedding, type_=ARRAY(DOUBLE_PRECISION))
     )
 
-    rows = session.execute(sql, {"dim": dim, "k": k}).mappings().all()
-    return [{"id": r["id"], "data": r["data"]} for r in rows]
-
 
@@ -0,0 +1,372 @@
+"""
+Загрузка документов в documents/chunks.
+
+Файл целиком сохраняется в documents.data, текст режется на перекрывающиеся
+чанки, чанки эмбеддятся батчами в rubert_tiny2_embeddings вне транзакции и
+пишутся в chunks одним COPY. Каждый документ — отдельная транзакция, поэтому
+при повторном запуске уже загруженные документы пропускаются (resume).
+
+    python ingest.py docs/*.txt --chunk-size 800 --overlap 150 --batch-size 64
+    python ingest.py --count-tokens   # chunks.token_count у загруженных ранее (CONTEXT_TOKENIZER)
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import httpx
+import numpy as np
+
+import database.baseclasses as db
+from configs import CONTEXT, INGEST, RUBERT_EMBEDDER
+from context import count_tokens
+
+log = logging.getLogger("ingest")
+
+
+# --------- Чанкинг ----------
+def split_into_chunks(text: str, chunk_size: int = INGEST.chunk_size, overlap: int = INGEST.chunk_overlap) -> List[str]:
+    """
+    Режем по строкам (FAQ-документы — «вопрос — ответ» в строке), набирая окно
+    до chunk_size символов; следующее окно начинается с хвоста предыдущего
+    длиной до overlap символов. Строки длиннее chunk_size режутся по словам.
+    """
+    overlap = max(0, min(overlap, chunk_size // 2))
+    units: List[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line:
+            units.extend(_windows(line.split(" "), " ", chunk_size, overlap) if len(line) > chunk_size else [line])
+    return _windows(units, "\n", chunk_size, overlap)
+
+
+def _windows(units: List[str], sep: str, chunk_size: int, overlap: int) -> List[str]:
+    out: List[str] = []
+    window: List[str] = []
+    size = 0
+    fresh = False  # есть ли в окне что-то кроме перекрытия
+    for unit in units:
+        if fresh and size + len(sep) + len(unit) > chunk_size:
+            out.append(sep.join(window))
+            tail: List[str] = []
+            tail_size = 0
+            for prev in reversed(window):
+                if tail_size + len(prev) + len(sep) > overlap:
+                    break
+                tail.insert(0, prev)
+                tail_size += len(prev) + len(sep)
+            window, size = tail, tail_size
+        window.append(unit)
+        size += len(unit) + len(sep)
+        fresh = True
+    if fresh:
+        out.append(sep.join(window))
+    return out
+
+
+# --------- Категория документа ----------
+# Имена FAQ-файлов: NN_IT_FAQ_*, NN_BUH_FAQ_* (бухгалтерия/АХО), NN_FAQ_* (HR)
+_CATEGORY_BY_NAME = (
+    ("IT", re.compile(r"^\d+_IT_")),
+    ("AD", re.compile(r"^\d+_BUH_")),
+    ("HR", re.compile(r"^\d+_FAQ_")),
+)
+
+
+def category_for_document(name: str) -> Optional[str]:
+    """Категория factor-dev по имени файла; None — документ попадает только в глобальный поиск."""
+    base = os.path.basename(name)
+    for category, pattern in _CATEGORY_BY_NAME:
+        if pattern.match(base):
+            return category
+    return None
+
+
+# --------- Эмбеддинги батчами ----------
+@lru_cache(maxsize=8)
+def _emb_meta(host: str, model: str) -> tuple[str, str, str]:
+    r = httpx.get(f"{host}/v2/models/{model}", timeout=RUBERT_EMBEDDER.timeout)
+    r.raise_for_status()
+    md = r.json()
+    return md["inputs"][0]["name"], md["inputs"][0]["datatype"], md["outputs"][0]["name"]
+
+
+def embed_batch(
+    texts: List[str],
+    host: str = RUBERT_EMBEDDER.host,
+    model: str = RUBERT_EMBEDDER.model,
+    client: Optional[httpx.Client] = None,
+) -> np.ndarray:
+    """Один запрос к Triton на весь батч, результат (n, dim) float32."""
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    in_name, in_dtype, out_name = _emb_meta(host, model)
+    # BYTES в JSON-протоколе Triton — обычные UTF-8 строки, как и STRING
+    payload = {
+        "inputs": [{"name": in_name, "shape": [len(texts)], "datatype": in_dtype, "data": list(texts)}],
+        "outputs": [{"name": out_name}],
+        "binary_data_output": False,
+    }
+    url = f"{host}/v2/models/{model}/infer"
+    if client is None:
+        r = httpx.post(url, json=payload, timeout=RUBERT_EMBEDDER.timeout)
+    else:
+        r = client.post(url, json=payload)
+    r.raise_for_status()
+    out = r.json()["outputs"][0]
+    vecs = np.asarray(out["data"], dtype=np.float32).reshape(out["shape"])
+    if RUBERT_EMBEDDER.normalize:
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = vecs / np.where(norms > 0, norms, 1.0)
+    return vecs
+
+
+# --------- COPY ----------
+def _copy_text(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_array(vec: np.ndarray) -> str:
+    return "{" + ",".join(repr(float(x)) for x in vec) + "}"
+
+
+class _CopyStream:
+    """file-like поверх генератора строк, чтобы COPY не склеивал документ в одну строку."""
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self._buf = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            out, self._buf = self._buf, ""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+def _active_embedder(cur) -> tuple[Optional[int], str, str]:
+    """(generation, host, model) активного поколения chunks.embedding (reembed.py), без него — (None, RUBERT_*)."""
+    cur.execute("SELECT generation, host, model FROM embedding_generations WHERE slot = 'active'")
+    row = cur.fetchone()
+    return (row[0], row[1], row[2]) if row else (None, RUBERT_EMBEDDER.host, RUBERT_EMBEDDER.model)
+
+
+def _find_document(cur, name: str) -> Optional[tuple[int, bool]]:
+    """(id, есть ли чанки) документа с этим именем."""
+    cur.execute(
+        """
+        SELECT d.id, EXISTS (SELECT 1 FROM chunks c WHERE c.document_id = d.id)
+        FROM documents d WHERE d.name = %s ORDER BY d.id LIMIT 1
+        """,
+        (name,),
+    )
+    return cur.fetchone()
+
+
+def _embedded_batches(
+    chunks: List[str], batch_size: int, client: httpx.Client, host: str, model: str
+) -> Iterator[tuple[List[str], np.ndarray]]:
+    # следующий батч эмбеддится, пока текущий форматируется для COPY
+    batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(embed_batch, batches[0], host=host, model=model, client=client)
+        for i, batch in enumerate(batches):
+            vecs = pending.result()
+            if i + 1 < len(batches):
+                pending = pool.submit(embed_batch, batches[i + 1], host=host, model=model, client=client)
+            yield batch, vecs
+
+
+def _copy_rows(category: Optional[str], batches: Iterable[tuple[List[str], np.ndarray]]) -> List[str]:
+    """Строки COPY без document_id: форматирование батча идёт, пока эмбеддится следующий."""
+    cat = _copy_text(category) if category else "\\N"
+    rows = []
+    for texts, vecs in batches:
+        # токены Qwen для упаковки контекста (context.py); без CONTEXT_TOKENIZER — NULL
+        counts = [str(n) for n in count_tokens(texts) or []] or ["\\N"] * len(texts)
+        rows.extend(f"\t{_copy_text(t)}\t{_copy_array(v)}\t{cat}\t{n}\n" for t, v, n in zip(texts, vecs, counts))
+    return rows
+
+
+# --------- Документы ----------
+def ingest_document(
+    name: str,
+    data: bytes,
+    chunk_size: int = INGEST.chunk_size,
+    overlap: int = INGEST.chunk_overlap,
+    batch_size: int = INGEST.batch_size,
+    category: Optional[str] = None,
+    client: Optional[httpx.Client] = None,
+) -> Dict[str, Any]:
+    """
+    Загружает один документ в своей транзакции. Уже загруженный (есть чанки) — пропускает.
+    category по умолчанию выводится из имени файла (category_for_document).
+    """
+    category = category or category_for_document(name)
+    t0 = time.perf_counter()
+    db.ensure_generation_table()
+    conn = db.engine.raw_connection()
+    own_client = client is None
+    client = client or httpx.Client(timeout=RUBERT_EMBEDDER.timeout)
+    try:
+        cur = conn.cursor()
+        row = _find_document(cur, name)
+        if row and row[1]:
+            conn.rollback()
+            return {"name": name, "document_id": row[0], "status": "skipped", "chunks": 0}
+        chunks = split_into_chunks(data.decode("utf-8", errors="replace"), chunk_size, overlap)
+        generation, host, model = _active_embedder(cur)
+        # эмбеддинг — вне транзакции: ни chunks, ни embedding_generations не заблокированы на время HTTP-вызовов,
+        # и reembed.py flip не ждёт медленную загрузку
+        conn.rollback()
+        while True:
+            rows = _copy_rows(category, _embedded_batches(chunks, batch_size, client, host, model))
+            # SHARE до конца транзакции: flip (EXCLUSIVE) не переключит поколение между проверкой и commit
+            cur.execute("LOCK TABLE embedding_generations IN SHARE MODE")
+            active = _active_embedder(cur)
+            if active[0] == generation:
+                break
+            conn.rollback()
+            log.info("%s: embedding generation changed during ingest (%s -> %s), re-embedding", name, generation, active[0])
+            generation, host, model = active
+
+        row = _find_document(cur, name)
+        if row and row[1]:  # параллельная загрузка того же документа успела раньше
+            conn.rollback()
+            return {"name": name, "document_id": row[0], "status": "skipped", "chunks": 0}
+        if row:
+            document_id = row[0]
+            cur.execute("UPDATE documents SET data = %s, category = %s WHERE id = %s", (data, category, document_id))
+        else:
+            cur.execute(
+                "INSERT INTO documents (name, data, category) VALUES (%s, %s, %s) RETURNING id",
+                (name, data, category),
+            )
+            document_id = cur.fetchone()[0]
+
+        stream = _CopyStream(f"{document_id}{r}" for r in rows)
+        cur.copy_expert("COPY chunks (document_id, data, embedding, category, token_count) FROM STDIN", stream)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        if own_client:
+            client.close()
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "name": name,
+        "document_id": document_id,
+        "category": category,
+        "status": "ingested",
+        "chunks": len(chunks),
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(len(chunks) / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+def ingest_documents(items: Iterable[tuple[str, bytes]], **kwargs) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    results = []
+    with httpx.Client(timeout=RUBERT_EMBEDDER.timeout) as client:
+        for name, data in items:
+            res = ingest_document(name, data, client=client, **kwargs)
+            log.info("%s: %s, %s chunks, %s chunks/s", name, res["status"], res["chunks"], res.get("chunks_per_sec"))
+            results.append(res)
+    elapsed = time.perf_counter() - t0
+    total = sum(r["chunks"] for r in results)
+    return {
+        "documents": results,
+        "chunks": total,
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(total / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+def count_missing_tokens(batch_size: int = 1000) -> int:
+    """Заполняет chunks.token_count у чанков, загруженных до него (или без CONTEXT_TOKENIZER). Возвращает число чанков."""
+    if not CONTEXT.tokenizer:
+        raise SystemExit("CONTEXT_TOKENIZER is not set: nothing to count tokens with")
+    from psycopg2.extras import execute_values
+
+    done = 0
+    conn = db.engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        while True:
+            # батч — своя транзакция: прерванный пересчёт продолжается с места остановки
+            cur.execute("SELECT id, data FROM chunks WHERE token_count IS NULL ORDER BY id LIMIT %s", (batch_size,))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            counts = count_tokens([r[1] for r in rows])
+            execute_values(
+                cur,
+                "UPDATE chunks c SET token_count = v.n FROM (VALUES %s) AS v(id, n) WHERE c.id = v.id",
+                [(r[0], n) for r, n in zip(rows, counts)],
+            )
+            conn.commit()
+            done += len(rows)
+            log.info("token_count: %s chunks", done)
+    finally:
+        conn.close()
+    return done
+
+
+def _read_files(paths: List[str]) -> Iterator[tuple[str, bytes]]:
+    for path in paths:
+        with open(path, "rb") as f:
+            yield os.path.basename(path), f.read()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Загрузка документов в documents/chunks")
+    parser.add_argument("files", nargs="*", help="текстовые файлы (UTF-8)")
+    parser.add_argument("--chunk-size", type=int, default=INGEST.chunk_size)
+    parser.add_argument("--overlap", type=int, default=INGEST.chunk_overlap)
+    parser.add_argument("--batch-size", type=int, default=INGEST.batch_size)
+    parser.add_argument("--category", choices=db.CATEGORIES, default=None,
+                        help="категория всех файлов (по умолчанию — по имени файла)")
+    parser.add_argument("--count-tokens", action="store_true",
+                        help="только заполнить chunks.token_count у уже загруженных чанков (CONTEXT_TOKENIZER)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.count_tokens:
+        log.info("token_count filled for %s chunks", count_missing_tokens())
+        return
+    if not args.files:
+        parser.error("files are required (or --count-tokens)")
+    report = ingest_documents(
+        _read_files(args.files),
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+        batch_size=args.batch_size,
+        category=args.category,
+    )
+    log.info("Total: %s chunks in %ss (%s chunks/s)", report["chunks"], report["seconds"], report["chunks_per_sec"])
+
+
+if __name__ == "__main__":
+    main()
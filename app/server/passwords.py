@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Optional
+
+from passlib.context import CryptContext
+
+from configs import AUTH_HASHING
+
+pwd_ctx = CryptContext(
+    schemes=["bcrypt_sha256", "bcrypt"],
+    default="bcrypt_sha256",
+    deprecated="auto",
+)
+
+
+class HasherSaturated(Exception):
+    """Очередь проверки паролей заполнена — запрос отклоняем сразу."""
+
+
+def _verify_in_worker(password: str, password_hash: str) -> tuple[bool, float]:
+    # Выполняется в дочернем процессе: bcrypt не занимает GIL и потоки API.
+    t0 = time.perf_counter()
+    ok = pwd_ctx.verify(password, password_hash)
+    return ok, time.perf_counter() - t0
+
+
+class _HashStats:
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._hash_sec: deque[float] = deque(maxlen=window)
+        self._wait_sec: deque[float] = deque(maxlen=window)
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.in_flight = 0
+
+    def add(self, field: str, delta: int = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def record(self, hash_sec: float, wait_sec: float) -> None:
+        with self._lock:
+            self.completed += 1
+            self._hash_sec.append(hash_sec)
+            self._wait_sec.append(wait_sec)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hash_sec = sorted(self._hash_sec)
+            wait_sec = sorted(self._wait_sec)
+            return {
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "in_flight": self.in_flight,
+                "hash_ms": _percentiles_ms(hash_sec),
+                "queue_wait_ms": _percentiles_ms(wait_sec),
+            }
+
+
+def _percentiles_ms(values: list[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+    return {"p50": pick(0.50), "p95": pick(0.95), "max": round(values[-1] * 1000, 2)}
+
+
+class PasswordVerifier:
+    """
+    Проверка bcrypt-хэшей в отдельном пуле процессов ограниченного размера.
+    Одновременно в работе/очереди не больше workers + max_queue проверок,
+    всё сверх этого — HasherSaturated (fast-fail), чтобы логин-шторм
+    не забивал общий threadpool FastAPI.
+    """
+
+    def __init__(self, workers: int, max_queue: int, timeout: float):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.stats = _HashStats()
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, max_queue))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._executor
+
+    def _release(self, _: Optional[Future]) -> None:
+        self.stats.add("in_flight", -1)
+        self._slots.release()
+
+    def _submit(self, password: str, password_hash: str) -> Future:
+        if not self._slots.acquire(blocking=False):
+            self.stats.add("rejected")
+            raise HasherSaturated("Password verification queue is full")
+        self.stats.add("in_flight")
+        try:
+            fut = self._pool().submit(_verify_in_worker, password, password_hash)
+        except Exception:
+            self._release(None)
+            raise
+        # Слот освобождается, когда хэш реально досчитан, а не когда мы перестали ждать.
+        fut.add_done_callback(self._release)
+        return fut
+
+    def _record(self, result: tuple[bool, float], t0: float) -> bool:
+        ok, hash_sec = result
+        self.stats.record(hash_sec, max(0.0, time.perf_counter() - t0 - hash_sec))
+        return ok
+
+    def verify(self, password: str, password_hash: Optional[str]) -> bool:
+        if not password_hash:
+            return False
+        t0 = time.perf_counter()
+        fut = self._submit(password, password_hash)
+        try:
+            result = fut.result(timeout=self.timeout)
+        except FutureTimeout:
+            self.stats.add("timeouts")
+            raise
+        return self._record(result, t0)
+
+    async def verify_async(self, password: str, password_hash: Optional[str]) -> bool:
+        """То же, что verify(), но ожидание — в event loop: поток threadpool на время хэширования не занят."""
+        if not password_hash:
+            return False
+        t0 = time.perf_counter()
+        fut = self._submit(password, password_hash)
+        try:
+            # shield: по таймауту перестаём ждать, а не отменяем уже запущенную проверку
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.add("timeouts")
+            raise FutureTimeout() from None
+        return self._record(result, t0)
+
+    def warmup(self) -> None:
+        """Поднимаем процессы заранее, чтобы первый логин не платил за spawn."""
+        pool = self._pool()
+        for f in [pool.submit(time.perf_counter) for _ in range(self.workers)]:
+            f.result()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+verifier = PasswordVerifier(
+    workers=AUTH_HASHING.workers,
+    max_queue=AUTH_HASHING.max_queue,
+    timeout=AUTH_HASHING.timeout,
+)
@@ -0,0 +1,66 @@
+"""
+Дешёвый первый каскад модерации: логистическая регрессия на эмбеддинге
+rubert-tiny2, который /pipeline всё равно считает. Уверенно чистые (p < low) и
+уверенно токсичные (p > high) сообщения решаются сразу, остальные уходят в
+xlmr_toxicity. Веса и пороги — .npz из `python -m benchmarks.prefilter`.
+"""
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+import numpy as np
+
+from configs import PREFILTER
+
+CLEAN, TOXIC, ESCALATE = "clean", "toxic", "escalate"
+
+
+class ToxicityPrefilter:
+    def __init__(self, weights: np.ndarray, bias: float, low: float, high: float):
+        if not 0.0 <= low <= high <= 1.0:
+            raise ValueError(f"Bad prefilter thresholds: low={low}, high={high}")
+        self.weights = np.asarray(weights, dtype=np.float32).reshape(-1)
+        self.bias = float(bias)
+        self.low = low
+        self.high = high
+
+    @classmethod
+    def load(cls, path: str, low: Optional[float] = None, high: Optional[float] = None) -> "ToxicityPrefilter":
+        with np.load(path) as data:
+            return cls(
+                data["weights"],
+                float(data["bias"]),
+                float(data["low"]) if low is None else low,
+                float(data["high"]) if high is None else high,
+            )
+
+    def save(self, path: str, **extra) -> None:
+        np.savez(path, weights=self.weights, bias=self.bias, low=self.low, high=self.high, **extra)
+
+    def score(self, vecs: np.ndarray) -> np.ndarray:
+        """P(toxic) для (n, dim) или (dim,); эмбеддинги L2-нормируются, как при обучении."""
+        x = np.atleast_2d(np.asarray(vecs, dtype=np.float32))
+        norms = np.linalg.norm(x, axis=1, keepdims=True)
+        x = x / np.where(norms > 0, norms, 1.0)
+        return 1.0 / (1.0 + np.exp(-(x @ self.weights + self.bias)))
+
+    def decide(self, p: float) -> str:
+        if p < self.low:
+            return CLEAN
+        if p > self.high:
+            return TOXIC
+        return ESCALATE
+
+
+def load_configured() -> Optional[ToxicityPrefilter]:
+    """Каскад из TOXICITY_PREFILTER_PATH; None — выключен (всё идёт в xlmr_toxicity)."""
+    if not PREFILTER.path:
+        return None
+    if not os.path.exists(PREFILTER.path):
+        raise FileNotFoundError(f"TOXICITY_PREFILTER_PATH not found: {PREFILTER.path}")
+    try:
+        return ToxicityPrefilter.load(PREFILTER.path, low=PREFILTER.low, high=PREFILTER.high)
+    except ValueError as e:
+        # переопределён один порог, и он разошёлся со вторым из файла
+        raise ValueError(f"{e} (TOXICITY_PREFILTER_LOW / TOXICITY_PREFILTER_HIGH, {PREFILTER.path})") from e
@@ -0,0 +1,242 @@
+"""
+Пересчёт chunks.embedding при смене модели эмбеддингов (или max_length).
+
+Новые векторы пишутся в теневую колонку chunks.embedding_next, пока сервис
+продолжает искать по старой chunks.embedding. Чанки читаются серверным
+курсором и эмбеддятся параллельными батчами; каждый батч коммитится сразу,
+поэтому прерванный пересчёт продолжается с места остановки. В конце колонки
+переименовываются в одной транзакции вместе с записью host/model нового
+поколения в embedding_generations — по ней ingest.py и шлюз эмбеддят тексты
+той же моделью; предыдущее остаётся в chunks.embedding_prev для отката.
+
+    python reembed.py run --host http://new-rubert:8000 --model rubert_tiny2_embeddings --workers 4
+    python reembed.py status
+    python reembed.py rollback
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+from psycopg2.extras import execute_values
+
+import database.baseclasses as db
+from configs import INGEST, RUBERT_EMBEDDER
+from ingest import embed_batch
+
+log = logging.getLogger("reembed")
+
+SHADOW = "embedding_next"
+PREVIOUS = "embedding_prev"
+
+
+def _columns(cur) -> set[str]:
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'chunks'"
+    )
+    return {r[0] for r in cur.fetchall()}
+
+
+def _write_shadow(cur, ids: list[int], vecs) -> None:
+    execute_values(
+        cur,
+        f"UPDATE chunks c SET {SHADOW} = v.e FROM (VALUES %s) AS v(id, e) WHERE c.id = v.id",
+        [(i, [float(x) for x in vec]) for i, vec in zip(ids, vecs)],
+        template="(%s, %s::double precision[])",
+    )
+
+
+def _fill_pass(conn, host: str, model: str, batch_size: int, workers: int, client: httpx.Client) -> int:
+    """Один проход по чанкам без теневого вектора. Возвращает число обработанных."""
+    reader = db.engine.raw_connection()
+    done = 0
+    t0 = time.perf_counter()
+    try:
+        cur = reader.cursor(name="reembed_chunks")  # серверный курсор, без загрузки всей таблицы
+        cur.itersize = batch_size * workers * 2
+        cur.execute(f"SELECT id, data FROM chunks WHERE {SHADOW} IS NULL ORDER BY id")
+
+        write = conn.cursor()
+        pending: deque = deque()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+
+            def flush_one() -> None:
+                nonlocal done
+                ids, fut = pending.popleft()
+                _write_shadow(write, ids, fut.result())
+                conn.commit()
+                done += len(ids)
+
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                ids = [r[0] for r in rows]
+                fut = pool.submit(embed_batch, [r[1] for r in rows], host=host, model=model, client=client)
+                pending.append((ids, fut))
+                if len(pending) >= workers * 2:
+                    flush_one()
+                    _log_progress(done, t0)
+            while pending:
+                flush_one()
+        _log_progress(done, t0)
+    finally:
+        reader.rollback()
+        reader.close()
+    return done
+
+
+def _log_progress(done: int, t0: float) -> None:
+    elapsed = time.perf_counter() - t0
+    if done:
+        log.info("re-embedded %s chunks, %.1f chunks/s", done, done / elapsed if elapsed > 0 else 0.0)
+
+
+def run(host: str, model: str, batch_size: int, workers: int, restart: bool, flip_after: bool, generation: Optional[str]) -> None:
+    db.ensure_generation_table()
+    conn = db.engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"ALTER TABLE chunks ADD COLUMN IF NOT EXISTS {SHADOW} double precision[]")
+        if restart:
+            cur.execute(f"UPDATE chunks SET {SHADOW} = NULL")
+        conn.commit()
+
+        with httpx.Client(timeout=RUBERT_EMBEDDER.timeout) as client:
+            # догоняем чанки, загруженные во время пересчёта; перед flip остаток не больше одного круга батчей
+            small_tail = batch_size * workers if flip_after else 0
+            while _fill_pass(conn, host, model, batch_size, workers, client) > small_tail:
+                pass
+            if flip_after:
+                flip(conn, generation or f"{model}@{host} {datetime.now(tz=timezone.utc):%Y-%m-%d %H:%M}",
+                     host=host, model=model, batch_size=batch_size, client=client)
+    finally:
+        conn.close()
+
+
+def _fill_tail(cur, host: str, model: str, batch_size: int, client: httpx.Client) -> int:
+    """Чанки без теневого вектора под блокировкой flip, батчами по batch_size."""
+    cur.execute(f"SELECT id, data FROM chunks WHERE {SHADOW} IS NULL ORDER BY id")
+    tail = cur.fetchall()
+    for i in range(0, len(tail), batch_size):
+        batch = tail[i:i + batch_size]
+        vecs = embed_batch([r[1] for r in batch], host=host, model=model, client=client)
+        _write_shadow(cur, [r[0] for r in batch], vecs)
+    return len(tail)
+
+
+def flip(conn, generation: str, host: str, model: str, batch_size: int, client: httpx.Client) -> None:
+    """
+    Атомарно делает теневую колонку активной и записывает её host/model в embedding_generations.
+    Загрузка документов ждёт только на время хвоста и переименования.
+    """
+    cur = conn.cursor()
+    try:
+        # сначала поколение, потом chunks — в том же порядке, что ingest.py: без взаимной блокировки
+        cur.execute("LOCK TABLE embedding_generations IN EXCLUSIVE MODE")
+        cur.execute("LOCK TABLE chunks IN SHARE ROW EXCLUSIVE MODE")
+        tail = _fill_tail(cur, host, model, batch_size, client)
+        cur.execute(f"ALTER TABLE chunks DROP COLUMN IF EXISTS {PREVIOUS}")
+        cur.execute(f"ALTER TABLE chunks RENAME COLUMN embedding TO {PREVIOUS}")
+        cur.execute(f"ALTER TABLE chunks ALTER COLUMN {PREVIOUS} DROP NOT NULL")
+        cur.execute(f"ALTER TABLE chunks RENAME COLUMN {SHADOW} TO embedding")
+        cur.execute("ALTER TABLE chunks ALTER COLUMN embedding SET NOT NULL")
+        cur.execute("DELETE FROM embedding_generations WHERE slot = 'previous'")
+        cur.execute("UPDATE embedding_generations SET slot = 'previous' WHERE slot = 'active'")
+        cur.execute(
+            "INSERT INTO embedding_generations (slot, label, host, model) VALUES ('active', %s, %s, %s)",
+            (generation, host, model),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    log.info("Active embedding generation: %s (tail of %s chunks embedded under lock)", generation, tail)
+
+
+def rollback() -> None:
+    """Возвращает предыдущее поколение (embedding_prev) в chunks.embedding."""
+    db.ensure_generation_table()
+    conn = db.engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        if PREVIOUS not in _columns(cur):
+            raise SystemExit("No previous embedding generation to roll back to")
+        cur.execute("LOCK TABLE embedding_generations IN EXCLUSIVE MODE")
+        cur.execute("LOCK TABLE chunks IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute(f"SELECT count(*) FROM chunks WHERE {PREVIOUS} IS NULL")
+        if cur.fetchone()[0]:
+            raise SystemExit("Chunks added after the flip have no previous embedding; re-run instead")
+        cur.execute(f"ALTER TABLE chunks DROP COLUMN IF EXISTS {SHADOW}")
+        cur.execute("ALTER TABLE chunks DROP COLUMN embedding")
+        cur.execute(f"ALTER TABLE chunks RENAME COLUMN {PREVIOUS} TO embedding")
+        cur.execute("ALTER TABLE chunks ALTER COLUMN embedding SET NOT NULL")
+        # без записи 'previous' откатились к начальному поколению (RUBERT_*)
+        cur.execute("DELETE FROM embedding_generations WHERE slot = 'active'")
+        cur.execute("UPDATE embedding_generations SET slot = 'active' WHERE slot = 'previous'")
+        conn.commit()
+        log.info("Rolled back to the previous embedding generation")
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def status() -> None:
+    db.ensure_generation_table()
+    conn = db.engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cols = _columns(cur)
+        cur.execute("SELECT slot, generation, label, model, host, activated_at FROM embedding_generations")
+        slots = {r[0]: r[1:] for r in cur.fetchall()}
+        for slot in ("active", "previous"):
+            if slot in slots:
+                gen, label, model, host, at = slots[slot]
+                log.info("%s: #%s %s (%s@%s, since %s)", slot.capitalize(), gen, label, model, host, f"{at:%Y-%m-%d %H:%M}")
+        if "active" not in slots:
+            log.info("Active: initial generation (%s@%s)", RUBERT_EMBEDDER.model, RUBERT_EMBEDDER.host)
+        if SHADOW in cols:
+            cur.execute(f"SELECT count(*), count({SHADOW}) FROM chunks")
+            total, filled = cur.fetchone()
+            log.info("Shadow %s: %s / %s chunks", SHADOW, filled, total)
+        log.info("Previous generation kept: %s", PREVIOUS in cols)
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пересчёт эмбеддингов чанков без простоя")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_run = sub.add_parser("run", help="заполнить теневую колонку и переключить поколение")
+    p_run.add_argument("--host", default=RUBERT_EMBEDDER.host, help="Triton с новой моделью")
+    p_run.add_argument("--model", default=RUBERT_EMBEDDER.model)
+    p_run.add_argument("--batch-size", type=int, default=INGEST.batch_size)
+    p_run.add_argument("--workers", type=int, default=4)
+    p_run.add_argument("--generation", default=None, help="метка поколения (по умолчанию model@host + дата)")
+    p_run.add_argument("--restart", action="store_true", help="пересчитать всё заново, а не продолжить")
+    p_run.add_argument("--no-flip", action="store_true", help="только заполнить теневую колонку")
+    sub.add_parser("status", help="прогресс и активное поколение")
+    sub.add_parser("rollback", help="вернуть предыдущее поколение")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if args.cmd == "run":
+        run(args.host, args.model, args.batch_size, args.workers, args.restart, not args.no_flip, args.generation)
+    elif args.cmd == "status":
+        status()
+    else:
+        rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Переранжирование найденных фрагментов кросс-энкодером (reranker-triton).
+
+Поиск возвращает RERANKER_CANDIDATES чанков, chunk_reranker оценивает каждую
+пару «вопрос + фрагмент», и в pack_context уходят RERANKER_TOP_N лучших:
+промпт короче, prefill Qwen на CPU быстрее. На всё — не больше RERANKER_BUDGET
+секунд; не успел, ошибка или открытый breaker — чанки остаются в порядке
+поиска, запрос не ждёт и не падает.
+"""
+from __future__ import annotations
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+import telemetry
+import upstream
+from configs import RERANKER
+
+_pool = ThreadPoolExecutor(max_workers=RERANKER.workers, thread_name_prefix="rerank")
+
+
+def _scores(query: str, texts: List[str]) -> np.ndarray:
+    payload = {
+        "inputs": [
+            {"name": "QUERY", "shape": [1], "datatype": "BYTES", "data": [query]},
+            {"name": "TEXT", "shape": [len(texts)], "datatype": "BYTES", "data": texts},
+        ],
+        "outputs": [{"name": "SCORES"}],
+    }
+    r = upstream.reranker.request("POST", f"/v2/models/{RERANKER.model}/infer", json=payload)
+    out = next(o for o in r.json()["outputs"] if o["name"] == "SCORES")
+    scores = np.asarray(out["data"], dtype=np.float32).reshape(-1)
+    if len(scores) != len(texts):
+        raise ValueError(f"expected {len(texts)} scores, got {len(scores)}")
+    return scores
+
+
+def rerank(query: str, chunks: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Чанки по убыванию оценки кросс-энкодера, score — эта оценка.
+    None — переранжирование не уложилось в бюджет или не удалось (порядок поиска).
+    """
+    items = [c for c in chunks if (c.get("data") or "").strip()]
+    if upstream.reranker is None or not items:
+        return None
+    future = _pool.submit(contextvars.copy_context().run, _scores, query, [c["data"].strip() for c in items])
+    try:
+        scores = future.result(timeout=RERANKER.budget)
+    except FutureTimeout:
+        # запрос дорабатывает в фоне (его timeout — тот же бюджет), ответ не нужен
+        telemetry.RERANK.labels("timeout").inc()
+        return None
+    except upstream.CircuitOpenError:
+        telemetry.RERANK.labels("circuit_open").inc()
+        return None
+    except (httpx.HTTPError, KeyError, StopIteration, ValueError):
+        telemetry.RERANK.labels("error").inc()
+        return None
+    telemetry.RERANK.labels("reranked").inc()
+    order = np.argsort(-scores, kind="stable")
+    return [dict(items[i], score=float(scores[i])) for i in order]
+
+
+def shutdown() -> None:
+    _pool.shutdown(wait=False, cancel_futures=True)
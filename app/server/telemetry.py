@@ -0,0 +1,253 @@
+"""
+Метрики Prometheus и трассировка OpenTelemetry для шлюза.
+
+Стадии /pipeline пишутся в гистограмму gateway_stage_seconds{stage}, вызовы
+Triton / factor-dev — в gateway_upstream_* (статус, повторы, латентность,
+запросы в работе). OpenTelemetry необязателен: без SDK спаны не пишутся,
+но W3C traceparent из входящего запроса всё равно пробрасывается в Triton;
+экспорт спанов — при заданном OTEL_EXPORTER_OTLP_ENDPOINT.
+"""
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily
+
+from configs import TELEMETRY
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+except ImportError:  # трассировка выключена
+    otel_context = propagate = trace = None
+
+STAGES = ("tokenize", "prefilter", "toxicity", "jailbreak", "moderation", "embed", "factors", "knn", "rerank", "context", "llm", "postprocess")
+
+# от единиц миллисекунд (knn, factors) до минут (генерация Qwen на CPU)
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    "gateway_stage_seconds", "Длительность стадии /pipeline", ["stage"], buckets=_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "gateway_request_seconds", "Длительность HTTP-запроса к шлюзу", ["route", "method", "status"], buckets=_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge("gateway_requests_in_flight", "HTTP-запросы шлюза в обработке")
+
+UPSTREAM_REQUESTS = Counter(
+    "gateway_upstream_requests_total", "Запросы к внешним сервисам по HTTP-статусу", ["upstream", "status"]
+)
+UPSTREAM_RETRIES = Counter("gateway_upstream_retries_total", "Повторные попытки запросов к сервисам", ["upstream"])
+UPSTREAM_SECONDS = Histogram(
+    "gateway_upstream_seconds", "Латентность одной попытки запроса к сервису", ["upstream"], buckets=_BUCKETS
+)
+UPSTREAM_IN_FLIGHT = Gauge("gateway_upstream_in_flight", "Запросы к сервису в работе", ["upstream"])
+UPSTREAM_HEDGES = Counter("gateway_upstream_hedges_total", "Хеджированные запросы на вторую реплику", ["upstream"])
+UPSTREAM_RETRY_BUDGET_EXHAUSTED = Counter(
+    "gateway_upstream_retry_budget_exhausted_total", "Повторы, не сделанные из-за исчерпанного бюджета", ["upstream"]
+)
+UPSTREAM_BREAKER_STATE = Gauge(
+    "gateway_upstream_breaker_state", "Circuit breaker: 0 closed, 1 half-open, 2 open", ["upstream"]
+)
+UPSTREAM_BREAKER_OPENED = Counter("gateway_upstream_breaker_opened_total", "Размыкания circuit breaker", ["upstream"])
+REPLICA_OUTSTANDING = Gauge("gateway_upstream_replica_outstanding", "Запросы в работе на реплике", ["upstream", "replica"])
+REPLICA_UP = Gauge("gateway_upstream_replica_up", "Реплика в балансировке (1) или исключена (0)", ["upstream", "replica"])
+REPLICA_EJECTIONS = Counter(
+    "gateway_upstream_replica_ejections_total", "Исключения реплики: reason=errors|health", ["upstream", "replica", "reason"]
+)
+
+TOXICITY_PREFILTER = Counter(
+    "gateway_toxicity_prefilter_total", "Решения каскада перед xlmr_toxicity: clean|toxic|escalate", ["decision"]
+)
+
+LLM_ADMISSION = Counter(
+    "gateway_llm_admission_total",
+    "Решения допуска к генерации: admitted или shed_* (деградированный ответ)",
+    ["result", "priority"],
+)
+LLM_INVALID_TOKEN = Counter(
+    "gateway_llm_invalid_token_total", "Невалидные или просроченные токены в /pipeline: приоритет анонимный"
+)
+LLM_QUEUE_WAIT = Histogram("gateway_llm_queue_wait_seconds", "Ожидание слота генерации", buckets=_BUCKETS)
+LLM_QUEUE_DEPTH = Gauge("gateway_llm_queue_depth", "Запросы в очереди к LLM")
+LLM_ACTIVE = Gauge("gateway_llm_active", "Генерации в работе")
+CONTEXT_TOKENS = Histogram(
+    "gateway_context_tokens", "Токены фрагментов RAG в промпте LLM (context.py)",
+    buckets=(64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096),
+)
+CONTEXT_DUPLICATES = Counter("gateway_context_duplicates_total", "Почти-дубликаты, выкинутые из контекста")
+RERANK = Counter(
+    "gateway_rerank_total", "Переранжирование фрагментов: reranked или timeout|error|circuit_open (порядок поиска)",
+    ["result"],
+)
+
+for _stage in STAGES:
+    STAGE_SECONDS.labels(_stage)
+
+
+# --------- Кэши ----------
+class _CacheCollector:
+    """Счётчики попаданий lru_cache читаются из cache_info() в момент scrape."""
+
+    def __init__(self):
+        self._caches: Dict[str, Callable] = {}
+        self._gauges: Optional[tuple[Gauge, Gauge]] = None
+        self._synced = 0.0
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            # collect() видит только воркер, отдающий /metrics: каждый воркер сам пишет cache_info() в gauge-файлы
+            # multiprocess-режима, /metrics суммирует их по воркерам
+            self._gauges = (
+                Gauge("gateway_cache_hits_total", "Попадания в кэш", ["cache"], multiprocess_mode="sum", registry=None),
+                Gauge("gateway_cache_misses_total", "Промахи кэша", ["cache"], multiprocess_mode="sum", registry=None),
+            )
+
+    def register(self, name: str, cached: Callable) -> None:
+        self._caches[name] = cached
+
+    def sync(self, min_interval: float) -> None:
+        """Multiprocess-режим: cache_info() этого воркера в gauge-файлы, не чаще раза в min_interval секунд."""
+        now = time.monotonic()
+        if self._gauges is None or now - self._synced < min_interval:
+            return
+        self._synced = now
+        hits, misses = self._gauges
+        for name, cached in self._caches.items():
+            info = cached.cache_info()
+            hits.labels(name).set(info.hits)
+            misses.labels(name).set(info.misses)
+
+    def collect(self):
+        hits = CounterMetricFamily("gateway_cache_hits", "Попадания в кэш", labels=["cache"])
+        misses = CounterMetricFamily("gateway_cache_misses", "Промахи кэша", labels=["cache"])
+        for name, cached in self._caches.items():
+            info = cached.cache_info()
+            hits.add_metric([name], info.hits)
+            misses.add_metric([name], info.misses)
+        yield hits
+        yield misses
+
+
+_caches = _CacheCollector()
+REGISTRY.register(_caches)
+
+
+def register_cache(name: str, cached: Callable) -> None:
+    """Публикует hit/miss функции под lru_cache как gateway_cache_{hits,misses}_total{cache=name}."""
+    _caches.register(name, cached)
+
+
+def sync_caches() -> None:
+    """Вызывается после каждого HTTP-запроса: в multiprocess-режиме hit/miss воркеров попадают в /metrics."""
+    _caches.sync(min_interval=1.0)
+
+
+# --------- Трассировка ----------
+_tracer = None
+
+
+def setup_tracing() -> None:
+    """
+    Спаны пишет OpenTelemetry SDK; экспорт по OTLP — только при OTEL_EXPORTER_OTLP_ENDPOINT.
+    Без SDK пробрасывается лишь traceparent входящего запроса.
+    """
+    global _tracer
+    if trace is None:
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": TELEMETRY.service_name}))
+    if TELEMETRY.otlp_endpoint:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("gateway")
+
+
+@contextmanager
+def span(name: str, context=None, **attributes) -> Iterator[None]:
+    if _tracer is not None:
+        with _tracer.start_as_current_span(name, context=context, attributes=attributes or None):
+            yield
+    elif context is not None and otel_context is not None:
+        token = otel_context.attach(context)
+        try:
+            yield
+        finally:
+            otel_context.detach(token)
+    else:
+        yield
+
+
+def extract_context(headers) -> Optional[object]:
+    """Контекст трассы из заголовков входящего запроса (traceparent/tracestate)."""
+    if propagate is None:
+        return None
+    return propagate.extract(headers)
+
+
+def trace_headers() -> Dict[str, str]:
+    """Заголовки traceparent/tracestate текущего спана для вызова Triton."""
+    carrier: Dict[str, str] = {}
+    if propagate is not None:
+        propagate.inject(carrier)
+    return carrier
+
+
+# --------- Стадии и вызовы сервисов ----------
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        with span(f"pipeline.{name}"):
+            yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - t0)
+
+
+@contextmanager
+def upstream_attempt(upstream: str) -> Iterator[dict]:
+    """
+    Одна попытка запроса к сервису. Вызывающий кладёт HTTP-статус в result["status"];
+    если не положил (исключение транспорта) — считается как status="error".
+    """
+    result = {"status": "error"}
+    UPSTREAM_IN_FLIGHT.labels(upstream).inc()
+    t0 = time.perf_counter()
+    try:
+        yield result
+    finally:
+        UPSTREAM_SECONDS.labels(upstream).observe(time.perf_counter() - t0)
+        UPSTREAM_IN_FLIGHT.labels(upstream).dec()
+        UPSTREAM_REQUESTS.labels(upstream, str(result["status"])).inc()
+
+
+def record_retry(upstream: str) -> None:
+    UPSTREAM_RETRIES.labels(upstream).inc()
+
+
+def render() -> tuple[bytes, str]:
+    """Тело и Content-Type для /metrics (multiprocess-режим при PROMETHEUS_MULTIPROC_DIR)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        _caches.sync(min_interval=0.0)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,108 @@
+"""AdmissionController: сброс по оценке ожидания, по полной очереди и по таймауту, вытеснение менее важных."""
+import threading
+import time
+
+import pytest
+
+from admission import (
+    PRIORITY_ADMIN, PRIORITY_ANONYMOUS, PRIORITY_USER, AdmissionController, AdmissionRejected,
+)
+
+
+def _waiter(ctrl: AdmissionController, priority: int, outcome: dict) -> threading.Thread:
+    def run():
+        try:
+            ctrl._acquire(priority)
+            outcome[priority] = "admitted"
+        except AdmissionRejected as e:
+            outcome[priority] = e.reason
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_queued(ctrl: AdmissionController, n: int) -> None:
+    deadline = time.monotonic() + 5
+    while ctrl.snapshot()["waiting"] < n:
+        assert time.monotonic() < deadline, "request did not queue"
+        time.sleep(0.005)
+
+
+def test_free_slot_admits_immediately():
+    ctrl = AdmissionController(max_concurrency=2, max_queue=0, sla=1.0, service_time=10.0)
+    with ctrl.slot(PRIORITY_ANONYMOUS), ctrl.slot(PRIORITY_ANONYMOUS):
+        assert ctrl.snapshot()["active"] == 2
+    assert ctrl.snapshot()["active"] == 0
+
+
+def test_sheds_when_estimated_wait_exceeds_sla():
+    ctrl = AdmissionController(max_concurrency=1, max_queue=4, sla=1.0, service_time=5.0)
+    with ctrl.slot(PRIORITY_USER):
+        with pytest.raises(AdmissionRejected) as e:
+            ctrl._acquire(PRIORITY_USER)
+    assert e.value.reason == "shed_estimate"
+
+
+def test_sheds_when_queue_is_full():
+    ctrl = AdmissionController(max_concurrency=1, max_queue=0, sla=5.0, service_time=0.01)
+    with ctrl.slot(PRIORITY_USER):
+        with pytest.raises(AdmissionRejected) as e:
+            ctrl._acquire(PRIORITY_ADMIN)
+    assert e.value.reason == "shed_queue_full"
+
+
+def test_sheds_after_sla_in_queue():
+    ctrl = AdmissionController(max_concurrency=1, max_queue=1, sla=0.05, service_time=0.01)
+    with ctrl.slot(PRIORITY_USER):
+        with pytest.raises(AdmissionRejected) as e:
+            ctrl._acquire(PRIORITY_USER)
+        assert ctrl.snapshot()["waiting"] == 0
+    assert e.value.reason == "shed_timeout"
+
+
+def test_more_important_request_evicts_least_important():
+    ctrl = AdmissionController(max_concurrency=1, max_queue=1, sla=5.0, service_time=0.01)
+    outcome = {}
+    ctrl._acquire(PRIORITY_USER)
+    anonymous = _waiter(ctrl, PRIORITY_ANONYMOUS, outcome)
+    _wait_queued(ctrl, 1)
+    admin = _waiter(ctrl, PRIORITY_ADMIN, outcome)
+    anonymous.join(5)
+    assert outcome[PRIORITY_ANONYMOUS] == "shed_evicted"
+
+    ctrl._release(0.01)
+    admin.join(5)
+    assert outcome[PRIORITY_ADMIN] == "admitted"
+
+
+def test_equal_priority_is_not_evicted():
+    ctrl = AdmissionController(max_concurrency=1, max_queue=1, sla=5.0, service_time=0.01)
+    outcome = {}
+    ctrl._acquire(PRIORITY_ADMIN)
+    queued = _waiter(ctrl, PRIORITY_USER, outcome)
+    _wait_queued(ctrl, 1)
+    with pytest.raises(AdmissionRejected) as e:
+        ctrl._acquire(PRIORITY_USER)
+    assert e.value.reason == "shed_queue_full"
+
+    ctrl._release(0.01)
+    queued.join(5)
+    assert outcome[PRIORITY_USER] == "admitted"
+
+
+def test_queue_is_served_by_priority():
+    ctrl = AdmissionController(max_concurrency=1, max_queue=2, sla=5.0, service_time=0.01)
+    outcome = {}
+    ctrl._acquire(PRIORITY_USER)
+    anonymous = _waiter(ctrl, PRIORITY_ANONYMOUS, outcome)
+    _wait_queued(ctrl, 1)
+    admin = _waiter(ctrl, PRIORITY_ADMIN, outcome)
+    _wait_queued(ctrl, 2)
+
+    ctrl._release(0.01)
+    admin.join(5)
+    assert outcome == {PRIORITY_ADMIN: "admitted"}
+    ctrl._release(0.01)
+    anonymous.join(5)
+    assert outcome[PRIORITY_ANONYMOUS] == "admitted"
@@ -0,0 +1,91 @@
+"""pack_context: 0/1-рюкзак по токенам, схлопывание почти-дубликатов, обрезка единственного фрагмента."""
+import itertools
+import math
+import random
+
+import pytest
+
+import context
+from context import FRAGMENT_OVERHEAD, _knapsack, pack_context
+
+
+def _chunk(text, tokens, score=None):
+    return {"data": text, "token_count": tokens, "score": score}
+
+
+@pytest.fixture(autouse=True)
+def no_tokenizer(monkeypatch):
+    monkeypatch.setattr(context, "count_tokens", lambda texts: None)
+
+
+def test_knapsack_beats_greedy_by_relevance():
+    chunks = [
+        _chunk("отпуск оформляется заявлением в кадровом портале", 52, 1.0),
+        _chunk("больничный лист сдают в отдел кадров", 32, 0.6),
+        _chunk("пропуск в офис выдаёт служба безопасности", 32, 0.6),
+    ]
+    ctx, stats = pack_context(chunks, max_tokens=2 * (32 + FRAGMENT_OVERHEAD))
+    assert stats["fragments"] == 2
+    assert stats["tokens"] == 2 * (32 + FRAGMENT_OVERHEAD)
+    assert "отпуск" not in ctx
+    assert ctx.index("больничный") < ctx.index("пропуск")  # порядок релевантности сохраняется
+
+
+def test_knapsack_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(50):
+        n = rng.randint(1, 7)
+        weights = [rng.randint(1, 30) for _ in range(n)]
+        values = [rng.random() for _ in range(n)]
+        capacity = rng.randint(0, 60)
+        best = max(
+            (sum(values[i] for i in subset)
+             for r in range(n + 1) for subset in itertools.combinations(range(n), r)
+             if sum(weights[i] for i in subset) <= capacity),
+        )
+        chosen = _knapsack(weights, values, capacity)
+        assert chosen == sorted(set(chosen))
+        assert sum(weights[i] for i in chosen) <= capacity
+        assert sum(values[i] for i in chosen) == pytest.approx(best)
+
+
+def test_near_duplicates_collapse_into_most_relevant():
+    text = "Отпуск оформляется заявлением в кадровом портале за две недели до начала"
+    chunks = [
+        _chunk(text, 20, 0.9),
+        _chunk(text + ".", 20, 0.8),
+        _chunk("Больничный лист передаётся в отдел кадров в день выхода", 20, 0.7),
+    ]
+    ctx, stats = pack_context(chunks, max_tokens=1000)
+    assert stats["candidates"] == 3
+    assert stats["duplicates"] == 1
+    assert stats["fragments"] == 2
+    assert ctx.count("Отпуск") == 1
+
+
+def test_empty_chunks_are_skipped():
+    ctx, stats = pack_context([_chunk("  ", 1), _chunk(None, 1)], max_tokens=100)
+    assert ctx == ""
+    assert stats == {"candidates": 0, "duplicates": 0, "fragments": 0, "tokens": 0}
+
+
+def test_max_fragments_limits_candidates():
+    chunks = [_chunk(f"фрагмент номер {w} про отпуск", 5) for w in ("один", "два", "три")]
+    ctx, stats = pack_context(chunks, max_tokens=1000, max_fragments=2)
+    assert stats["fragments"] == 2
+    assert "три" not in ctx
+
+
+def test_oversized_fragment_is_truncated_to_budget():
+    text = "слово " * 200
+    ctx, stats = pack_context([_chunk(text, 400)], max_tokens=108)
+    assert stats["fragments"] == 1
+    assert stats["tokens"] == 108
+    body = ctx.split("\n", 1)[1]
+    assert len(body) == int(len(text.strip()) * 100 / 400)
+
+
+def test_missing_token_count_is_estimated_from_chars():
+    text = "а" * 250
+    _, stats = pack_context([_chunk(text, None)], max_tokens=1000)
+    assert stats["tokens"] == math.ceil(len(text) / context.CONTEXT.chars_per_token) + FRAGMENT_OVERHEAD
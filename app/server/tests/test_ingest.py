@@ -0,0 +1,76 @@
+"""Чанкинг с перекрытием, категория по имени файла и построчный поток для COPY — без БД и эмбеддера."""
+import pytest
+
+from ingest import _CopyStream, _copy_text, category_for_document, split_into_chunks
+
+LINES = [f"Вопрос {i} — ответ про отпуск и больничный номер {i}." for i in range(20)]
+
+
+def test_short_text_is_one_chunk():
+    assert split_into_chunks("  первая строка \n\n вторая строка ", chunk_size=100, overlap=10) == [
+        "первая строка\nвторая строка",
+    ]
+
+
+def test_chunks_respect_size_and_keep_every_line():
+    chunks = split_into_chunks("\n".join(LINES), chunk_size=200, overlap=60)
+    assert len(chunks) > 1
+    assert all(len(c) <= 200 for c in chunks)
+    seen = [line for c in chunks for line in c.split("\n")]
+    assert sorted(set(seen)) == sorted(LINES)
+
+
+def test_next_chunk_starts_with_tail_of_previous():
+    chunks = split_into_chunks("\n".join(LINES), chunk_size=200, overlap=60)
+    for prev, cur in zip(chunks, chunks[1:]):
+        head = cur.split("\n")[0]
+        assert prev.endswith(head)
+        assert len(head) < 60
+
+
+def test_no_overlap():
+    chunks = split_into_chunks("\n".join(LINES), chunk_size=200, overlap=0)
+    assert [line for c in chunks for line in c.split("\n")] == LINES
+
+
+def test_long_line_is_split_by_words():
+    words = [f"слово{i}" for i in range(100)]
+    chunks = split_into_chunks(" ".join(words), chunk_size=80, overlap=20)
+    assert len(chunks) > 1
+    assert all(len(c) <= 80 for c in chunks)
+    assert {w for c in chunks for w in c.split()} == set(words)
+
+
+def test_overlap_is_capped_at_half_chunk():
+    chunks = split_into_chunks("\n".join(LINES), chunk_size=200, overlap=10_000)
+    assert all(len(c) <= 200 for c in chunks)
+    assert len(chunks) < len(LINES)  # перекрытие не съедает всё окно
+
+
+def test_empty_text():
+    assert split_into_chunks(" \n\n ", chunk_size=100, overlap=10) == []
+
+
+@pytest.mark.parametrize("name, category", [
+    ("01_IT_FAQ_vpn.txt", "IT"),
+    ("docs/12_BUH_FAQ_avans.docx", "AD"),
+    ("3_FAQ_otpusk.txt", "HR"),
+    ("IT_FAQ.txt", None),
+    ("readme.md", None),
+])
+def test_category_for_document(name, category):
+    assert category_for_document(name) == category
+
+
+def test_copy_stream_reads_across_lines():
+    field = _copy_text("a\tb")
+    lines = [f"{i}\t{field}\n" for i in range(3)]
+    stream = _CopyStream(iter(lines))
+    parts = []
+    while True:
+        part = stream.read(5)
+        if not part:
+            break
+        assert len(part) <= 5
+        parts.append(part)
+    assert "".join(parts) == "".join(lines) == "0\ta\\tb\n1\ta\\tb\n2\ta\\tb\n"
@@ -0,0 +1,77 @@
+"""PasswordVerifier: ограничение очереди (HasherSaturated), таймаут без потери слота, async-проверка."""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pytest
+
+import passwords
+from passwords import HasherSaturated, PasswordVerifier, pwd_ctx
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    """Проверка в потоке вместо процесса; каждая висит, пока тест не откроет gate."""
+    opened = threading.Event()
+
+    def blocked(password, password_hash):
+        opened.wait(5)
+        return password == password_hash, 0.0
+
+    monkeypatch.setattr(passwords, "_verify_in_worker", blocked)
+    yield opened
+    opened.set()
+
+
+def _threaded(verifier: PasswordVerifier) -> PasswordVerifier:
+    pool = ThreadPoolExecutor(max_workers=8)
+    verifier._pool = lambda: pool
+    return verifier
+
+
+def test_rejects_beyond_workers_plus_queue(gate):
+    verifier = _threaded(PasswordVerifier(workers=1, max_queue=1, timeout=5))
+    pending = [verifier._submit("a", "a"), verifier._submit("b", "b")]
+    with pytest.raises(HasherSaturated):
+        verifier.verify("c", "c")
+    assert verifier.stats.snapshot()["rejected"] == 1
+
+    gate.set()
+    assert all(f.result(timeout=5)[0] for f in pending)
+    assert verifier.verify("d", "d") is True  # слоты вернулись после завершения проверок
+
+
+def test_timeout_keeps_slot_until_hash_finishes(gate):
+    verifier = _threaded(PasswordVerifier(workers=1, max_queue=0, timeout=0.05))
+    with pytest.raises(FutureTimeout):
+        verifier.verify("a", "a")
+    snapshot = verifier.stats.snapshot()
+    assert snapshot["timeouts"] == 1
+    assert snapshot["in_flight"] == 1
+    with pytest.raises(HasherSaturated):  # перестали ждать, но хэш ещё считается
+        verifier.verify("b", "b")
+
+    gate.set()
+    verifier.timeout = 5
+    for _ in range(100):
+        if verifier.stats.snapshot()["in_flight"] == 0:
+            break
+        threading.Event().wait(0.01)
+    assert verifier.verify("c", "c") is True
+
+
+def test_async_timeout_raises_future_timeout(gate):
+    verifier = _threaded(PasswordVerifier(workers=1, max_queue=0, timeout=0.05))
+    with pytest.raises(FutureTimeout):
+        asyncio.run(verifier.verify_async("a", "a"))
+    assert verifier.stats.snapshot()["timeouts"] == 1
+
+
+def test_verifies_bcrypt_hash():
+    verifier = _threaded(PasswordVerifier(workers=1, max_queue=0, timeout=30))
+    password_hash = pwd_ctx.hash("correct horse")
+    assert verifier.verify("correct horse", password_hash) is True
+    assert verifier.verify("wrong", password_hash) is False
+    assert verifier.verify("anything", None) is False
+    assert verifier.stats.snapshot()["completed"] == 2
@@ -0,0 +1,89 @@
+"""
+/pipeline на заглушках моделей (benchmarks.stubs): один запрос — одна генерация qwen_cpu,
+весь чат (system + user) — один элемент батча. БД не нужна: поиск подменяется.
+
+    cd app/server
+    python -m pytest tests
+"""
+import importlib
+import os
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+
+from benchmarks.stubs import DEFAULT_LATENCY, build_factors_app, build_triton_app, parse_latencies
+
+CHUNKS = [
+    {"id": 1, "data": "Отпуск оформляется заявлением в кадровом портале за две недели.", "token_count": None},
+    {"id": 2, "data": "Больничный лист передаётся в отдел кадров в день выхода на работу.", "token_count": None},
+]
+# в порядке зависимостей; app — последним
+RELOADED = ("configs", "upstream", "prefilter", "rerank", "vectorstore", "app")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(app) -> str:
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("stub server did not start")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture(scope="module")
+def stubs():
+    # нулевые задержки и без action_item: каждый запрос доходит до LLM
+    latencies = parse_latencies([f"{name}=const:0" for name in DEFAULT_LATENCY])
+    triton = _serve(build_triton_app(latencies))
+    factors = _serve(build_factors_app(latencies["factor-dev"], action_rate=0.0))
+    return triton, factors
+
+
+@pytest.fixture(scope="module")
+def gateway(stubs):
+    triton, factors = stubs
+    # configs читает окружение при импорте, а другие тесты могли импортировать его раньше:
+    # configs и модули, которые строят клиенты из его настроек, перезагружаются уже направленными на заглушки
+    with pytest.MonkeyPatch.context() as mp:
+        for name in ("TOXICITY_CLASSIFIER_HOST", "SENTINEL_CLASSIFIER_HOST", "RUBERT_HOST", "QWEN_URL"):
+            mp.setenv(name, triton)
+        mp.setenv("FACTORS_DEV_HOST", factors)
+        for name in ("MODERATION_HOST", "RERANKER_HOST", "TOXICITY_PREFILTER_PATH", "VECTOR_STORE"):
+            mp.setenv(name, "")
+        mp.setenv("RETRIEVAL_MODE", "vector")
+        for name in RELOADED:
+            importlib.reload(importlib.import_module(name))
+        gateway = importlib.import_module("app")
+        mp.setattr(gateway.db, "knn_search", lambda embedding, k, category=None: CHUNKS[:k])
+        mp.setattr(gateway.db, "active_generation", lambda: None)
+        yield triton, TestClient(gateway.app)
+
+
+def test_one_generation_per_pipeline_request(gateway):
+    triton, client = gateway
+    before = httpx.get(f"{triton}/stats").json()
+    queries = ["Как оформить отпуск?", "Куда сдать больничный?", "Сколько дней отпуска положено?"]
+    for query in queries:
+        r = client.get("/pipeline", params={"text": query})
+        assert r.status_code == 200
+        assert r.json()["info"] == "LLM answer"
+    stats = httpx.get(f"{triton}/stats").json()
+
+    requests = stats.get("qwen_cpu.requests", 0) - before.get("qwen_cpu.requests", 0)
+    items = stats.get("qwen_cpu.items", 0) - before.get("qwen_cpu.items", 0)
+    assert requests == len(queries)
+    assert items == len(queries)  # system и user — один чат, а не два элемента батча
@@ -0,0 +1,46 @@
+"""Пул соединений: настройки DATABASE_POOL_* доходят до engine, ожидание и таймауты checkout считаются."""
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+import database.baseclasses as db
+from configs import DATABASE
+
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_pre_ping_is_on_by_default():
+    env = {k: v for k, v in os.environ.items() if not k.startswith("DATABASE_POOL_")}
+    out = subprocess.run(
+        [sys.executable, "-c", "from configs import DATABASE; print(DATABASE.pool_pre_ping, DATABASE.pool_size)"],
+        env=env, capture_output=True, text=True, check=True, cwd=SERVER,
+    )
+    assert out.stdout.split() == ["True", "10"]
+
+
+def test_engine_uses_pool_settings():
+    pool = db.engine.pool
+    assert isinstance(pool, QueuePool)
+    assert pool.size() == DATABASE.pool_size
+    assert pool._max_overflow == DATABASE.max_overflow
+    assert pool._pre_ping == DATABASE.pool_pre_ping
+    assert pool._recycle == DATABASE.pool_recycle
+
+
+def test_timed_pool_counts_waits_and_timeouts():
+    pool = db._timed_pool(QueuePool)(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.05)
+    conn = pool.connect()
+    with pytest.raises(PoolTimeoutError):
+        pool.connect()
+    conn.close()
+    pool.connect().close()
+
+    snapshot = pool.stats.snapshot()
+    assert snapshot["checkouts"] == 3
+    assert snapshot["timeouts"] == 1
+    assert snapshot["wait_ms"]["max"] >= 50
@@ -0,0 +1,85 @@
+"""rerank: порядок по оценке кросс-энкодера; бюджет, ошибка или открытый breaker — None (порядок поиска)."""
+import threading
+
+import httpx
+import pytest
+
+import rerank
+import upstream
+
+CHUNKS = [{"id": i, "data": f"фрагмент {i}", "score": 1.0 / (60 + i)} for i in range(3)]
+
+
+class _Reranker:
+    def __init__(self, respond):
+        self.respond = respond
+
+    def request(self, method, path, **kwargs):
+        return self.respond(kwargs["json"])
+
+
+def _scores(*values):
+    return lambda payload: httpx.Response(200, json={"outputs": [{"name": "SCORES", "data": list(values)}]})
+
+
+def _raises(error):
+    def respond(payload):
+        raise error
+    return respond
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    def install(respond):
+        monkeypatch.setattr(upstream, "reranker", _Reranker(respond))
+    return install
+
+
+def test_orders_by_cross_encoder_score(reranker):
+    reranker(_scores(0.1, 0.9, 0.5))
+    out = rerank.rerank("вопрос", CHUNKS)
+    assert [c["id"] for c in out] == [1, 2, 0]
+    assert out[0]["score"] == pytest.approx(0.9)
+
+
+def test_sends_query_and_texts(reranker):
+    seen = {}
+
+    def respond(payload):
+        seen.update({i["name"]: i["data"] for i in payload["inputs"]})
+        return _scores(0.0, 0.0)(payload)
+
+    reranker(respond)
+    rerank.rerank("вопрос", [CHUNKS[0], {"id": 9, "data": "   "}, CHUNKS[1]])
+    assert seen == {"QUERY": ["вопрос"], "TEXT": ["фрагмент 0", "фрагмент 1"]}  # пустые не оцениваются
+
+
+def test_over_budget_falls_back(reranker, monkeypatch):
+    release = threading.Event()
+
+    def slow(payload):
+        release.wait(5)
+        return _scores(0.0, 0.0, 0.0)(payload)
+
+    reranker(slow)
+    monkeypatch.setattr(rerank.RERANKER, "budget", 0.05)
+    try:
+        assert rerank.rerank("вопрос", CHUNKS) is None
+    finally:
+        release.set()
+
+
+@pytest.mark.parametrize("respond", [
+    _scores(0.1, 0.2),                                     # оценок меньше, чем фрагментов
+    lambda payload: httpx.Response(200, json={"outputs": []}),
+    _raises(upstream.CircuitOpenError("chunk_reranker: circuit open")),
+    _raises(httpx.ConnectError("refused")),
+])
+def test_errors_fall_back(reranker, respond):
+    reranker(respond)
+    assert rerank.rerank("вопрос", CHUNKS) is None
+
+
+def test_disabled_reranker_falls_back(monkeypatch):
+    monkeypatch.setattr(upstream, "reranker", None)
+    assert rerank.rerank("вопрос", CHUNKS) is None
@@ -0,0 +1,97 @@
+"""
+CircuitBreaker, RetryBudget и повторы Upstream.request на httpx.MockTransport — без сети.
+Классы берутся из модуля при вызове: test_pipeline перезагружает upstream.
+"""
+import time
+
+import httpx
+import pytest
+
+import upstream
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = upstream.CircuitBreaker("test", failures=3, open_seconds=60)
+    for ok in (False, False, True, False, False):
+        breaker.record(ok)  # удачный ответ обнуляет счётчик подряд
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_allows_single_probe():
+    breaker = upstream.CircuitBreaker("test", failures=1, open_seconds=0.01)
+    breaker.record(False)
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # второй запрос ждёт исхода пробного
+
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = upstream.CircuitBreaker("test", failures=3, open_seconds=0.01)
+    for _ in range(3):
+        breaker.record(False)
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record(False)  # одной ошибки пробного достаточно
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_retry_budget_is_ratio_of_requests():
+    budget = upstream.RetryBudget(ratio=0.5, min_per_sec=0, window=10)
+    assert not budget.try_spend()
+    for _ in range(4):
+        budget.record_request()
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_retry_budget_window_expires():
+    budget = upstream.RetryBudget(ratio=0.0, min_per_sec=20, window=0.05)  # 20/с * 0.05 с = один повтор
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    time.sleep(0.06)
+    assert budget.try_spend()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(503)
+
+    monkeypatch.setattr(upstream, "_http", httpx.Client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(upstream, "_budget", upstream.RetryBudget(ratio=1.0, min_per_sec=100))
+    monkeypatch.setattr(upstream.UPSTREAM, "retry_backoff", 0.0)
+    svc = upstream.Upstream("test", ["http://replica"], timeout=1.0, retries=5)
+    svc.breaker = upstream.CircuitBreaker("test", failures=2, open_seconds=60)
+    return svc, calls
+
+
+def test_retries_stop_once_breaker_opens(service):
+    svc, calls = service
+    with pytest.raises(upstream.CircuitOpenError):
+        svc.request("GET", "/x")
+    assert len(calls) == 2  # вторая ошибка разомкнула breaker: остальные повторы не отправлены
+
+    with pytest.raises(upstream.CircuitOpenError):
+        svc.request("GET", "/x")
+    assert len(calls) == 2
+
+
+def test_retries_stop_when_budget_is_spent(service, monkeypatch):
+    svc, calls = service
+    svc.breaker = upstream.CircuitBreaker("test", failures=100, open_seconds=60)
+    monkeypatch.setattr(upstream, "_budget", upstream.RetryBudget(ratio=0.0, min_per_sec=0))
+    with pytest.raises(httpx.HTTPStatusError):
+        svc.request("GET", "/x")
+    assert len(calls) == 1
@@ -0,0 +1,125 @@
+"""Сжатый индекс: recall PCA/PQ с точным пересчётом, шард категории как в knn_search, поиск при смене поколения."""
+import numpy as np
+import pytest
+
+import vectorstore
+from benchmarks.vectorstore import _exact_topk, _queries, _recall, _synthetic
+from vectorstore import ChunkStore, CompressedIndex, PCACodec, PQCodec, load_codec, save_codec
+
+DIM = 312
+K = 5
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    x = _synthetic(4000, DIM, seed=0)
+    queries = _queries(x, 50, noise=0.1, seed=0)
+    kth, _ = _exact_topk(x, queries, K)
+    return x, queries, kth
+
+
+def _index(codec, x, categories=None):
+    index = CompressedIndex(codec, lambda ids: (ids, x[ids]))
+    ids = np.arange(len(x), dtype=np.int64)
+    index.add(ids, np.full(len(x), -1, dtype=np.int8) if categories is None else categories, x)
+    return index
+
+
+@pytest.mark.parametrize("fit", [
+    lambda x: PCACodec.fit(x, 64),
+    lambda x: PQCodec.fit(x, 26, bits=8, seed=0),
+], ids=["pca64", "pq26x8"])
+def test_recall_with_exact_rerank(corpus, fit):
+    x, queries, kth = corpus
+    index = _index(fit(x), x)
+    found = [np.array([i for i, _ in index.search(q, K, shortlist=100)]) for q in queries]
+    assert _recall(found, x, queries, kth, K) >= 0.95
+
+
+def test_pq_distances_match_reconstruction(corpus):
+    x, queries, _ = corpus
+    codec = PQCodec.fit(x[:1000], 26, bits=8, seed=0)
+    codes = codec.encode(x[:20])
+    dsub = codec.centroids.shape[2]
+    parts = [codec.centroids[j][codes[j]] for j in range(len(codec.centroids))]
+    rotated = np.concatenate(parts, axis=1)[:, :codec.rotation.shape[1]]
+    restored = rotated @ codec.rotation.T + codec.mean  # 312 = 26 * 12: поворот квадратный
+    assert dsub * len(codec.centroids) == DIM
+    expected = ((restored - queries[0]) ** 2).sum(1)
+    np.testing.assert_allclose(codec.distances(queries[0], codes), expected, rtol=1e-3, atol=1e-4)
+
+
+def test_pq_rejects_wide_codes(corpus):
+    with pytest.raises(ValueError):
+        PQCodec.fit(corpus[0][:100], 26, bits=9)
+
+
+@pytest.mark.parametrize("codec", [lambda x: PCACodec.fit(x, 16), lambda x: PQCodec.fit(x, 13, bits=4)],
+                         ids=["pca", "pq"])
+def test_codec_roundtrip(corpus, tmp_path, codec):
+    x = corpus[0][:500]
+    original = codec(x)
+    path = str(tmp_path / "codec.npz")
+    save_codec(original, path)
+    loaded = load_codec(path)
+    assert loaded.kind == original.kind
+    np.testing.assert_array_equal(loaded.encode(x), original.encode(x))
+
+
+def test_category_shard_needs_k_chunks(corpus):
+    x = corpus[0][:500]
+    categories = np.full(len(x), -1, dtype=np.int8)
+    categories[:10] = vectorstore.CATEGORIES.index("IT")
+    index = _index(PCACodec.fit(x, 32), x, categories)
+    query = x[100]
+
+    # в шарде 10 чанков: для k=5 ищем только в нём, shortlist ограничен размером шарда
+    in_shard = index.search(query, K, shortlist=50, category="IT")
+    assert len(in_shard) == K and all(i < 10 for i, _ in in_shard)
+    assert len(index.shortlist(query, 50, "IT", k=K)) == 10
+
+    # k больше шарда — как knn_search в Postgres, глобальный поиск
+    assert [i for i, _ in index.search(query, 11, shortlist=50, category="IT")][0] == 100
+    assert index.search(query, K, shortlist=50, category="HR")[0][0] == 100  # пустой шард
+
+
+@pytest.fixture
+def store(corpus, monkeypatch):
+    x = corpus[0][:200]
+    calls = {"knn_search": 0}
+
+    def knn_search(embedding, k, category=None):
+        calls["knn_search"] += 1
+        return [{"id": -1, "data": "postgres", "token_count": None}]
+
+    monkeypatch.setattr(vectorstore.db, "knn_search", knn_search)
+    monkeypatch.setattr(vectorstore.db, "fetch_chunks",
+                        lambda ids: [{"id": i, "data": f"chunk {i}", "token_count": None} for i in ids])
+    monkeypatch.setattr(vectorstore, "_generation", lambda: 1)
+    return ChunkStore(_index(PCACodec.fit(x, 32), x), generation=1), x, calls
+
+
+def test_search_uses_index_of_same_generation(store):
+    chunk_store, x, calls = store
+    rows = chunk_store.knn_search(x[7].tolist(), k=3, generation=1)
+    assert rows[0]["id"] == 7 and len(rows) == 3
+    assert calls["knn_search"] == 0
+
+
+def test_generation_mismatch_falls_back_to_postgres(store, monkeypatch):
+    chunk_store, x, calls = store
+    monkeypatch.setattr(vectorstore, "_generation", lambda: 2)
+    assert chunk_store.knn_search(x[7].tolist(), k=3, generation=2)[0]["data"] == "postgres"
+    assert calls["knn_search"] == 1
+    assert chunk_store._wake.is_set()  # пересборку делает фоновый поток, запрос её не ждёт
+
+    chunk_store._wake.clear()
+    assert chunk_store.refresh() == 0
+    assert chunk_store._wake.is_set()
+
+    rebuilt = _index(PCACodec.fit(x, 16), x)
+    monkeypatch.setattr(ChunkStore, "_load", staticmethod(lambda kind, codec_path="": (rebuilt, 2)))
+    chunk_store._rebuild()
+    assert chunk_store.index is rebuilt and chunk_store.generation == 2
+    assert chunk_store.knn_search(x[7].tolist(), k=3, generation=2)[0]["id"] == 7
+    assert calls["knn_search"] == 1
@@ -0,0 +1,48 @@
+"""
+Токенизация на шлюзе: сообщение токенизируется один раз, и те же
+INPUT_IDS / ATTENTION_MASK уходят вместо TEXT в модели из
+GATEWAY_TOKENIZER_MODELS (по умолчанию только xlmr_toxicity) — бэкенды
+пропускают свою токенизацию. Годится только для моделей с тем же токенизатором. Нужен пакет tokenizers
+(быстрый токенизатор HF на Rust, без transformers и torch).
+"""
+from __future__ import annotations
+
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from configs import GATEWAY_TOKENIZER
+
+
+class GatewayTokenizer:
+    def __init__(self, tokenizer, max_length: int):
+        # truncation в tokenizers учитывает служебные токены (<s> … </s>), как у AutoTokenizer в бэкендах
+        tokenizer.enable_truncation(max_length)
+        tokenizer.no_padding()
+        self._tokenizer = tokenizer
+        self.max_length = max_length
+
+    @classmethod
+    def load(cls, source: str, max_length: int) -> "GatewayTokenizer":
+        """source — tokenizer.json, каталог с ним (например, из model-cache) или id модели в hub."""
+        from tokenizers import Tokenizer
+
+        if os.path.isdir(source):
+            source = os.path.join(source, "tokenizer.json")
+        tokenizer = Tokenizer.from_file(source) if os.path.isfile(source) else Tokenizer.from_pretrained(source)
+        return cls(tokenizer, max_length)
+
+    def encode(self, text: str) -> np.ndarray:
+        return np.asarray(self._tokenizer.encode(text).ids, dtype=np.int64)
+
+    def count(self, texts: List[str]) -> List[int]:
+        """Число токенов каждого текста без служебных (не больше max_length)."""
+        return [len(e.ids) for e in self._tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+def load_configured() -> Optional[GatewayTokenizer]:
+    """Токенизатор из GATEWAY_TOKENIZER; None — выключено (бэкенды получают TEXT)."""
+    if not GATEWAY_TOKENIZER.source:
+        return None
+    return GatewayTokenizer.load(GATEWAY_TOKENIZER.source, GATEWAY_TOKENIZER.max_length)
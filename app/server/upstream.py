@@ -0,0 +1,386 @@
+"""
+Вызовы Triton и factor-dev: общий keep-alive клиент, метрики и traceparent,
+повторы в рамках глобального бюджета, circuit breaker на каждый сервис и
+хеджирование дешёвых вызовов (модерация, эмбеддинги) при нескольких репликах.
+
+Реплики балансируются на стороне шлюза (p2c или least outstanding по числу
+запросов в работе). Реплика исключается после нескольких ошибок подряд или
+неудачной проверки готовности и возвращается после удачной проверки или по
+истечении паузы; если исключены все — запросы идут на все.
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+import httpx
+
+import telemetry
+from configs import (
+    FACTORS_DEV, MODERATION, QWEN, RERANKER, RUBERT_EMBEDDER, SENTINEL_CLASSIFIER, TOXICITY_CLASSIFIER, UPSTREAM,
+)
+
+log = logging.getLogger(__name__)
+
+_http = httpx.Client()
+_hedge_pool = ThreadPoolExecutor(max_workers=UPSTREAM.hedge_workers, thread_name_prefix="hedge")
+
+RETRY_STATUSES = {502, 503, 504}
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Сервис недавно падал подряд — запрос не отправляется до конца паузы."""
+
+
+# --------- Бюджет повторов ----------
+class RetryBudget:
+    """
+    Общий на все сервисы бюджет повторов и хеджей за скользящее окно:
+    не больше ratio от числа запросов плюс min_per_sec, чтобы при перегрузке
+    повторы не умножали нагрузку.
+    """
+
+    def __init__(self, ratio: float, min_per_sec: float, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+
+    def _trim(self, now: float) -> None:
+        for q in (self._requests, self._retries):
+            while q and q[0] < now - self.window:
+                q.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if len(self._retries) >= self.ratio * len(self._requests) + self.min_per_sec * self.window:
+                return False
+            self._retries.append(now)
+            return True
+
+
+# --------- Circuit breaker ----------
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+
+class CircuitBreaker:
+    """failures подряд -> OPEN на open_seconds, затем один пробный запрос (HALF_OPEN)."""
+
+    def __init__(self, name: str, failures: int, open_seconds: float):
+        self.name = name
+        self.failures = max(1, failures)
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        telemetry.UPSTREAM_BREAKER_STATE.labels(name).set(CLOSED)
+
+    def _set(self, state: int) -> None:
+        self._state = state
+        telemetry.UPSTREAM_BREAKER_STATE.labels(self.name).set(state)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._set(HALF_OPEN)
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    @property
+    def state(self) -> str:
+        return ("closed", "half_open", "open")[self._state]
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            if ok:
+                self._consecutive = 0
+                if self._state != CLOSED:
+                    self._set(CLOSED)
+                return
+            self._consecutive += 1
+            if self._state == HALF_OPEN or self._consecutive >= self.failures:
+                if self._state != OPEN:
+                    telemetry.UPSTREAM_BREAKER_OPENED.labels(self.name).inc()
+                self._opened_at = time.monotonic()
+                self._set(OPEN)
+
+
+# --------- Реплики ----------
+class _Replica:
+    __slots__ = ("host", "outstanding", "failures", "ejected_until")
+
+    def __init__(self, host: str):
+        self.host = host
+        self.outstanding = 0
+        self.failures = 0            # ошибок подряд
+        self.ejected_until = 0.0     # monotonic; 0 — в балансировке
+
+
+# --------- Сервис ----------
+class _Latency:
+    """Скользящее окно удачных попыток — для задержки перед хеджем."""
+
+    def __init__(self, size: int = 256):
+        self._lock = threading.Lock()
+        self._values: deque = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._values)
+        if len(values) < 20:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Upstream:
+    def __init__(self, name: str, hosts: List[str], timeout: float, retries: int = UPSTREAM.retries,
+                 hedge: bool = False, health_path: str = "/v2/health/ready"):
+        self.name = name
+        self.hosts = hosts
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, UPSTREAM.connect_timeout))
+        self.retries = retries
+        self.hedge = hedge and len(hosts) > 1
+        self.health_path = health_path
+        self.breaker = CircuitBreaker(name, UPSTREAM.breaker_failures, UPSTREAM.breaker_open_seconds)
+        self._latency = _Latency()
+        self._lock = threading.Lock()
+        self._replicas = [_Replica(h) for h in hosts]
+        for h in hosts:
+            telemetry.REPLICA_UP.labels(name, h).set(1)
+
+    # ----- балансировка -----
+    def _pick(self, exclude: Optional[str] = None) -> _Replica:
+        """Выбирает реплику и сразу учитывает запрос в её outstanding (освобождает _release)."""
+        now = time.monotonic()
+        with self._lock:
+            others = [r for r in self._replicas if r.host != exclude] or self._replicas
+            pool = [r for r in others if r.ejected_until <= now] or others
+            if len(pool) == 1:
+                chosen = pool[0]
+            elif UPSTREAM.balancer == "least_outstanding":
+                low = min(r.outstanding for r in pool)
+                chosen = random.choice([r for r in pool if r.outstanding == low])
+            else:
+                a, b = random.sample(pool, 2)
+                chosen = a if a.outstanding <= b.outstanding else b
+            chosen.outstanding += 1
+        telemetry.REPLICA_OUTSTANDING.labels(self.name, chosen.host).inc()
+        return chosen
+
+    def _release(self, replica: _Replica, ok: bool) -> None:
+        telemetry.REPLICA_OUTSTANDING.labels(self.name, replica.host).dec()
+        now = time.monotonic()
+        with self._lock:
+            replica.outstanding -= 1
+            if not ok:
+                replica.failures += 1
+                if replica.failures >= UPSTREAM.eject_failures and replica.ejected_until <= now:
+                    self._eject(replica, "errors")
+                return
+            replica.failures = 0
+            reinstated = 0 < replica.ejected_until <= now  # пауза истекла, и реплика ответила
+            if reinstated:
+                replica.ejected_until = 0.0
+        if reinstated:
+            telemetry.REPLICA_UP.labels(self.name, replica.host).set(1)
+
+    def _eject(self, replica: _Replica, reason: str) -> None:
+        # вызывается под self._lock; одну реплику не исключаем — идти всё равно некуда
+        if len(self._replicas) < 2:
+            return
+        if replica.ejected_until <= time.monotonic():
+            telemetry.REPLICA_EJECTIONS.labels(self.name, replica.host, reason).inc()
+            telemetry.REPLICA_UP.labels(self.name, replica.host).set(0)
+            log.warning("%s: replica %s ejected (%s)", self.name, replica.host, reason)
+        replica.ejected_until = time.monotonic() + UPSTREAM.eject_seconds
+
+    def _reinstate(self, replica: _Replica) -> None:
+        with self._lock:
+            was_ejected = replica.ejected_until > 0
+            replica.ejected_until = 0.0
+            replica.failures = 0
+        if was_ejected:
+            telemetry.REPLICA_UP.labels(self.name, replica.host).set(1)
+            log.warning("%s: replica %s reinstated", self.name, replica.host)
+
+    def probe(self) -> None:
+        """Проверка готовности всех реплик (фоновый поток, см. start_health_checks)."""
+        for replica in self._replicas:
+            try:
+                ok = _http.get(replica.host + self.health_path, timeout=UPSTREAM.health_timeout).status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                self._reinstate(replica)
+            else:
+                with self._lock:
+                    self._eject(replica, "health")
+
+    # ----- запросы -----
+    def _attempt(self, replica: _Replica, method: str, path: str, **kwargs) -> httpx.Response:
+        url = replica.host + path
+        ok = False
+        try:
+            with telemetry.span(f"{self.name} {method}", **{"http.url": url}), \
+                    telemetry.upstream_attempt(self.name) as result:
+                t0 = time.perf_counter()
+                r = _http.request(method, url, timeout=self.timeout, headers=telemetry.trace_headers(), **kwargs)
+                result["status"] = r.status_code
+            ok = r.status_code < 500
+            if ok:
+                self._latency.add(time.perf_counter() - t0)
+            return r
+        finally:
+            self._release(replica, ok)
+
+    def _hedged(self, method: str, path: str, **kwargs) -> httpx.Response:
+        delay = self._latency.quantile(UPSTREAM.hedge_quantile)
+        if delay is None:
+            return self._attempt(self._pick(), method, path, **kwargs)
+        primary = self._pick()
+        first = _hedge_pool.submit(contextvars.copy_context().run, self._attempt, primary, method, path, **kwargs)
+        done, _ = wait([first], timeout=max(delay, UPSTREAM.hedge_min_delay))
+        if done or not _budget.try_spend():
+            return first.result()
+        telemetry.UPSTREAM_HEDGES.labels(self.name).inc()
+        second = _hedge_pool.submit(contextvars.copy_context().run, self._attempt, self._pick(exclude=primary.host),
+                                    method, path, **kwargs)
+        pending = {first, second}
+        last = first
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None and fut.result().status_code < 500:
+                    return fut.result()  # проигравший дорабатывает в фоне, ответ игнорируется
+                last = fut
+        return last.result()  # обе попытки неудачны: исключение или 5xx последней
+
+    def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Запрос к сервису; ошибки — как у httpx (raise_for_status), при открытом
+        breaker (в том числе перед повтором) — CircuitOpenError. Повторяются сбои
+        соединения и 502/503/504.
+        """
+        if not self.breaker.allow():
+            telemetry.UPSTREAM_REQUESTS.labels(self.name, "circuit_open").inc()
+            raise CircuitOpenError(f"{self.name}: circuit open")
+        _budget.record_request()
+        call = self._hedged if self.hedge else lambda m, p, **kw: self._attempt(self._pick(), m, p, **kw)
+        r: Optional[httpx.Response] = None
+        error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                if not _budget.try_spend():
+                    telemetry.UPSTREAM_RETRY_BUDGET_EXHAUSTED.labels(self.name).inc()
+                    break
+                time.sleep(UPSTREAM.retry_backoff * 2 ** (attempt - 1))
+                # прошлые попытки могли разомкнуть breaker: повторы не должны его обходить
+                if not self.breaker.allow():
+                    telemetry.UPSTREAM_REQUESTS.labels(self.name, "circuit_open").inc()
+                    raise CircuitOpenError(f"{self.name}: circuit open")
+                telemetry.record_retry(self.name)
+            try:
+                r, error = call(method, path, **kwargs), None
+            except RETRY_ERRORS as e:
+                self.breaker.record(False)
+                r, error = None, e
+                continue
+            except Exception:
+                self.breaker.record(False)
+                raise
+            self.breaker.record(r.status_code < 500)
+            if r.status_code not in RETRY_STATUSES:
+                break
+        if error is not None:
+            raise error
+        r.raise_for_status()
+        return r
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            replicas = [
+                {
+                    "host": r.host,
+                    "outstanding": r.outstanding,
+                    "failures": r.failures,
+                    "ejected_for_s": round(max(0.0, r.ejected_until - now), 1),
+                }
+                for r in self._replicas
+            ]
+        return {
+            "replicas": replicas,
+            "balancer": UPSTREAM.balancer,
+            "breaker": self.breaker.state,
+            "hedge": self.hedge,
+            "latency_p95_s": self._latency.quantile(0.95),
+        }
+
+
+_budget = RetryBudget(UPSTREAM.retry_budget_ratio, UPSTREAM.retry_budget_min_per_sec)
+
+toxicity = Upstream(TOXICITY_CLASSIFIER.model, TOXICITY_CLASSIFIER.hosts, TOXICITY_CLASSIFIER.timeout, hedge=True)
+sentinel = Upstream(SENTINEL_CLASSIFIER.model, SENTINEL_CLASSIFIER.hosts, SENTINEL_CLASSIFIER.timeout, hedge=True)
+moderation = Upstream(MODERATION.model, MODERATION.hosts, MODERATION.timeout, hedge=True) if MODERATION.hosts else None
+embedder = Upstream(RUBERT_EMBEDDER.model, RUBERT_EMBEDDER.hosts, RUBERT_EMBEDDER.timeout, hedge=True)
+factors = Upstream("factor-dev", FACTORS_DEV.hosts, FACTORS_DEV.timeout, health_path="/health")
+# переранжирование необязательно: повторять некогда, после бюджета — порядок поиска
+reranker = Upstream(RERANKER.model, RERANKER.hosts, RERANKER.budget, retries=0) if RERANKER.hosts else None
+# генерация дорогая — без повторов
+llm = Upstream(QWEN.model, QWEN.hosts, QWEN.timeout, retries=0)
+
+
+UPSTREAMS = tuple(u for u in (toxicity, sentinel, moderation, embedder, factors, reranker, llm) if u is not None)
+
+
+def snapshot() -> dict:
+    return {u.name: u.snapshot() for u in UPSTREAMS}
+
+
+_stop = threading.Event()
+
+
+def _health_loop() -> None:
+    while not _stop.wait(UPSTREAM.health_interval):
+        for u in UPSTREAMS:
+            if len(u.hosts) > 1:
+                u.probe()
+
+
+def start_health_checks() -> None:
+    if UPSTREAM.health_interval > 0 and any(len(u.hosts) > 1 for u in UPSTREAMS):
+        threading.Thread(target=_health_loop, name="upstream-health", daemon=True).start()
+
+
+def close() -> None:
+    _stop.set()
+    _hedge_pool.shutdown(wait=False, cancel_futures=True)
+    _http.close()
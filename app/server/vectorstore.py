@@ -0,0 +1,433 @@
+"""
+Сжатый векторный индекс чанков в памяти шлюза (VECTOR_STORE=pca | pq).
+
+knn_search в Postgres считает L2 по всем chunks.embedding (312 x float64,
+2.5 КБ на чанк) на каждый запрос. Здесь в памяти лежат только сжатые векторы:
+
+    pca  проекция на VECTOR_STORE_PCA_DIM главных компонент, float16;
+    pq   product quantization: вектор режется на VECTOR_STORE_PQ_SUBSPACES
+         частей, каждая — номер ближайшего из 2**VECTOR_STORE_PQ_BITS центроидов
+         (байт); расстояние до запроса — asymmetric distance computation:
+         таблица расстояний от частей запроса до центроидов и сумма по кодам.
+
+По сжатым векторам отбирается VECTOR_STORE_SHORTLIST кандидатов, их полные
+эмбеддинги читаются из chunks по первичному ключу, и top-k считается точно.
+Кодек обучается на чанках при старте или берётся из VECTOR_STORE_PATH
+(python -m vectorstore --out codec.npz); новые чанки дописываются в индекс
+фоновым потоком раз в VECTOR_STORE_REFRESH_SECONDS; при смене поколения
+эмбеддингов (reembed.py) он же пересобирает индекс с новым кодеком, а поиск
+до конца сборки идёт в Postgres. Память и recall@5 против точного поиска —
+python -m benchmarks.vectorstore.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import database.baseclasses as db
+from configs import VECTOR_STORE
+from database.baseclasses import CATEGORIES
+
+log = logging.getLogger(__name__)
+_KMEANS_ITERS = 20
+
+
+def _kmeans(x: np.ndarray, k: int, rng: np.random.Generator, iters: int = _KMEANS_ITERS) -> np.ndarray:
+    """Центроиды Ллойда по L2; пустой кластер получает случайную точку."""
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        d = (x * x).sum(1)[:, None] - 2.0 * x @ centroids.T + (centroids * centroids).sum(1)[None, :]
+        assign = d.argmin(1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+    return centroids
+
+
+class PCACodec:
+    """Проекция на главные компоненты, хранение во float16."""
+
+    kind = "pca"
+    axis = 0  # ось чанков в массиве кодов
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)  # [dim, D]
+
+    @classmethod
+    def fit(cls, x: np.ndarray, dim: int, seed: int = 0) -> "PCACodec":
+        mean = x.mean(0)
+        _, _, vt = np.linalg.svd(x - mean, full_matrices=False)
+        return cls(mean, vt[:min(dim, vt.shape[0])])
+
+    @property
+    def code_bytes(self) -> int:
+        return self.components.shape[0] * 2
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        return ((np.asarray(x, dtype=np.float32) - self.mean) @ self.components.T).astype(np.float16)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # L2 в подпространстве компонент: остатки вне него не учитываются — у запроса он общий для всех,
+        # у чанков свой, поэтому порядок приближённый и top-k уточняется по полным векторам
+        q = (np.asarray(query, dtype=np.float32) - self.mean) @ self.components.T
+        diff = codes.astype(np.float32) - q
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"mean": self.mean, "components": self.components}
+
+
+class PQCodec:
+    """
+    Product quantization: вектор поворачивается в базис главных компонент так, чтобы
+    дисперсия делилась между подпространствами поровну (иначе первое, с основной
+    дисперсией, квантуется грубо, а центроиды хвостовых тратятся на шум), и режется
+    на m подпространств по dsub координат; в каждом 2**bits центроидов, код — байт.
+    """
+
+    kind = "pq"
+    axis = 1  # коды хранятся по подпространствам [m, n]: take по строке — непрерывная память
+
+    def __init__(self, mean: np.ndarray, rotation: np.ndarray, centroids: np.ndarray):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.rotation = np.asarray(rotation, dtype=np.float32)    # [D, m * dsub], ортонормированные столбцы
+        self.centroids = np.asarray(centroids, dtype=np.float32)  # [m, ks, dsub]
+
+    @classmethod
+    def fit(cls, x: np.ndarray, subspaces: int, bits: int = 8, seed: int = 0) -> "PQCodec":
+        if not 1 <= bits <= 8:
+            raise ValueError(f"PQ bits must be 1..8, got {bits}")
+        x = np.asarray(x, dtype=np.float32)
+        mean = x.mean(0)
+        eigvals, eigvecs = np.linalg.eigh(np.cov(x - mean, rowvar=False))
+        rotation = cls._balance(eigvals, eigvecs, subspaces)
+        rng = np.random.default_rng(seed)
+        ks = min(2 ** bits, len(x))
+        parts = cls._split((x - mean) @ rotation, subspaces)
+        return cls(mean, rotation, np.stack([_kmeans(p, ks, rng) for p in parts]))
+
+    @staticmethod
+    def _balance(eigvals: np.ndarray, eigvecs: np.ndarray, m: int) -> np.ndarray:
+        """Собственные векторы по подпространствам: очередной (по убыванию дисперсии) — в то, где произведение дисперсий меньше."""
+        dim = len(eigvals)
+        dsub = -(-dim // m)
+        buckets: List[List[int]] = [[] for _ in range(m)]
+        log_var = np.zeros(m)
+        for i in np.argsort(eigvals)[::-1]:
+            open_ = [j for j in range(m) if len(buckets[j]) < dsub]
+            j = min(open_, key=lambda b: log_var[b])
+            buckets[j].append(int(i))
+            log_var[j] += np.log(max(float(eigvals[i]), 1e-12))
+        # недостающие до m * dsub координаты — нулевые столбцы
+        rotation = np.zeros((dim, m * dsub), dtype=np.float32)
+        for j, bucket in enumerate(buckets):
+            rotation[:, j * dsub:j * dsub + len(bucket)] = eigvecs[:, bucket]
+        return rotation
+
+    @staticmethod
+    def _split(x: np.ndarray, m: int) -> List[np.ndarray]:
+        dsub = x.shape[1] // m
+        return [x[:, j * dsub:(j + 1) * dsub] for j in range(m)]
+
+    @property
+    def code_bytes(self) -> int:
+        return self.centroids.shape[0]
+
+    def encode(self, x: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        codes = np.empty((self.centroids.shape[0], len(x)), dtype=np.uint8)
+        for start in range(0, len(x), batch_size):  # матрица расстояний батча — batch x 2**bits
+            parts = self._split((x[start:start + batch_size] - self.mean) @ self.rotation, self.centroids.shape[0])
+            for j, (p, c) in enumerate(zip(parts, self.centroids)):
+                d = (p * p).sum(1)[:, None] - 2.0 * p @ c.T + (c * c).sum(1)[None, :]
+                codes[j, start:start + len(p)] = d.argmin(1)
+        return codes
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # ADC: таблица расстояний от частей запроса до центроидов, сумма по кодам чанка;
+        # поворот ортонормированный — L2 те же, что в исходном пространстве
+        q = (np.asarray(query, dtype=np.float32).reshape(1, -1) - self.mean) @ self.rotation
+        tables = [((c - p) ** 2).sum(1) for p, c in zip(self._split(q, self.centroids.shape[0]), self.centroids)]
+        d = tables[0].take(codes[0])
+        for table, row in zip(tables[1:], codes[1:]):
+            d += table.take(row)
+        return d
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"mean": self.mean, "rotation": self.rotation, "centroids": self.centroids}
+
+
+def fit_codec(kind: str, x: np.ndarray, seed: int = 0):
+    sample = x
+    if len(x) > VECTOR_STORE.train_size:
+        sample = x[np.random.default_rng(seed).choice(len(x), VECTOR_STORE.train_size, replace=False)]
+    if kind == "pca":
+        return PCACodec.fit(sample, VECTOR_STORE.pca_dim, seed)
+    if kind == "pq":
+        return PQCodec.fit(sample, VECTOR_STORE.pq_subspaces, VECTOR_STORE.pq_bits, seed)
+    raise ValueError(f"Unknown VECTOR_STORE: {kind!r} (expected pca or pq)")
+
+
+def save_codec(codec, path: str) -> None:
+    np.savez(path, kind=codec.kind, **codec.arrays())
+
+
+def load_codec(path: str):
+    with np.load(path) as data:
+        kind = str(data["kind"])
+        if kind == "pca":
+            return PCACodec(data["mean"], data["components"])
+        if kind == "pq":
+            return PQCodec(data["mean"], data["rotation"], data["centroids"])
+    raise ValueError(f"Unknown codec kind in {path}: {kind!r}")
+
+
+class CompressedIndex:
+    """
+    Сжатые векторы чанков с id и категорией. search() — кандидаты по сжатым
+    векторам и точный top-k по полным векторам от full(ids) -> (найденные ids, [n, D]).
+    """
+
+    def __init__(self, codec, full: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]):
+        self.codec = codec
+        self._full = full
+        self._lock = threading.Lock()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.categories = np.empty(0, dtype=np.int8)
+        self.codes: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.categories.nbytes + (self.codes.nbytes if self.codes is not None else 0)
+
+    def add(self, ids: np.ndarray, categories: np.ndarray, vectors: np.ndarray) -> None:
+        codes = self.codec.encode(vectors)
+        with self._lock:  # поиск видит либо старые массивы, либо новые целиком
+            self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+            self.categories = np.concatenate([self.categories, np.asarray(categories, dtype=np.int8)])
+            self.codes = codes if self.codes is None else np.concatenate([self.codes, codes], axis=self.codec.axis)
+
+    def shortlist(self, query: np.ndarray, n: int, category: Optional[str] = None, k: Optional[int] = None) -> np.ndarray:
+        """
+        id n ближайших по сжатым векторам; в шарде категории, если там не меньше k (по умолчанию n)
+        чанков — как knn_search в Postgres, — тогда n не больше размера шарда.
+        """
+        with self._lock:
+            ids, categories, codes = self.ids, self.categories, self.codes
+        if codes is None or not len(ids):
+            return np.empty(0, dtype=np.int64)
+        if category in CATEGORIES:
+            mask = categories == CATEGORIES.index(category)
+            if mask.sum() >= (n if k is None else k):
+                ids, codes = ids[mask], np.compress(mask, codes, axis=self.codec.axis)
+        d = self.codec.distances(query, codes)
+        n = min(n, len(d))
+        top = np.argpartition(d, n - 1)[:n]
+        return ids[top[np.argsort(d[top], kind="stable")]]
+
+    def search(self, query: np.ndarray, k: int, shortlist: int, category: Optional[str] = None) -> List[Tuple[int, float]]:
+        """[(id, точное L2²), ...] — top-k из shortlist кандидатов."""
+        candidates = self.shortlist(query, max(k, shortlist), category, k)
+        if not len(candidates):
+            return []
+        found, vectors = self._full(candidates)
+        if not len(found):
+            return []
+        diff = np.asarray(vectors, dtype=np.float64) - np.asarray(query, dtype=np.float64)
+        d = np.einsum("ij,ij->i", diff, diff)
+        order = np.argsort(d, kind="stable")[:k]
+        return [(int(found[i]), float(d[i])) for i in order]
+
+
+# --------- Индекс над chunks ----------
+def _category_code(category: Optional[str]) -> int:
+    # индекс в CATEGORIES; -1 — без категории
+    return CATEGORIES.index(category) if category in CATEGORIES else -1
+
+
+def _iter_chunks(after_id: int = 0, batch_size: int = 10_000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """(ids, категории, эмбеддинги float32) чанков с id > after_id, батчами по порядку id."""
+    conn = db.engine.raw_connection()
+    try:
+        cur = conn.cursor(name="vectorstore")  # серверный курсор: не тянем всю таблицу в память разом
+        cur.itersize = batch_size
+        cur.execute("SELECT id, category, embedding FROM chunks WHERE id > %s ORDER BY id", (after_id,))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield (np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+                   np.fromiter((_category_code(r[1]) for r in rows), dtype=np.int8, count=len(rows)),
+                   np.asarray([r[2] for r in rows], dtype=np.float32))
+        cur.close()
+    finally:
+        conn.close()
+
+
+def _fetch_full(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    rows = db.fetch_chunk_embeddings([int(i) for i in ids])
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0))
+    return np.asarray([r[0] for r in rows], dtype=np.int64), np.asarray([r[1] for r in rows], dtype=np.float64)
+
+
+def _generation() -> Optional[int]:
+    active = db.active_generation()
+    return active["generation"] if active else None
+
+
+class ChunkStore:
+    """
+    CompressedIndex над таблицей chunks: построение при старте, дописывание новых чанков, поиск как knn_search.
+    Обновление — в фоновом потоке: раз в VECTOR_STORE_REFRESH_SECONDS новые чанки, при смене поколения
+    эмбеддингов (reembed.py flip / rollback) — полная пересборка с новым кодеком. Пока индекс не догнал
+    поколение запроса, поиск идёт в Postgres (db.knn_search).
+    """
+
+    def __init__(self, index: CompressedIndex, generation: Optional[int] = None):
+        self._current = (index, generation)  # подменяется целиком: поиск видит индекс вместе с его поколением
+        self._last_id = int(index.ids.max()) if len(index) else 0
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def index(self) -> CompressedIndex:
+        return self._current[0]
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self._current[1]
+
+    @staticmethod
+    def _load(kind: str, codec_path: str = "") -> Tuple[CompressedIndex, Optional[int]]:
+        t0 = time.perf_counter()
+        generation = _generation()  # до чтения chunks: переключение во время сборки заметит следующий проход
+        batches = list(_iter_chunks())
+        ids = np.concatenate([b[0] for b in batches]) if batches else np.empty(0, dtype=np.int64)
+        categories = np.concatenate([b[1] for b in batches]) if batches else np.empty(0, dtype=np.int8)
+        vectors = np.concatenate([b[2] for b in batches]) if batches else None
+        if codec_path:
+            codec = load_codec(codec_path)
+        elif vectors is not None:
+            codec = fit_codec(kind, vectors)
+        else:
+            raise RuntimeError("VECTOR_STORE: no chunks to train the codec on and no VECTOR_STORE_PATH")
+        index = CompressedIndex(codec, _fetch_full)
+        if vectors is not None:
+            index.add(ids, categories, vectors)
+        log.info("vector store %s: %d chunks, %.1f MiB, built in %.1fs (generation %s)",
+                 codec.kind, len(index), index.nbytes / 2**20, time.perf_counter() - t0, generation)
+        return index, generation
+
+    @classmethod
+    def build(cls, kind: str, codec_path: str = "") -> "ChunkStore":
+        return cls(*cls._load(kind, codec_path))
+
+    def start(self) -> None:
+        """Фоновый поток обновления (daemon)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="vectorstore-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        interval = VECTOR_STORE.refresh_seconds if VECTOR_STORE.refresh_seconds > 0 else None
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                with self._refresh_lock:
+                    if _generation() != self.generation:
+                        self._rebuild()
+                    self._append_new()
+            except Exception:
+                log.exception("vector store refresh failed")
+            time.sleep(1.0)  # запросы с отстающим поколением будят поток на каждом поиске — не чаще раза в секунду
+
+    def _rebuild(self) -> None:
+        # chunks.embedding теперь в пространстве другой модели: старые коды и кодек (в том числе из
+        # VECTOR_STORE_PATH) к нему не подходят
+        log.info("vector store: embedding generation %s changed, rebuilding", self.generation)
+        index, generation = self._load(self.index.codec.kind)
+        self._last_id = int(index.ids.max()) if len(index) else 0
+        self._current = (index, generation)
+
+    def refresh(self) -> int:
+        """
+        Дописывает чанки, загруженные после построения (ingest); возвращает их число.
+        Смену поколения и уже идущее фоновое обновление не ждёт — их доделывает фоновый поток.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return 0
+        try:
+            if _generation() != self.generation:
+                self._wake.set()
+                return 0
+            return self._append_new()
+        finally:
+            self._refresh_lock.release()
+
+    def _append_new(self) -> int:
+        added = 0
+        for ids, categories, vectors in _iter_chunks(self._last_id):
+            self.index.add(ids, categories, vectors)
+            self._last_id = int(ids[-1])
+            added += len(ids)
+        return added
+
+    def knn_search(self, embedding: List[float], k: int = 5, category: Optional[str] = None,
+                   generation: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Как database.baseclasses.knn_search: [{"id", "data", "token_count"}, ...] по возрастанию L2.
+        generation — поколение, моделью которого посчитан embedding; индекс другого поколения не годится.
+        """
+        if not embedding:
+            return []
+        index, indexed = self._current
+        if generation != indexed:
+            self._wake.set()
+            return db.knn_search(embedding, k=k, category=category)
+        found = index.search(np.asarray(embedding, dtype=np.float32), k, VECTOR_STORE.shortlist, category)
+        rows = {r["id"]: r for r in db.fetch_chunks([chunk_id for chunk_id, _ in found])}
+        return [rows[chunk_id] for chunk_id, _ in found if chunk_id in rows]
+
+
+@lru_cache(maxsize=1)
+def configured_store() -> Optional[ChunkStore]:
+    """Индекс из VECTOR_STORE; None — выключено (knn_search в Postgres)."""
+    if not VECTOR_STORE.kind:
+        return None
+    store = ChunkStore.build(VECTOR_STORE.kind, VECTOR_STORE.path)
+    store.start()
+    return store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Обучить кодек VECTOR_STORE на chunks.embedding и сохранить в .npz")
+    parser.add_argument("--kind", default=VECTOR_STORE.kind or "pq", choices=("pca", "pq"))
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    vectors = np.concatenate([b[2] for b in _iter_chunks()])
+    codec = fit_codec(args.kind, vectors)
+    save_codec(codec, args.out)
+    print(f"{args.kind}: trained on {min(len(vectors), VECTOR_STORE.train_size)} of {len(vectors)} chunks, "
+          f"{codec.code_bytes} bytes per chunk -> {args.out}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
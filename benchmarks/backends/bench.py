@@ -0,0 +1,260 @@
+"""
+Микробенчмарк Python-бэкендов Triton на CPU без Triton и без настоящих весов.
+
+Каждый model.py загружается как есть, triton_python_backend_utils подменяется
+локальным модулем, а вместо весов из hub подставляется маленький чекпойнт той же
+архитектуры со случайными весами и настоящим токенизатором:
+
+    rubert    BERT (размеры rubert-tiny2)            rubert_tiny2_embeddings
+    xlmr      XLM-R, 4 слоя x 256                    xlmr_toxicity
+    sentinel  XLM-R, 4 слоя x 256                    prompt_injection_sentinel
+    qwen      Qwen2, 2 слоя x 128, greedy 16 токенов qwen_cpu
+
+execute() гоняется по сетке батч x длина текста (батч = число запросов по одному
+тексту, как их собирает dynamic batcher). Время токенизации и forward берётся из
+метрик model_execute_*_seconds_total самого бэкенда, post-processing — остаток
+execute(). Чекпойнты собираются один раз в --cache (нужен доступ к hub за
+токенизаторами; дальше можно HF_HUB_OFFLINE=1). --pipeline-chunk задаёт в
+энкодерах кусок батча, токенизация которого идёт параллельно с forward
+предыдущего (0 — весь батч одним forward, без флага — умолчание бэкендов, 16),
+--pretokenized подаёт им INPUT_IDS вместо TEXT (как шлюз с GATEWAY_TOKENIZER);
+время токенизации в отчёте — то, что не удалось спрятать за forward.
+
+    python benchmarks/backends/bench.py
+    python benchmarks/backends/bench.py --models rubert,xlmr --batch-sizes 1,8,32 --lengths 16,128,512 --threads 4
+    python benchmarks/backends/bench.py --json before.json
+    python benchmarks/backends/bench.py --models xlmr --batch-sizes 32 --pipeline-chunk 8
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.join(ROOT, "triton-common"))  # в образе triton_common.py лежит рядом с model.py
+
+import triton_python_backend_utils as pb_utils  # noqa: E402  подмена из этой папки
+
+# Qwen читает параметры генерации при импорте: короткий детерминированный ответ
+os.environ.setdefault("MAX_NEW_TOKENS", "16")
+os.environ.setdefault("DO_SAMPLE", "false")
+
+_WORDS = (
+    "как подключиться к корпоративной почте через vpn если пароль истёк и учётная запись "
+    "заблокирована после трёх попыток входа в домен обратитесь в сервис деск с номером заявки "
+    "для оформления отпуска заявление подаётся за две недели через кадровый портал а справка "
+    "о доходах формируется бухгалтерией в течение трёх рабочих дней"
+).split()
+
+
+def _text(n_words: int, seed: int) -> str:
+    rnd = np.random.default_rng(seed)
+    return " ".join(_WORDS[i] for i in rnd.integers(0, len(_WORDS), n_words))
+
+
+# --------- Маленькие чекпойнты ----------
+def _build_bert(tokenizer):
+    from transformers import BertConfig, BertModel
+
+    cfg = BertConfig(vocab_size=len(tokenizer), hidden_size=312, num_hidden_layers=3, num_attention_heads=12,
+                     intermediate_size=600, max_position_embeddings=2048)
+    return BertModel(cfg)
+
+
+def _build_xlmr(labels: Dict[int, str]):
+    def build(tokenizer):
+        from transformers import XLMRobertaConfig, XLMRobertaForSequenceClassification
+
+        cfg = XLMRobertaConfig(vocab_size=len(tokenizer), hidden_size=256, num_hidden_layers=4,
+                               num_attention_heads=4, intermediate_size=1024, max_position_embeddings=514,
+                               num_labels=len(labels), id2label=labels, label2id={v: k for k, v in labels.items()})
+        return XLMRobertaForSequenceClassification(cfg)
+    return build
+
+
+def _build_qwen(tokenizer):
+    from transformers import Qwen2Config, Qwen2ForCausalLM
+
+    cfg = Qwen2Config(vocab_size=len(tokenizer), hidden_size=128, num_hidden_layers=2, num_attention_heads=4,
+                      num_key_value_heads=2, intermediate_size=256, max_position_embeddings=4096,
+                      tie_word_embeddings=True, eos_token_id=tokenizer.eos_token_id)
+    return Qwen2ForCausalLM(cfg)
+
+
+BACKENDS = {
+    "rubert": {
+        "model_py": "rubert-tiny2-embeddings/model_repository/rubert_tiny2_embeddings/1/model.py",
+        "triton_name": "rubert_tiny2_embeddings",
+        "attr": "_MODEL_NAME",
+        "tokenizer": "cointegrated/rubert-tiny2",
+        "build": _build_bert,
+    },
+    "xlmr": {
+        "model_py": "xlmr-large-toxicity-classifier-v2/model_repository/xlmr_toxicity/1/model.py",
+        "triton_name": "xlmr_toxicity",
+        "attr": "_MODEL_NAME",
+        "tokenizer": "textdetox/xlmr-large-toxicity-classifier-v2",
+        "build": _build_xlmr({0: "neutral", 1: "toxic"}),
+    },
+    "sentinel": {
+        "model_py": "sentinel-triton/model_repository/prompt_injection_sentinel/1/model.py",
+        "triton_name": "prompt_injection_sentinel",
+        "attr": "MODEL_ID",
+        "tokenizer": "FacebookAI/xlm-roberta-base",
+        "build": _build_xlmr({0: "benign", 1: "jailbreak"}),
+    },
+    "qwen": {
+        "model_py": "qwen-triton/model_repository/qwen_cpu/1/model.py",
+        "triton_name": "qwen_cpu",
+        "attr": "MODEL_ID",
+        "tokenizer": "Qwen/Qwen2-1.5B-Instruct",
+        "build": _build_qwen,
+    },
+}
+
+
+def ensure_checkpoint(name: str, cache: str) -> str:
+    path = os.path.join(cache, name)
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    import torch
+    from transformers import AutoTokenizer
+
+    spec = BACKENDS[name]
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(spec["tokenizer"])
+    model = spec["build"](tokenizer)
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    print(f"built {name}: {sum(p.numel() for p in model.parameters()) / 1e6:.1f}M params -> {path}", file=sys.stderr)
+    return path
+
+
+def load_backend(name: str, checkpoint: str):
+    """Импортирует model.py бэкенда с весами из checkpoint и вызывает initialize()."""
+    spec = BACKENDS[name]
+    module_spec = importlib.util.spec_from_file_location(f"bench_{name}_model", os.path.join(ROOT, spec["model_py"]))
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    setattr(module, spec["attr"], checkpoint)
+    model = module.TritonPythonModel()
+    model.initialize({
+        "model_name": spec["triton_name"],
+        "model_version": "1",
+        "model_config": "{}",
+        "model_instance_kind": "CPU",
+        "model_instance_name": f"{spec['triton_name']}_0",
+    })
+    return model
+
+
+# --------- Замеры ----------
+def _requests(texts: List[str], tokenizer=None) -> list:
+    if tokenizer is not None:
+        # INPUT_IDS, как их шлёт шлюз с GATEWAY_TOKENIZER: токенизация вне execute()
+        return [pb_utils.InferenceRequest([pb_utils.Tensor("INPUT_IDS", np.array([tokenizer(t)["input_ids"]], dtype=np.int64))])
+                for t in texts]
+    return [pb_utils.InferenceRequest([pb_utils.Tensor("TEXT", np.array([t.encode("utf-8")], dtype=object))])
+            for t in texts]
+
+
+def _counter(triton_name: str) -> Callable[[str], float]:
+    return lambda metric: pb_utils.metric_value(metric, model=triton_name, version="1")
+
+
+def bench_case(model, triton_name: str, batch: int, words: int, repeat: int, pretokenized: bool = False) -> dict:
+    # длины в батче разные (0.5x..1.5x), иначе паддинг нереалистично мал
+    rnd = np.random.default_rng(batch * 1000 + words)
+    texts = [_text(max(1, int(words * rnd.uniform(0.5, 1.5))), seed=i) for i in range(batch)]
+    tokenizer = model.tokenizer if pretokenized else None
+    model.execute(_requests(texts, tokenizer))  # прогрев (аллокации, ленивые инициализации)
+    value = _counter(triton_name)
+    total_ms, tok_ms, fwd_ms, post_ms, tps = [], [], [], [], []
+    for _ in range(repeat):
+        reqs = _requests(texts, tokenizer)
+        tok0, fwd0 = value("model_execute_tokenize_seconds_total"), value("model_execute_forward_seconds_total")
+        t0 = time.perf_counter()
+        responses = model.execute(reqs)
+        elapsed = time.perf_counter() - t0
+        assert len(responses) == batch and not any(r.has_error() for r in responses)
+        tok = value("model_execute_tokenize_seconds_total") - tok0
+        fwd = value("model_execute_forward_seconds_total") - fwd0
+        total_ms.append(elapsed * 1000)
+        tok_ms.append(tok * 1000)
+        fwd_ms.append(fwd * 1000)
+        post_ms.append(max(0.0, elapsed - tok - fwd) * 1000)
+        tps.append(value("model_execute_tokens_per_second"))
+    return {
+        "batch": batch,
+        "words": words,
+        "max_tokens": int(value("model_execute_max_tokens")),
+        "padding_ratio": value("model_execute_padding_ratio"),
+        "execute_ms": statistics.median(total_ms),
+        "tokenize_ms": statistics.median(tok_ms),
+        "forward_ms": statistics.median(fwd_ms),
+        "post_ms": statistics.median(post_ms),
+        "tokens_per_s": statistics.median(tps),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", default=",".join(BACKENDS), help="через запятую: " + ", ".join(BACKENDS))
+    parser.add_argument("--batch-sizes", default="1,4,16")
+    parser.add_argument("--lengths", default="8,64,256", help="длина текста в словах")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--cache", default=os.path.expanduser("~/.cache/ai-atom/bench-checkpoints"))
+    parser.add_argument("--pipeline-chunk", type=int, default=None,
+                        help="PIPELINE_CHUNK энкодеров: токенизация следующего куска параллельно с forward")
+    parser.add_argument("--pretokenized", action="store_true", help="энкодерам — INPUT_IDS вместо TEXT")
+    parser.add_argument("--json", default=None, help="сохранить результаты")
+    args = parser.parse_args()
+
+    import torch
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+        os.environ["TORCH_NUM_THREADS"] = str(args.threads)
+    if args.pipeline_chunk is not None:
+        os.environ["PIPELINE_CHUNK"] = str(args.pipeline_chunk)  # model.py читает при импорте
+    batches = [int(x) for x in args.batch_sizes.split(",")]
+    lengths = [int(x) for x in args.lengths.split(",")]
+
+    results: Dict[str, List[dict]] = {}
+    for name in args.models.split(","):
+        model = load_backend(name, ensure_checkpoint(name, args.cache))
+        if args.threads:
+            torch.set_num_threads(args.threads)  # qwen выставляет свои потоки в initialize()
+        print(f"\n{name} ({torch.get_num_threads()} threads)")
+        print(f"{'batch':>6} {'words':>6} {'max tok':>8} {'pad':>6} {'exec ms':>9} {'tok ms':>8} "
+              f"{'fwd ms':>9} {'post ms':>8} {'tok/s':>9}")
+        rows = results.setdefault(name, [])
+        for batch in batches:
+            for words in lengths:
+                r = bench_case(model, BACKENDS[name]["triton_name"], batch, words, args.repeat,
+                               pretokenized=args.pretokenized and name != "qwen")
+                rows.append(r)
+                print(f"{r['batch']:>6} {r['words']:>6} {r['max_tokens']:>8} {r['padding_ratio']:>6.2f} "
+                      f"{r['execute_ms']:>9.1f} {r['tokenize_ms']:>8.1f} {r['forward_ms']:>9.1f} "
+                      f"{r['post_ms']:>8.1f} {r['tokens_per_s']:>9.0f}")
+        model.finalize()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"threads": args.threads, "pipeline_chunk": args.pipeline_chunk,
+                       "pretokenized": args.pretokenized, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
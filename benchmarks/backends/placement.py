@@ -0,0 +1,219 @@
+"""
+Разбиение ядер машины между моделями, которые работают на ней одновременно:
+модерация (xlmr + sentinel), эмбеддинг (rubert) и генерация (qwen).
+
+Каждая модель — отдельный процесс (как stub-процесс Python-бэкенда в Triton),
+загружается один раз (чекпойнты bench.py или --cache-dir из model-cache). Для
+каждого разбиения ядер процессы перепривязываются к своим ядрам (intra-op
+потоков = ядер, inter-op = 1) и одновременно гоняют execute() --seconds секунд.
+Пропускная способность пайплайна — сообщений/с, которые выдерживают все модели
+сразу: min(xlmr/с, sentinel/с, rubert/с, qwen/с / --llm-share). Для сравнения
+первой строкой — без привязки, с потоками по умолчанию (как было: каждая модель
+считает, что все ядра её).
+
+Ядра модерации делятся поровну между xlmr и sentinel, шаг сетки — --step ядер.
+Лучшее разбиение печатается готовым блоком для cpu-placement.env.
+
+    python benchmarks/backends/placement.py
+    python benchmarks/backends/placement.py --cpus 0-15 --step 2 --seconds 10 --llm-share 0.6
+    python benchmarks/backends/placement.py --cache-dir .model-cache --json placement.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+from bench import ensure_checkpoint  # noqa: E402
+from startup import HUB_IDS  # noqa: E402
+
+GROUPS = {"moderation": ("xlmr", "sentinel"), "embedding": ("rubert",), "generation": ("qwen",)}
+MODELS = [name for names in GROUPS.values() for name in names]
+
+
+def _parse_cpus(spec: str) -> List[int]:
+    cpus = set()
+    for part in spec.split(","):
+        if part.strip():
+            lo, _, hi = part.strip().partition("-")
+            cpus.update(range(int(lo), int(hi or lo) + 1))
+    return sorted(cpus)
+
+
+def _format_cpus(cpus: List[int]) -> str:
+    """[0, 1, 2, 3, 8] -> "0-3,8"."""
+    ranges, start = [], None
+    for i, cpu in enumerate(cpus):
+        if start is None:
+            start = cpu
+        if i + 1 == len(cpus) or cpus[i + 1] != cpu + 1:
+            ranges.append(f"{start}-{cpu}" if cpu != start else str(cpu))
+            start = None
+    return ",".join(ranges)
+
+
+# --------- Процесс модели ----------
+def _pin(cpus: List[int]) -> None:
+    # все уже созданные потоки процесса (в т.ч. пул OpenMP), новые наследуют привязку
+    for tid in os.listdir("/proc/self/task"):
+        try:
+            os.sched_setaffinity(int(tid), cpus)
+        except OSError:
+            pass
+
+
+def _worker(name: str, checkpoint: str, batch: int, words: int) -> None:
+    """Грузит бэкенд и выполняет команды из stdin: {"cpus": [...] | null, "threads": n | null, "seconds": s}."""
+    import torch
+
+    from bench import _requests, _text, load_backend
+
+    all_cpus = sorted(os.sched_getaffinity(0))
+    model = load_backend(name, checkpoint)
+    default_threads = torch.get_num_threads()  # после initialize(): у qwen — его 4 потока
+    texts = [_text(words, seed=i) for i in range(batch)]
+    print(json.dumps({"ready": True}), flush=True)
+    for line in sys.stdin:
+        cmd = json.loads(line)
+        _pin(cmd["cpus"] or all_cpus)
+        torch.set_num_threads(cmd["threads"] or default_threads)
+        model.execute(_requests(texts))  # прогрев на новых ядрах
+        items, t0 = 0, time.perf_counter()
+        while time.perf_counter() - t0 < cmd["seconds"]:
+            model.execute(_requests(texts))
+            items += len(texts)
+        print(json.dumps({"items_per_s": items / (time.perf_counter() - t0)}), flush=True)
+    model.finalize()
+
+
+class _Worker:
+    def __init__(self, name: str, checkpoint: str, batch: int, words: int):
+        self.name = name
+        env = dict(os.environ, **{f"{name.upper()}_INTEROP_THREADS": "1"})
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", name, checkpoint, str(batch), str(words)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env, cwd=HERE,
+        )
+
+    def read(self) -> dict:
+        for line in self.proc.stdout:
+            if line.startswith("{"):
+                return json.loads(line)
+        raise SystemExit(f"{self.name}: worker exited with {self.proc.wait()}")
+
+    def send(self, cpus: Optional[List[int]], threads: Optional[int], seconds: float) -> None:
+        self.proc.stdin.write(json.dumps({"cpus": cpus, "threads": threads, "seconds": seconds}) + "\n")
+        self.proc.stdin.flush()
+
+    def close(self) -> None:
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+# --------- Разбиения ----------
+def splits(cpus: List[int], step: int):
+    """Все разбиения ядер на модерацию / эмбеддинг / генерацию кратно step (остаток — генерации)."""
+    units = len(cpus) // step
+    for a in range(1, units - 1):
+        for b in range(1, units - a):
+            m, e = a * step, b * step
+            yield {"moderation": cpus[:m], "embedding": cpus[m:m + e], "generation": cpus[m + e:]}
+
+
+def assign(split: Dict[str, List[int]]) -> Dict[str, List[int]]:
+    """Ядра групп -> ядра моделей: внутри группы поровну, на одном ядре — вместе."""
+    out = {}
+    for group, names in GROUPS.items():
+        cores = split[group]
+        share = max(1, len(cores) // len(names))
+        for i, name in enumerate(names):
+            own = cores[i * share:(i + 1) * share] if i + 1 < len(names) else cores[i * share:]
+            out[name] = own or cores
+    return out
+
+
+def run(workers: Dict[str, _Worker], placement: Optional[Dict[str, List[int]]], seconds: float,
+        llm_share: float) -> dict:
+    for name, worker in workers.items():
+        cpus = placement[name] if placement else None
+        worker.send(cpus, len(cpus) if cpus else None, seconds)
+    rates = {name: worker.read()["items_per_s"] for name, worker in workers.items()}
+    messages = min(rate / (llm_share if name == "qwen" else 1.0) for name, rate in rates.items())
+    return {"rates": rates, "messages_per_s": messages}
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        _worker(sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cpus", default=None, help="ядра для разбиения, например 0-15 (по умолчанию — доступные)")
+    parser.add_argument("--step", type=int, default=None, help="шаг сетки в ядрах (по умолчанию ~8 шагов на машину)")
+    parser.add_argument("--seconds", type=float, default=8.0, help="длительность замера одного разбиения")
+    parser.add_argument("--batch", type=int, default=8, help="текстов на execute() энкодеров (qwen — 1)")
+    parser.add_argument("--words", type=int, default=32, help="длина текста в словах")
+    parser.add_argument("--llm-share", type=float, default=1.0, help="доля сообщений, доходящих до генерации")
+    parser.add_argument("--cache", default=os.path.expanduser("~/.cache/ai-atom/bench-checkpoints"))
+    parser.add_argument("--cache-dir", default=None, help="каталог model-cache/prepare.py (настоящие веса)")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", default=None, help="сохранить результаты")
+    args = parser.parse_args()
+
+    cpus = _parse_cpus(args.cpus) if args.cpus else sorted(os.sched_getaffinity(0))
+    step = args.step or max(1, len(cpus) // 8)
+    if len(cpus) // step < 3:
+        raise SystemExit(f"нужно хотя бы 3 шага по {step} ядер, доступно {len(cpus)}")
+
+    workers = {}
+    for name in MODELS:
+        checkpoint = (os.path.join(os.path.abspath(args.cache_dir), HUB_IDS[name].replace("/", "--"))
+                      if args.cache_dir else ensure_checkpoint(name, args.cache))
+        workers[name] = _Worker(name, checkpoint, 1 if name == "qwen" else args.batch, args.words)
+    for worker in workers.values():
+        worker.read()  # ready
+
+    header = f"{'moderation':>11} {'embedding':>10} {'generation':>11} " + " ".join(f"{n + '/s':>11}" for n in MODELS)
+    print(header + f" {'messages/s':>11}")
+    results = []
+    try:
+        baseline = run(workers, None, args.seconds, args.llm_share)
+        results.append({"split": None, **baseline})
+        print(f"{'unpinned, default threads':>34} " + " ".join(f"{baseline['rates'][n]:>11.1f}" for n in MODELS)
+              + f" {baseline['messages_per_s']:>11.2f}")
+        for split in splits(cpus, step):
+            r = run(workers, assign(split), args.seconds, args.llm_share)
+            results.append({"split": {g: _format_cpus(c) for g, c in split.items()}, **r})
+            print(f"{len(split['moderation']):>11} {len(split['embedding']):>10} {len(split['generation']):>11} "
+                  + " ".join(f"{r['rates'][n]:>11.1f}" for n in MODELS) + f" {r['messages_per_s']:>11.2f}")
+    finally:
+        for worker in workers.values():
+            worker.close()
+
+    pinned = sorted((r for r in results if r["split"]), key=lambda r: r["messages_per_s"], reverse=True)
+    print(f"\ntop {args.top} by messages/s:")
+    for r in pinned[:args.top]:
+        print(f"  {r['messages_per_s']:>8.2f}  " + "  ".join(f"{g}={c}" for g, c in r["split"].items()))
+    best = pinned[0]
+    gain = best["messages_per_s"] / baseline["messages_per_s"] if baseline["messages_per_s"] else float("inf")
+    print(f"\nbest: x{gain:.2f} vs unpinned; cpu-placement.env:")
+    placement = assign({g: _parse_cpus(c) for g, c in best["split"].items()})
+    for name in MODELS:
+        prefix = name.upper()
+        print(f"{prefix}_CPUS={_format_cpus(placement[name])}\n{prefix}_NUM_THREADS={len(placement[name])}\n"
+              f"{prefix}_INTEROP_THREADS=1")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"cpus": _format_cpus(cpus), "step": step, "llm_share": args.llm_share, "results": results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Квантование qwen_cpu (QWEN_QUANTIZATION): память, токены/с и качество ответов
+на FAQ-запросах относительно модели без квантования.
+
+Каждый режим — в отдельном процессе (RSS не смешиваются): model.py грузится как
+есть, затем greedy-ответы на запросы из app/server/benchmarks/queries_ru.txt по
+одному (batch 1). Отчёт: RSS после initialize() и пиковый, токены/с, время
+ответа и близость к ответам без квантования — доля совпавших целиком, доля
+совпавших первых 16 токенов и средний difflib-ratio по тексту. Ответы
+сохраняются в --json, чтобы их можно было прочитать глазами.
+
+Без --target — маленький чекпойнт qwen из bench.py (проверка обвязки; качество
+на случайных весах не показательно). Настоящий замер:
+
+    python benchmarks/backends/quantization.py --target .model-cache/Qwen--Qwen2-1.5B-Instruct --json quant.json
+    python benchmarks/backends/quantization.py --modes none,int8 --max-new-tokens 96 --threads 4
+"""
+from __future__ import annotations
+
+import argparse
+import difflib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+from speculative import QUERIES, _prompts  # noqa: E402
+
+PREFIX_TOKENS = 16
+
+
+def _child(checkpoint: str, prompts_path: str, n: int) -> None:
+    """Выполняется в дочернем процессе с QWEN_QUANTIZATION из окружения; печатает JSON."""
+    import resource
+
+    import bench
+    import triton_python_backend_utils as pb_utils
+
+    t0 = time.perf_counter()
+    model = bench.load_backend("qwen", checkpoint)
+    load_s = time.perf_counter() - t0
+    rss_after_load = pb_utils.metric_value("model_resident_memory_bytes", model="qwen_cpu", version="1")
+    value = bench._counter("qwen_cpu")
+    prompts = _prompts(prompts_path, n)
+    model.execute(bench._requests(prompts[:1]))  # прогрев
+    answers, token_ids, tps, seconds = [], [], [], []
+    for prompt in prompts:
+        tokens0 = value("model_execute_generated_tokens_total")
+        t1 = time.perf_counter()
+        response = model.execute(bench._requests([prompt]))[0]
+        elapsed = time.perf_counter() - t1
+        tokens = value("model_execute_generated_tokens_total") - tokens0
+        answer = str(pb_utils.get_output_tensor_by_name(response, "OUTPUT_TEXT").as_numpy()[0])
+        answers.append(answer)
+        token_ids.append(model.tokenizer(answer, add_special_tokens=False)["input_ids"])
+        seconds.append(elapsed)
+        tps.append(tokens / elapsed if elapsed > 0 else 0.0)
+    print(json.dumps({
+        "load_s": load_s,
+        "rss_gib": rss_after_load / 2**30,
+        "max_rss_gib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**20,
+        "tokens_per_s": statistics.median(tps),
+        "seconds_p50": statistics.median(seconds),
+        "answers": answers,
+        "token_ids": token_ids,
+    }, ensure_ascii=False))
+
+
+def _run(mode: str, checkpoint: str, args) -> dict:
+    env = dict(os.environ, QWEN_QUANTIZATION="" if mode == "none" else mode,
+               DO_SAMPLE="false", MAX_NEW_TOKENS=str(args.max_new_tokens))
+    if args.threads:
+        env["QWEN_NUM_THREADS"] = str(args.threads)
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", checkpoint, args.prompts, str(args.n)]
+    out = subprocess.run(cmd, capture_output=True, text=True, env=env, cwd=HERE)
+    if out.returncode != 0:
+        raise SystemExit(f"{mode}: child failed\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def quality(reference: dict, result: dict) -> dict:
+    pairs = list(zip(reference["answers"], result["answers"]))
+    prefixes = list(zip(reference["token_ids"], result["token_ids"]))
+    return {
+        "identical": sum(a == b for a, b in pairs) / len(pairs),
+        "prefix_match": sum(a[:PREFIX_TOKENS] == b[:PREFIX_TOKENS] for a, b in prefixes) / len(prefixes),
+        "text_similarity": statistics.mean(difflib.SequenceMatcher(None, a, b).ratio() for a, b in pairs),
+    }
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        _child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=None, help="каталог или id модели (по умолчанию — из bench.py)")
+    parser.add_argument("--modes", default="none,int8,int8wo,int4", help="none и значения QWEN_QUANTIZATION")
+    parser.add_argument("--prompts", default=QUERIES)
+    parser.add_argument("--n", type=int, default=12, help="сколько запросов")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None, help="QWEN_NUM_THREADS")
+    parser.add_argument("--cache", default=os.path.expanduser("~/.cache/ai-atom/bench-checkpoints"))
+    parser.add_argument("--json", default=None, help="сохранить результаты и ответы")
+    args = parser.parse_args()
+
+    from bench import ensure_checkpoint
+
+    target = args.target or ensure_checkpoint("qwen", args.cache)
+    modes = args.modes.split(",")
+    if modes[0] != "none":
+        modes.insert(0, "none")  # эталон для сравнения качества
+    results = {}
+    print(f"{'mode':<8} {'load s':>7} {'RSS GiB':>8} {'peak GiB':>9} {'tok/s':>7} {'s/answer':>9} "
+          f"{'identical':>10} {'prefix16':>9} {'similarity':>11}")
+    for mode in modes:
+        try:
+            r = _run(mode, target, args)
+        except SystemExit as e:
+            print(f"{mode:<8} failed: {str(e).splitlines()[-1]}")
+            continue
+        r.update(quality(results["none"], r) if "none" in results else {"identical": 1.0, "prefix_match": 1.0,
+                                                                       "text_similarity": 1.0})
+        results[mode] = r
+        print(f"{mode:<8} {r['load_s']:>7.1f} {r['rss_gib']:>8.2f} {r['max_rss_gib']:>9.2f} {r['tokens_per_s']:>7.1f} "
+              f"{r['seconds_p50']:>9.2f} {r['identical']:>10.2f} {r['prefix_match']:>9.2f} {r['text_similarity']:>11.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"target": target, "max_new_tokens": args.max_new_tokens,
+                       "prompts": _prompts(args.prompts, args.n), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
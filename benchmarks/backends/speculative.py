@@ -0,0 +1,121 @@
+"""
+Спекулятивное декодирование qwen_cpu: токены/с и совпадение ответов с черновой
+моделью (DRAFT_MODEL_ID) и без неё при greedy-декодировании.
+
+Оба прогона — тот же model.py, по одному запросу (batch 1, как с черновой
+моделью и генерирует бэкенд), на запросах из app/server/benchmarks/queries_ru.txt.
+При greedy ответ с черновой моделью должен совпадать с обычным токен в токен:
+основная модель проверяет каждый предложенный токен. Несовпадения в отчёте —
+численные расхождения (другие формы матриц в forward), их стоит посмотреть
+глазами (--show-diff).
+
+Без --target/--draft — маленький чекпойнт qwen из bench.py в роли обеих моделей:
+проверка обвязки (все токены принимаются), не скорости. Настоящий замер — на
+весах из model-cache:
+
+    python benchmarks/backends/speculative.py
+    python benchmarks/backends/speculative.py --target .model-cache/Qwen--Qwen2-1.5B-Instruct \\
+        --draft .model-cache/Qwen--Qwen2-0.5B-Instruct --max-new-tokens 128 --draft-tokens 5 --json spec.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+
+QUERIES = os.path.join(ROOT, "app", "server", "benchmarks", "queries_ru.txt")
+
+
+def _prompts(path: str, n: int) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return lines[:n]
+
+
+def run(checkpoint: str, draft: str, prompts: List[str]) -> dict:
+    import numpy as np
+
+    import bench
+    import triton_python_backend_utils as pb_utils
+
+    # model.py читает DRAFT_MODEL_ID при импорте, load_backend импортирует его заново
+    os.environ["DRAFT_MODEL_ID"] = draft
+    model = bench.load_backend("qwen", checkpoint)
+    value = bench._counter("qwen_cpu")
+    model.execute(bench._requests(prompts[:1]))  # прогрев
+    answers, tps, seconds = [], [], []
+    for prompt in prompts:
+        tokens0 = value("model_execute_generated_tokens_total")
+        t0 = time.perf_counter()
+        response = model.execute(bench._requests([prompt]))[0]
+        elapsed = time.perf_counter() - t0
+        tokens = value("model_execute_generated_tokens_total") - tokens0
+        answers.append(str(pb_utils.get_output_tensor_by_name(response, "OUTPUT_TEXT").as_numpy()[0]))
+        seconds.append(elapsed)
+        tps.append(tokens / elapsed if elapsed > 0 else 0.0)
+    model.finalize()
+    return {
+        "tokens_per_s": statistics.median(tps),
+        "seconds_p50": statistics.median(seconds),
+        "seconds_total": float(np.sum(seconds)),
+        "answers": answers,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=None, help="основная модель: каталог или id (по умолчанию — из bench.py)")
+    parser.add_argument("--draft", default=None, help="черновая модель (по умолчанию — та же, что основная)")
+    parser.add_argument("--prompts", default=QUERIES)
+    parser.add_argument("--n", type=int, default=12, help="сколько запросов")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--draft-tokens", type=int, default=5, help="DRAFT_NUM_TOKENS")
+    parser.add_argument("--schedule", default="heuristic", help="DRAFT_SCHEDULE: heuristic | constant")
+    parser.add_argument("--cache", default=os.path.expanduser("~/.cache/ai-atom/bench-checkpoints"))
+    parser.add_argument("--show-diff", action="store_true", help="напечатать несовпавшие ответы")
+    parser.add_argument("--json", default=None, help="сохранить результаты")
+    args = parser.parse_args()
+
+    # greedy: ответ определяется моделью однозначно, его и сравниваем
+    os.environ["DO_SAMPLE"] = "false"
+    os.environ["MAX_NEW_TOKENS"] = str(args.max_new_tokens)
+    os.environ["DRAFT_NUM_TOKENS"] = str(args.draft_tokens)
+    os.environ["DRAFT_SCHEDULE"] = args.schedule
+    from bench import ensure_checkpoint
+
+    target = args.target or ensure_checkpoint("qwen", args.cache)
+    draft = args.draft or target
+    prompts = _prompts(args.prompts, args.n)
+
+    plain = run(target, "", prompts)
+    assisted = run(target, draft, prompts)
+    same = [a == b for a, b in zip(plain["answers"], assisted["answers"])]
+
+    print(f"{len(prompts)} prompts, greedy, max_new_tokens={args.max_new_tokens}, draft_tokens={args.draft_tokens} "
+          f"({args.schedule})\ntarget {target}\ndraft  {draft}\n")
+    print(f"{'mode':<10} {'tok/s p50':>10} {'s/answer p50':>13} {'total s':>9}")
+    for mode, r in (("plain", plain), ("assisted", assisted)):
+        print(f"{mode:<10} {r['tokens_per_s']:>10.1f} {r['seconds_p50']:>13.2f} {r['seconds_total']:>9.1f}")
+    speedup = plain["seconds_total"] / assisted["seconds_total"] if assisted["seconds_total"] else float("inf")
+    print(f"\nspeedup x{speedup:.2f}, identical answers {sum(same)}/{len(same)}")
+    if args.show_diff:
+        for prompt, ok, a, b in zip(prompts, same, plain["answers"], assisted["answers"]):
+            if not ok:
+                print(f"\n--- {prompt}\nplain:    {a!r}\nassisted: {b!r}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"target": target, "draft": draft, "max_new_tokens": args.max_new_tokens,
+                       "draft_tokens": args.draft_tokens, "schedule": args.schedule, "prompts": prompts,
+                       "plain": plain, "assisted": assisted, "identical": sum(same), "speedup": speedup},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Время готовности Python-бэкендов Triton: import model.py, initialize() и первый
+execute() (он дожидается токенизатора, который грузится в фоне). Каждый замер —
+в отдельном процессе, чтобы не мешали кэш страниц и уже импортированные модули
+соседних замеров (кэш страниц ОС между процессами остаётся — первый прогон
+«холодный», остальные «тёплые»; поэтому --repeat и медиана).
+
+Варианты:
+    hub     чекпойнт по id из hub (HF-кэш), как грузились бэкенды раньше
+    cache   каталог из model-cache/prepare.py (--cache-dir), offline
+
+Без --cache-dir используются маленькие чекпойнты из bench.py: вариант cache — их
+копия в bf16 safetensors, вариант hub — fp32 как есть.
+
+    python benchmarks/backends/startup.py
+    python benchmarks/backends/startup.py --models qwen --cache-dir .model-cache --hub --repeat 3
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+
+from bench import BACKENDS, ensure_checkpoint  # noqa: E402
+
+# настоящие чекпойнты бэкендов и формат их хранения в model-cache/prepare.py
+HUB_IDS = {
+    "rubert": "cointegrated/rubert-tiny2",
+    "xlmr": "textdetox/xlmr-large-toxicity-classifier-v2",
+    "sentinel": "qualifire/prompt-injection-jailbreak-sentinel-v2",
+    "qwen": os.environ.get("MODEL_ID", "Qwen/Qwen2-1.5B-Instruct"),
+}
+_CACHE_DTYPE = {"rubert": "float32"}
+
+
+def _child(name: str, checkpoint: str, offline: bool) -> None:
+    """Выполняется в дочернем процессе: печатает JSON с временами этапов."""
+    if offline:
+        os.environ["HF_HUB_OFFLINE"] = "1"
+    t0 = time.perf_counter()
+    import torch  # noqa: F401  импорт torch/transformers одинаков для всех вариантов, считаем отдельно
+    import transformers  # noqa: F401
+    t_import = time.perf_counter()
+    from bench import _requests, load_backend
+
+    model = load_backend(name, checkpoint)
+    t_init = time.perf_counter()
+    responses = model.execute(_requests(["Как оформить отпуск?"]))
+    t_first = time.perf_counter()
+    assert not any(r.has_error() for r in responses)
+    import resource
+
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        "import_s": t_import - t0,
+        "initialize_s": t_init - t_import,
+        "first_execute_s": t_first - t_init,
+        "ready_s": t_first - t_import,
+        "max_rss_mb": rss_mb,
+    }))
+
+
+def _bf16_copy(name: str, checkpoint: str, cache: str) -> str:
+    """Копия маленького чекпойнта в формате model-cache/prepare.py."""
+    path = os.path.join(cache, f"{name}-cache")
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    import torch
+    from transformers import AutoConfig, AutoModel, AutoModelForCausalLM, AutoModelForSequenceClassification, AutoTokenizer
+
+    archs = AutoConfig.from_pretrained(checkpoint).architectures or []
+    auto = AutoModelForCausalLM if any("CausalLM" in a for a in archs) else (
+        AutoModelForSequenceClassification if any("Classification" in a for a in archs) else AutoModel)
+    dtype = getattr(torch, _CACHE_DTYPE.get(name, "bfloat16"))
+    auto.from_pretrained(checkpoint, torch_dtype=dtype).save_pretrained(path, safe_serialization=True)
+    AutoTokenizer.from_pretrained(checkpoint).save_pretrained(path)
+    return path
+
+
+def _run(name: str, checkpoint: str, offline: bool, env: dict) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", name, checkpoint]
+    if offline:
+        cmd.append("--offline")
+    out = subprocess.run(cmd, capture_output=True, text=True, env=env, cwd=ROOT)
+    if out.returncode != 0:
+        raise SystemExit(f"{name}: child failed\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        _child(sys.argv[2], sys.argv[3], "--offline" in sys.argv)
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", default=",".join(BACKENDS), help="через запятую: " + ", ".join(BACKENDS))
+    parser.add_argument("--cache-dir", default=None, help="каталог model-cache/prepare.py (настоящие веса)")
+    parser.add_argument("--hub", action="store_true", help="с --cache-dir: замерить и загрузку по id из hub")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache", default=os.path.expanduser("~/.cache/ai-atom/bench-checkpoints"))
+    parser.add_argument("--json", default=None, help="сохранить результаты")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    results = {}
+    print(f"{'model':<9} {'variant':<7} {'import s':>9} {'init s':>8} {'1st exec s':>11} {'ready s':>8} {'rss MB':>8}")
+    for name in args.models.split(","):
+        model_id = HUB_IDS[name]
+        if args.cache_dir:
+            variants = [("cache", os.path.join(os.path.abspath(args.cache_dir), model_id.replace("/", "--")), True)]
+            if args.hub:
+                variants.insert(0, ("hub", model_id, False))
+        else:
+            small = ensure_checkpoint(name, args.cache)
+            variants = [("hub", small, False), ("cache", _bf16_copy(name, small, args.cache), True)]
+        for variant, checkpoint, offline in variants:
+            runs = [_run(name, checkpoint, offline, env) for _ in range(args.repeat)]
+            row = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+            row["cold_ready_s"] = runs[0]["ready_s"]
+            results.setdefault(name, {})[variant] = row
+            print(f"{name:<9} {variant:<7} {row['import_s']:>9.2f} {row['initialize_s']:>8.2f} "
+                  f"{row['first_execute_s']:>11.2f} {row['ready_s']:>8.2f} {row['max_rss_mb']:>8.0f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
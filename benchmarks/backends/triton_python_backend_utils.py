@@ -0,0 +1,122 @@
+"""
+Подмена triton_python_backend_utils для запуска model.py вне Triton.
+
+Реализовано ровно то, чем пользуются наши бэкенды: Tensor, InferenceRequest /
+get_input_tensor_by_name, InferenceResponse, Logger, TritonError и custom
+metrics (MetricFamily) — значения метрик доступны бенчмарку через METRICS.
+"""
+from __future__ import annotations
+
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+VERBOSE = False
+
+
+class TritonError(Exception):
+    pass
+
+
+class Tensor:
+    def __init__(self, name: str, array: np.ndarray):
+        self._name = name
+        self._array = np.asarray(array)
+
+    def name(self) -> str:
+        return self._name
+
+    def as_numpy(self) -> np.ndarray:
+        return self._array
+
+
+class InferenceRequest:
+    def __init__(self, inputs: List[Tensor]):
+        self._inputs = {t.name(): t for t in inputs}
+
+    def inputs(self) -> List[Tensor]:
+        return list(self._inputs.values())
+
+
+def get_input_tensor_by_name(request: InferenceRequest, name: str) -> Optional[Tensor]:
+    return request._inputs.get(name)
+
+
+class InferenceResponse:
+    def __init__(self, output_tensors: Optional[List[Tensor]] = None, error: Optional[TritonError] = None):
+        self._outputs = output_tensors or []
+        self._error = error
+
+    def output_tensors(self) -> List[Tensor]:
+        return self._outputs
+
+    def has_error(self) -> bool:
+        return self._error is not None
+
+    def error(self) -> Optional[TritonError]:
+        return self._error
+
+
+def get_output_tensor_by_name(response: InferenceResponse, name: str) -> Optional[Tensor]:
+    return next((t for t in response.output_tensors() if t.name() == name), None)
+
+
+class Logger:
+    @staticmethod
+    def _log(level: str, msg: str) -> None:
+        if VERBOSE or level in ("WARN", "ERROR"):
+            print(f"[{level}] {msg}", file=sys.stderr)
+
+    @staticmethod
+    def log_info(msg: str) -> None:
+        Logger._log("INFO", msg)
+
+    @staticmethod
+    def log_verbose(msg: str) -> None:
+        Logger._log("VERBOSE", msg)
+
+    @staticmethod
+    def log_warn(msg: str) -> None:
+        Logger._log("WARN", msg)
+
+    @staticmethod
+    def log_error(msg: str) -> None:
+        Logger._log("ERROR", msg)
+
+
+# --------- custom metrics ----------
+METRICS: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], "_Metric"] = {}
+
+
+class _Metric:
+    def __init__(self):
+        self._value = 0.0
+
+    def increment(self, value: float) -> None:
+        self._value += value
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+    def value(self) -> float:
+        return self._value
+
+
+class MetricFamily:
+    COUNTER = 0
+    GAUGE = 1
+
+    def __init__(self, name: str, description: str, kind: int):
+        self.name = name
+        self.description = description
+        self.kind = kind
+
+    def Metric(self, labels: Optional[Dict[str, str]] = None) -> _Metric:
+        key = (self.name, tuple(sorted((labels or {}).items())))
+        return METRICS.setdefault(key, _Metric())
+
+
+def metric_value(name: str, **labels: str) -> float:
+    metric = METRICS.get((name, tuple(sorted(labels.items()))))
+    return metric.value() if metric else 0.0
@@ -0,0 +1,4 @@
+-- Полнотекстовый индекс по чанкам для гибридного поиска (RETRIEVAL_MODE=hybrid).
+-- CONCURRENTLY — без блокировки записи в chunks; выполнять вне транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chunks_data_fts
+    ON public.chunks USING gin (to_tsvector('russian', data));
@@ -0,0 +1,26 @@
+-- Категория (IT / AD / HR) у документов и чанков для поиска по шарду категории.
+-- Категория выводится из имени файла: NN_IT_FAQ_* -> IT, NN_BUH_FAQ_* -> AD, NN_FAQ_* -> HR,
+-- остальные документы без категории (участвуют только в глобальном поиске).
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS category text;
+ALTER TABLE public.chunks ADD COLUMN IF NOT EXISTS category text;
+
+UPDATE public.documents
+SET category = CASE
+    WHEN name ~ '(^|/)\d+_IT_' THEN 'IT'
+    WHEN name ~ '(^|/)\d+_BUH_' THEN 'AD'
+    WHEN name ~ '(^|/)\d+_FAQ_' THEN 'HR'
+END
+WHERE category IS NULL;
+
+UPDATE public.chunks c
+SET category = d.category
+FROM public.documents d
+WHERE d.id = c.document_id
+  AND c.category IS DISTINCT FROM d.category;
+
+CREATE INDEX IF NOT EXISTS idx_chunks_category ON public.chunks USING btree (category);
+
+-- по одному полнотекстовому под-индексу на категорию; idx_chunks_data_fts (001) — глобальный fallback
+CREATE INDEX IF NOT EXISTS idx_chunks_data_fts_it ON public.chunks USING gin (to_tsvector('russian', data)) WHERE category = 'IT';
+CREATE INDEX IF NOT EXISTS idx_chunks_data_fts_ad ON public.chunks USING gin (to_tsvector('russian', data)) WHERE category = 'AD';
+CREATE INDEX IF NOT EXISTS idx_chunks_data_fts_hr ON public.chunks USING gin (to_tsvector('russian', data)) WHERE category = 'HR';
@@ -0,0 +1,4 @@
+-- Число токенов Qwen в чанке для упаковки контекста LLM по бюджету токенов (app/server/context.py).
+-- Новые чанки получают его при загрузке (ingest.py с CONTEXT_TOKENIZER); уже загруженные заполняет
+-- python ingest.py --count-tokens. NULL — не посчитано, шлюз считает или оценивает на лету.
+ALTER TABLE public.chunks ADD COLUMN IF NOT EXISTS token_count integer;
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+import numpy as np
+import triton_python_backend_utils as pb_utils
+from triton_common import ExecuteMetrics
+
+# BLS: TEXT один раз -> xlmr_toxicity, prompt_injection_sentinel и (по запросу) rubert_tiny2_embeddings параллельно
+TOXICITY_MODEL = "xlmr_toxicity"
+SENTINEL_MODEL = "prompt_injection_sentinel"
+EMBEDDINGS_MODEL = "rubert_tiny2_embeddings"
+EMBEDDING_DIM = 312
+# каскад: логистическая регрессия на эмбеддинге (app/server: python -m benchmarks.prefilter), xlmr — только неуверенные
+PREFILTER_PATH = os.getenv("TOXICITY_PREFILTER_PATH", "")
+
+
+class _Prefilter:
+    """Веса и пороги из .npz, который пишет benchmarks.prefilter (тот же формат, что у шлюза)."""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.weights = data["weights"].astype(np.float32).reshape(-1)
+            self.bias = float(data["bias"])
+            self.low = float(os.getenv("TOXICITY_PREFILTER_LOW") or data["low"])
+            self.high = float(os.getenv("TOXICITY_PREFILTER_HIGH") or data["high"])
+        if not 0.0 <= self.low <= self.high <= 1.0:
+            raise ValueError(f"Bad prefilter thresholds: low={self.low}, high={self.high} ({path})")
+
+    def score(self, embeddings):
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        x = embeddings / np.where(norms > 0, norms, 1.0)
+        return (1.0 / (1.0 + np.exp(-(x @ self.weights + self.bias)))).astype(np.float32)
+
+
+class TritonPythonModel:
+    def initialize(self, args):
+        self.metrics = ExecuteMetrics(args, ("executions", "sequences", "submodel_seconds", "batch_size", "escalated"))
+        self.prefilter = _Prefilter(PREFILTER_PATH) if PREFILTER_PATH else None
+        if self.prefilter is not None:
+            pb_utils.Logger.log_info(
+                f"[moderation] prefilter {PREFILTER_PATH} low={self.prefilter.low} high={self.prefilter.high}"
+            )
+
+    async def _infer(self, model_name, output_name, texts):
+        request = pb_utils.InferenceRequest(
+            model_name=model_name,
+            requested_output_names=[output_name],
+            inputs=[pb_utils.Tensor("TEXT", texts)],
+        )
+        response = await request.async_exec()
+        if response.has_error():
+            raise pb_utils.TritonModelException(f"{model_name}: {response.error().message()}")
+        return pb_utils.get_output_tensor_by_name(response, output_name).as_numpy()
+
+    async def _run_all(self, batch, with_embeddings):
+        calls = [self._infer(TOXICITY_MODEL, "P_TOXIC", batch), self._infer(SENTINEL_MODEL, "P_ATTACK", batch)]
+        if with_embeddings:
+            calls.append(self._infer(EMBEDDINGS_MODEL, "EMBEDDINGS", batch))
+        results = await asyncio.gather(*calls)
+        embeddings = results[2].astype(np.float32).reshape(-1, EMBEDDING_DIM) if with_embeddings else None
+        return results[0].astype(np.float32).reshape(-1), results[1].astype(np.float32).reshape(-1), embeddings, len(batch)
+
+    async def _run_cascade(self, batch):
+        # sentinel и эмбеддинги параллельно, затем xlmr только для текстов между порогами
+        p_attack, embeddings = await asyncio.gather(
+            self._infer(SENTINEL_MODEL, "P_ATTACK", batch), self._infer(EMBEDDINGS_MODEL, "EMBEDDINGS", batch)
+        )
+        embeddings = embeddings.astype(np.float32).reshape(-1, EMBEDDING_DIM)
+        p_toxic = self.prefilter.score(embeddings)
+        escalate = (p_toxic >= self.prefilter.low) & (p_toxic <= self.prefilter.high)
+        # решённые каскадом — 0/1: шлюз округляет P_TOXIC, а high может быть и ниже 0.5
+        p_toxic = np.where(p_toxic > self.prefilter.high, 1.0, 0.0).astype(np.float32)
+        escalated = int(escalate.sum())
+        if escalated:
+            p_toxic[escalate] = (await self._infer(TOXICITY_MODEL, "P_TOXIC", batch[escalate])).reshape(-1)
+        return p_toxic, p_attack.astype(np.float32).reshape(-1), embeddings, escalated
+
+    async def execute(self, requests):
+        texts, sizes, wants_embeddings = [], [], []
+        for req in requests:
+            arr = pb_utils.get_input_tensor_by_name(req, "TEXT").as_numpy().reshape(-1)
+            texts.extend(arr)
+            sizes.append(len(arr))
+            # EMBEDDINGS считаем, только если их запросили (без "outputs" Triton просит все выходы)
+            wants_embeddings.append("EMBEDDINGS" in req.requested_output_names())
+
+        if not texts:
+            return [pb_utils.InferenceResponse(output_tensors=[
+                pb_utils.Tensor("P_TOXIC", np.empty((0,), dtype=np.float32)),
+                pb_utils.Tensor("P_ATTACK", np.empty((0,), dtype=np.float32)),
+            ]) for _ in requests]
+
+        # все тексты всех запросов — одним вызовом каждой подмодели
+        batch = np.array(texts, dtype=object)
+        t0 = time.perf_counter()
+        try:
+            if self.prefilter is None:
+                p_toxic, p_attack, embeddings, escalated = await self._run_all(batch, any(wants_embeddings))
+            else:
+                p_toxic, p_attack, embeddings, escalated = await self._run_cascade(batch)
+        except pb_utils.TritonModelException as e:
+            return [pb_utils.InferenceResponse(output_tensors=[], error=pb_utils.TritonError(str(e))) for _ in requests]
+        self.metrics.increment(
+            executions=1, sequences=len(texts), submodel_seconds=time.perf_counter() - t0, escalated=escalated
+        )
+        self.metrics.set(batch_size=len(texts))
+
+        responses = []
+        offset = 0
+        for n, want in zip(sizes, wants_embeddings):
+            part = slice(offset, offset + n)
+            offset += n
+            outputs = [pb_utils.Tensor("P_TOXIC", p_toxic[part]), pb_utils.Tensor("P_ATTACK", p_attack[part])]
+            if want:
+                outputs.append(pb_utils.Tensor("EMBEDDINGS", embeddings[part]))
+            responses.append(pb_utils.InferenceResponse(output_tensors=outputs))
+        return responses
+
+    def finalize(self):
+        pass
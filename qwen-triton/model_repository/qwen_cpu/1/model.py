@@ -1,13 +1,17 @@
 
 import os
 import json
+import time
+from functools import cached_property
 import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 import triton_python_backend_utils as pb_utils
+from triton_common import ENCODER_METRICS, ExecuteMetrics, configure_cpu, in_background, resolve_checkpoint
 
 MODEL_ID = os.environ.get("MODEL_ID", "Qwen/Qwen3-1.7B")
 
+
 DEFAULT_GEN_KW = {
     "max_new_tokens": int(os.environ.get("MAX_NEW_TOKENS", "256")),
     "temperature": float(os.environ.get("TEMPERATURE", "0.7")),
@@ -15,113 +19,324 @@ DEFAULT_GEN_KW = {
     "do_sample": os.environ.get("DO_SAMPLE", "true").lower() == "true",
 }
 
+# Рассуждения Qwen3 (<think>...</think>) по умолчанию выключены: шаблон чата с enable_thinking=False и запрет
+# токена <think> при генерации, чтобы MAX_NEW_TOKENS уходили только на ответ. Запрос может включить их через
+# GEN_PARAMS ("thinking": true). Шаблоны без enable_thinking (Qwen2) параметр игнорируют.
+ENABLE_THINKING = os.environ.get("ENABLE_THINKING", "false").lower() == "true"
+MAX_NEW_TOKENS_LIMIT = int(os.environ.get("MAX_NEW_TOKENS_LIMIT", "1024"))  # потолок max_new_tokens из GEN_PARAMS
+
+# GEN_PARAMS — JSON-объект с параметрами генерации запроса, все ключи необязательны
+_GEN_PARAMS = {
+    "max_new_tokens": int,
+    "temperature": (int, float),
+    "top_p": (int, float),
+    "do_sample": bool,
+    "stop": list,
+    "thinking": bool,
+}
+
+
+def _read_gen_params(request):
+    tensor = pb_utils.get_input_tensor_by_name(request, "GEN_PARAMS")
+    if tensor is None or tensor.as_numpy().size == 0:
+        return {}
+    raw = tensor.as_numpy().reshape(-1)[0]
+    try:
+        params = json.loads(raw.decode("utf-8") if isinstance(raw, (bytes, bytearray)) else str(raw))
+    except ValueError as e:
+        raise ValueError(f"GEN_PARAMS is not valid JSON: {e}")
+    if not isinstance(params, dict):
+        raise ValueError("GEN_PARAMS must be a JSON object")
+    unknown = set(params) - set(_GEN_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown GEN_PARAMS keys {sorted(unknown)}, expected some of {sorted(_GEN_PARAMS)}")
+    for key, value in params.items():
+        # bool — подкласс int, числом его не считаем
+        if not isinstance(value, _GEN_PARAMS[key]) or (_GEN_PARAMS[key] is not bool and isinstance(value, bool)):
+            raise ValueError(f"GEN_PARAMS.{key}: unexpected value {value!r}")
+    if not all(isinstance(s, str) and s for s in params.get("stop", [])):
+        raise ValueError("GEN_PARAMS.stop must be a list of non-empty strings")
+    if not 1 <= params.get("max_new_tokens", 1) <= MAX_NEW_TOKENS_LIMIT:
+        raise ValueError(f"GEN_PARAMS.max_new_tokens must be in [1, {MAX_NEW_TOKENS_LIMIT}]")
+    return params
+
+
+def _parse_chat(prompt):
+    """Элемент TEXT — JSON-чат [{"role": ..., "content": ...}, ...] или просто текст (один ход user)."""
+    if prompt.lstrip().startswith("["):
+        try:
+            messages = json.loads(prompt)
+        except ValueError:
+            messages = None
+        if isinstance(messages, list) and messages and all(
+            isinstance(m, dict) and isinstance(m.get("role"), str) and isinstance(m.get("content"), str)
+            for m in messages
+        ):
+            return [{"role": m["role"], "content": m["content"]} for m in messages]
+    return [{"role": "user", "content": prompt}]
+
+
+def _cut_at_stop(text, stop):
+    """generate() останавливается на стоп-строке, но оставляет её в ответе."""
+    cut = min((i for i in (text.find(s) for s in stop) if i != -1), default=-1)
+    return text if cut == -1 else text[:cut]
+
+
+# Спекулятивное декодирование: маленькая модель того же семейства (с тем же токенизатором, например
+# Qwen/Qwen2-0.5B-Instruct) предлагает токены, основная проверяет их одним forward. Пусто — обычная генерация.
+DRAFT_MODEL_ID = os.environ.get("DRAFT_MODEL_ID", "")
+DRAFT_KW = {
+    "num_assistant_tokens": int(os.environ.get("DRAFT_NUM_TOKENS", "5")),
+    # heuristic: число предлагаемых токенов растёт, пока они принимаются, и падает, когда нет
+    "num_assistant_tokens_schedule": os.environ.get("DRAFT_SCHEDULE", "heuristic"),
+}
+
+# Квантование линейных слоёв после загрузки (память и скорость на CPU), пусто — без квантования:
+#   int8   — встроенное динамическое int8 torch (веса int8 по каналам, ядра fbgemm), без зависимостей;
+#   int8wo — только веса int8, int4 — только веса int4 группами по QWEN_QUANT_GROUP_SIZE (нужен torchao).
+# lm_head не квантуется: у маленьких Qwen он общий с эмбеддингами и сильнее всего влияет на выбор токена.
+QWEN_QUANTIZATION = os.environ.get("QWEN_QUANTIZATION", "").lower()
+QWEN_QUANT_GROUP_SIZE = int(os.environ.get("QWEN_QUANT_GROUP_SIZE", "128"))
+QWEN_QUANT_SKIP = [m.strip() for m in os.environ.get("QWEN_QUANT_SKIP", "lm_head").split(",") if m.strip()]
+
+
+def _linear_names(model):
+    return [name for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear) and name.rsplit(".", 1)[-1] not in QWEN_QUANT_SKIP]
+
+
+def _quantize(model, mode):
+    if mode == "int8":
+        from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+        # динамическое квантование работает с float32-весами
+        model = model.float()
+        return quantize_dynamic(model, {name: default_dynamic_qconfig for name in _linear_names(model)},
+                                dtype=torch.qint8, inplace=True)
+    if mode in ("int8wo", "int4"):
+        try:
+            from torchao.quantization import int4_weight_only, int8_weight_only, quantize_
+        except ImportError as e:
+            raise pb_utils.TritonModelException(f"QWEN_QUANTIZATION={mode} requires torchao: {e}")
+        names = set(_linear_names(model))
+        if mode == "int8wo":
+            config = int8_weight_only()
+        else:
+            # int4 на CPU: упакованные веса и ядро _weight_int4pack_mm; bf16 — формат, который ожидает ядро
+            model = model.to(torch.bfloat16)
+            config = int4_weight_only(group_size=QWEN_QUANT_GROUP_SIZE)
+        quantize_(model, config, filter_fn=lambda module, fqn: fqn in names)
+        return model
+    raise pb_utils.TritonModelException(f"Unknown QWEN_QUANTIZATION={mode!r}: expected int8, int8wo or int4")
+
+
+def _rss_bytes():
+    """Резидентная память процесса сейчас (VmRSS)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def _load_tokenizer(checkpoint, local):
+    tokenizer = AutoTokenizer.from_pretrained(
+        checkpoint, use_fast=True, trust_remote_code=True, local_files_only=local
+    )
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
 def _as_python_list(tensor_or_list):
     if isinstance(tensor_or_list, (list, tuple)):
         return list(tensor_or_list)
     return tensor_or_list.tolist()
 
 class TritonPythonModel:
+    @property
+    def tokenizer(self):
+        # грузится в фоне с initialize(); первый execute() дожидается его
+        return self._tokenizer.result()
+
     def initialize(self, args):
        
-        torch.set_num_threads(int(os.environ.get("TORCH_NUM_THREADS", "4")))
+        configure_cpu("QWEN", default_threads=4)
         self.device = torch.device("cpu")
 
-       
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            MODEL_ID,
-            use_fast=True,
-            trust_remote_code=True
-        )
-       
-        if self.tokenizer.pad_token is None:
-            self.tokenizer.pad_token = self.tokenizer.eos_token
+        t0 = time.perf_counter()
+        checkpoint, local = resolve_checkpoint(MODEL_ID)
+        self._tokenizer = in_background(_load_tokenizer, checkpoint, local)
 
+        # веса в кэше могут лежать в bf16 (вдвое меньше читать); считаем в TORCH_DTYPE
         self.model = AutoModelForCausalLM.from_pretrained(
-            MODEL_ID,
-            torch_dtype=torch.float32,
+            checkpoint,
+            torch_dtype=getattr(torch, os.environ.get("TORCH_DTYPE", "float32")),
             low_cpu_mem_usage=True,
-            trust_remote_code=True
+            trust_remote_code=True,
+            local_files_only=local,
         ).to(self.device)
         self.model.eval()
+        if QWEN_QUANTIZATION:
+            t1 = time.perf_counter()
+            self.model = _quantize(self.model, QWEN_QUANTIZATION)
+            pb_utils.Logger.log_info(
+                f"[Qwen Triton CPU] {QWEN_QUANTIZATION} quantization in {time.perf_counter() - t1:.1f}s, "
+                f"skipped {QWEN_QUANT_SKIP}"
+            )
+        self.draft = self._load_draft() if DRAFT_MODEL_ID else None
 
        
         self.use_chat_template = bool(int(os.environ.get("USE_CHAT_TEMPLATE", "1")))
+        self.max_input_tokens = int(os.environ.get("MAX_INPUT_TOKENS", "2048"))
+        self.metrics = ExecuteMetrics(args, ENCODER_METRICS + ("generated_tokens", "rss_bytes"))
+        rss = _rss_bytes()
+        self.metrics.set(rss_bytes=rss)
 
-        pb_utils.Logger.log_info(f"[Qwen Triton CPU] Loaded {MODEL_ID}")
+        pb_utils.Logger.log_info(
+            f"[Qwen Triton CPU] Loaded {checkpoint} in {time.perf_counter() - t0:.1f}s (local={local}), "
+            f"RSS {rss / 2**30:.2f} GiB"
+        )
 
-    def _build_inputs(self, prompts):
+    def _load_draft(self):
+        checkpoint, local = resolve_checkpoint(DRAFT_MODEL_ID)
+        draft = AutoModelForCausalLM.from_pretrained(
+            checkpoint,
+            torch_dtype=self.model.dtype,
+            low_cpu_mem_usage=True,
+            trust_remote_code=True,
+            local_files_only=local,
+        ).to(self.device).eval()
+        for key, value in DRAFT_KW.items():
+            setattr(draft.generation_config, key, value)
+        if draft.config.vocab_size != self.model.config.vocab_size:
+            pb_utils.Logger.log_warn(
+                f"[Qwen Triton CPU] draft vocab {draft.config.vocab_size} != {self.model.config.vocab_size}: "
+                "draft must share the tokenizer of the main model"
+            )
+        pb_utils.Logger.log_info(f"[Qwen Triton CPU] draft model {checkpoint} (local={local}) {DRAFT_KW}")
+        return draft
+
+    def _generate(self, enc, gen_kw):
+        """Новые токены каждой последовательности батча."""
+        if self.draft is None:
+            output_ids = self.model.generate(**enc, **gen_kw)
+            return list(output_ids[:, enc["input_ids"].shape[1]:])
+        # assisted generation в transformers — только batch 1: последовательности по одной, без паддинга
+        generated = []
+        for ids, mask in zip(enc["input_ids"], enc["attention_mask"]):
+            ids = ids[mask.bool()].unsqueeze(0)
+            output_ids = self.model.generate(
+                input_ids=ids, attention_mask=torch.ones_like(ids), assistant_model=self.draft, **gen_kw
+            )
+            generated.append(output_ids[0, ids.shape[1]:])
+        return generated
+
+    @cached_property
+    def think_token_id(self):
+        # у Qwen3 <think> — отдельный токен словаря; у Qwen2 его нет
+        return self.tokenizer.get_vocab().get("<think>")
+
+    def _build_inputs(self, prompts, thinking):
        
+        chats = [_parse_chat(p) for p in prompts]
         if self.use_chat_template and hasattr(self.tokenizer, "apply_chat_template"):
             rendered = []
-            for p in prompts:
-               
-                messages = [{"role": "user", "content": p}]
+            for messages in chats:
+                # весь чат (system + user + ...) — одна последовательность и одна генерация
                 text = self.tokenizer.apply_chat_template(
-                    messages, tokenize=False, add_generation_prompt=True
+                    messages, tokenize=False, add_generation_prompt=True, enable_thinking=thinking
                 )
                 rendered.append(text)
             return rendered
         else:
-            return prompts
-
-    def execute(self, requests):
-        responses = []
+            return ["\n\n".join(m["content"] for m in messages) for messages in chats]
 
+    def _gen_kw(self, params):
+        gen_kw = dict(DEFAULT_GEN_KW)
        
-        all_prompts = []
-        sizes = []
-        for req in requests:
-            t = pb_utils.get_input_tensor_by_name(req, "TEXT")
-            arr = t.as_numpy().reshape(-1)
-            prompts = [
-                x.decode("utf-8") if isinstance(x, (bytes, bytearray)) else str(x)
-                for x in arr
-            ]
-            all_prompts.extend(prompts)
-            sizes.append(len(prompts))
+        if "NO_REPEAT_NGRAM_SIZE" in os.environ:
+            gen_kw["no_repeat_ngram_size"] = int(os.environ["NO_REPEAT_NGRAM_SIZE"])
+        gen_kw.update({k: params[k] for k in ("max_new_tokens", "temperature", "top_p", "do_sample") if k in params})
+        if gen_kw["temperature"] == 0:  # temperature 0 — greedy
+            gen_kw["do_sample"] = False
+        if params.get("stop"):
+            gen_kw["stop_strings"] = params["stop"]
+            gen_kw["tokenizer"] = self.tokenizer
+        if not params.get("thinking", ENABLE_THINKING) and self.think_token_id is not None:
+            gen_kw["bad_words_ids"] = [[self.think_token_id]]
 
-        if not all_prompts:
-            for req in requests:
-                empty = np.array([], dtype=object) 
-                responses.append(pb_utils.InferenceResponse(
-                    output_tensors=[pb_utils.Tensor("OUTPUT_TEXT", empty)]
-                ))
-            return responses
+        gen_kw["pad_token_id"] = self.tokenizer.pad_token_id
+        gen_kw["eos_token_id"] = self.tokenizer.eos_token_id
+        return gen_kw
 
-       
-        texts = self._build_inputs(all_prompts)
+    def _run(self, prompts, params):
+        """Ответы на prompts с одними параметрами генерации."""
+        t0 = time.perf_counter()
+        texts = self._build_inputs(prompts, params.get("thinking", ENABLE_THINKING))
         with torch.no_grad():
             enc = self.tokenizer(
                 texts,
                 padding=True,
                 truncation=True,
-                max_length=int(os.environ.get("MAX_INPUT_TOKENS", "2048")),
+                max_length=self.max_input_tokens,
                 return_tensors="pt"
             )
             enc = {k: v.to(self.device) for k, v in enc.items()}
+            t1 = time.perf_counter()
 
-            gen_kw = dict(DEFAULT_GEN_KW)
-           
-            if "NO_REPEAT_NGRAM_SIZE" in os.environ:
-                gen_kw["no_repeat_ngram_size"] = int(os.environ["NO_REPEAT_NGRAM_SIZE"])
+            gen_tokens = self._generate(enc, self._gen_kw(params))
 
-            output_ids = self.model.generate(
-                **enc,
-                **gen_kw,
-                pad_token_id=self.tokenizer.pad_token_id,
-                eos_token_id=self.tokenizer.eos_token_id
+            # законченные последовательности generate добивает pad_token_id — их не считаем
+            generated = sum(int((row != self.tokenizer.pad_token_id).sum()) for row in gen_tokens)
+            self.metrics.observe(
+                [enc["attention_mask"]], self.max_input_tokens, t1 - t0, time.perf_counter() - t1,
+                generated_tokens=generated,
             )
-
-           
-            input_len = enc["input_ids"].shape[1]
-            gen_tokens = output_ids[:, input_len:]
             outputs = self.tokenizer.batch_decode(gen_tokens, skip_special_tokens=True)
+        if params.get("stop"):
+            outputs = [_cut_at_stop(text, params["stop"]) for text in outputs]
+        return outputs
+
+    def execute(self, requests):
+        responses = []
+
+       
+        prompts_by_request, errors = [], []
+        groups = {}  # запросы с одинаковыми GEN_PARAMS генерируются одним батчем
+        for i, req in enumerate(requests):
+            try:
+                params, error = _read_gen_params(req), None
+            except ValueError as e:
+                params, error = {}, pb_utils.TritonError(str(e))
+            t = pb_utils.get_input_tensor_by_name(req, "TEXT")
+            arr = t.as_numpy().reshape(-1) if error is None else []
+            prompts = [
+                x.decode("utf-8") if isinstance(x, (bytes, bytearray)) else str(x)
+                for x in arr
+            ]
+            prompts_by_request.append(prompts)
+            errors.append(error)
+            if error is None:
+                key = json.dumps(params, sort_keys=True)
+                groups.setdefault(key, (params, []))[1].append(i)
+
+        outputs_by_request = [[] for _ in requests]
+        for params, members in groups.values():
+            prompts = [p for i in members for p in prompts_by_request[i]]
+            if not prompts:
+                continue
+            outputs = self._run(prompts, params)
+            offset = 0
+            for i in members:
+                n = len(prompts_by_request[i])
+                outputs_by_request[i] = outputs[offset:offset + n]
+                offset += n
 
        
-        offset = 0
-        for req, n in zip(requests, sizes):
-            chunk = outputs[offset:offset+n]
-            offset += n
+        for chunk, error in zip(outputs_by_request, errors):
+            if error is not None:
+                responses.append(pb_utils.InferenceResponse(output_tensors=[], error=error))
+                continue
            
             out_np = np.array(chunk, dtype=object)
             responses.append(pb_utils.InferenceResponse(
@@ -0,0 +1,75 @@
+import os
+import time
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import triton_python_backend_utils as pb_utils
+from triton_common import EncoderModel, ExecuteMetrics, configure_cpu, decode_strings, pad, resolve_checkpoint
+
+# Кросс-энкодер: вопрос и фрагмент читаются моделью вместе, на выходе — релевантность пары
+MODEL_ID = os.environ.get("RERANKER_MODEL_ID", "DiTy/cross-encoder-russian-msmarco")
+
+# пара «вопрос + фрагмент» в токенах; длиннее — обрезается длинная часть (фрагмент)
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", "256"))
+
+
+def _read_pairs(request):
+    """Пары (вопрос, фрагмент) запроса: один QUERY на все TEXT."""
+    query = pb_utils.get_input_tensor_by_name(request, "QUERY")
+    texts = pb_utils.get_input_tensor_by_name(request, "TEXT")
+    if query is None or texts is None:
+        raise ValueError("expected QUERY and TEXT")
+    queries = decode_strings(query.as_numpy().reshape(-1))
+    if len(queries) != 1:
+        raise ValueError(f"expected one QUERY, got {len(queries)}")
+    return [(queries[0], text) for text in decode_strings(texts.as_numpy().reshape(-1))]
+
+
+class TritonPythonModel(EncoderModel):
+    OUTPUT_NAME = "SCORES"
+
+    def initialize(self, args):
+        configure_cpu("RERANKER")
+        self.device = torch.device("cpu")
+
+        t0 = time.perf_counter()
+        checkpoint, local = resolve_checkpoint(MODEL_ID)
+        token = None if local else os.getenv("HUGGING_FACE_HUB_TOKEN")
+        self.start_tokenizer(AutoTokenizer.from_pretrained, checkpoint, local_files_only=local, use_auth_token=token)
+        self.model = AutoModelForSequenceClassification.from_pretrained(
+            checkpoint, local_files_only=local, use_auth_token=token, low_cpu_mem_usage=True, torch_dtype=torch.float32
+        ).to(self.device).eval()
+
+        # один логит — релевантность; два класса — вероятность последнего («релевантно»)
+        self.num_labels = int(getattr(self.model.config, "num_labels", 1))
+        self.max_length = RERANK_MAX_LENGTH
+        self.metrics = ExecuteMetrics(args)
+
+        pb_utils.Logger.log_info(
+            f"[reranker] loaded {checkpoint} in {time.perf_counter() - t0:.1f}s (local={local}) "
+            f"num_labels={self.num_labels} max_length={self.max_length}"
+        )
+
+    def _read_request(self, request):
+        return _read_pairs(request)
+
+    def _length(self, pair):
+        return len(pair[0]) + len(pair[1])
+
+    def _counters(self, pairs):
+        return {}
+
+    def _encode(self, pairs):
+        """Кусок батча -> (input_ids, attention_mask); обрезается более длинная часть пары — фрагмент."""
+        encoded = self.tokenizer(
+            [q for q, _ in pairs], [t for _, t in pairs], truncation="longest_first", max_length=self.max_length
+        )
+        return pad(encoded["input_ids"], self.tokenizer.pad_token_id)
+
+    def _forward(self, input_ids, attention_mask):
+        logits = self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+        if self.num_labels == 1:
+            scores = torch.sigmoid(logits.squeeze(-1))
+        else:
+            scores = torch.softmax(logits, dim=-1)[:, -1]
+        return scores.detach().cpu().numpy().astype(np.float32)
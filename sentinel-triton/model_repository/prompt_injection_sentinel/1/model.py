@@ -1,11 +1,14 @@
 import os
+import time
 import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import triton_python_backend_utils as pb_utils
+from triton_common import ENCODER_METRICS, EncoderModel, ExecuteMetrics, configure_cpu, resolve_checkpoint
 
 MODEL_ID = "qualifire/prompt-injection-jailbreak-sentinel-v2"
 
+
 def _pick_attack_index(config):
    
     idx = 1 
@@ -23,69 +26,37 @@ def _pick_attack_index(config):
             pass
     return idx
 
-class TritonPythonModel:
+class TritonPythonModel(EncoderModel):
+    OUTPUT_NAME = "P_ATTACK"
+
     def initialize(self, args):
+        configure_cpu("SENTINEL")
         self.device = torch.device("cpu")
        
-        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, use_auth_token=os.getenv("HUGGING_FACE_HUB_TOKEN"))
+        t0 = time.perf_counter()
+        checkpoint, local = resolve_checkpoint(MODEL_ID)
+        token = None if local else os.getenv("HUGGING_FACE_HUB_TOKEN")
+        self.start_tokenizer(AutoTokenizer.from_pretrained, checkpoint, local_files_only=local, use_auth_token=token)
         self.model = AutoModelForSequenceClassification.from_pretrained(
-            MODEL_ID, use_auth_token=os.getenv("HUGGING_FACE_HUB_TOKEN")
+            checkpoint, local_files_only=local, use_auth_token=token, low_cpu_mem_usage=True, torch_dtype=torch.float32
         ).to(self.device).eval()
 
         self.num_labels = int(getattr(self.model.config, "num_labels", 2))
         self.attack_idx = _pick_attack_index(self.model.config)
         self.max_length = 512
+        self.metrics = ExecuteMetrics(args, ENCODER_METRICS + ("pretokenized",))
        
-        pb_utils.Logger.log_info(f"[sentinel] num_labels={self.num_labels} attack_idx={self.attack_idx}")
-
-    def execute(self, requests):
-        responses = []
-        all_texts, sizes = [], []
-
-        for req in requests:
-            t = pb_utils.get_input_tensor_by_name(req, "TEXT")
-            arr = t.as_numpy().reshape(-1)
-            texts = [x.decode("utf-8") if isinstance(x, (bytes, bytearray)) else str(x) for x in arr]
-            all_texts.extend(texts)
-            sizes.append(len(texts))
-
-        if not all_texts:
-            for req in requests:
-                responses.append(pb_utils.InferenceResponse(
-                    output_tensors=[pb_utils.Tensor("P_ATTACK", np.empty((0,), dtype=np.float32))]
-                ))
-            return responses
-
-        with torch.no_grad():
-            enc = self.tokenizer(
-                all_texts,
-                padding=True,
-                truncation=True,
-                max_length=self.max_length,
-                return_tensors="pt"
-            )
-            enc = {k: v.to(self.device) for k, v in enc.items()}
-            out = self.model(**enc)
-            logits = out.logits 
-
-            if self.num_labels == 1:
-                probs_attack = torch.sigmoid(logits.squeeze(-1)) 
-            else:
-                probs = torch.softmax(logits, dim=-1) 
-                ai = max(0, min(self.attack_idx, self.num_labels - 1))
-                probs_attack = probs[:, ai] 
-
-            scores = probs_attack.detach().cpu().numpy().astype(np.float32)
-
-        offset = 0
-        for req, n in zip(requests, sizes):
-            chunk = scores[offset:offset + n]
-            offset += n
-            responses.append(pb_utils.InferenceResponse(
-                output_tensors=[pb_utils.Tensor("P_ATTACK", chunk)]
-            ))
-
-        return responses
-
-    def finalize(self):
-        pass
+        pb_utils.Logger.log_info(
+            f"[sentinel] loaded {checkpoint} in {time.perf_counter() - t0:.1f}s (local={local}) "
+            f"num_labels={self.num_labels} attack_idx={self.attack_idx}"
+        )
+
+    def _forward(self, input_ids, attention_mask):
+        logits = self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+        if self.num_labels == 1:
+            probs_attack = torch.sigmoid(logits.squeeze(-1))
+        else:
+            probs = torch.softmax(logits, dim=-1)
+            ai = max(0, min(self.attack_idx, self.num_labels - 1))
+            probs_attack = probs[:, ai]
+        return probs_attack.detach().cpu().numpy().astype(np.float32)
@@ -0,0 +1,301 @@
+"""
+Общие помощники Python-бэкендов Triton: кэш артефактов, размещение на ядрах,
+паддинг батча, custom metrics execute() и основа execute() энкодеров.
+
+Один файл на все модели: Dockerfile каждого сервиса кладёт его рядом с model.py
+(папка версии модели — в sys.path stub-процесса Triton), benchmarks/backends
+добавляет triton-common в sys.path сам. torch импортируется лениво — BLS
+moderation обходится без него.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import triton_python_backend_utils as pb_utils
+
+# Локальный кэш артефактов (model-cache/prepare.py): $MODEL_CACHE_DIR/<org>--<name>/ — safetensors и токенизатор.
+# Если он есть, грузим из него без обращения к hub; иначе — по id из hub, как раньше.
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "/model-cache")
+
+
+def resolve_checkpoint(model_id):
+    """(путь или id, грузить только локальные файлы)."""
+    if os.path.isdir(model_id):
+        return model_id, True
+    path = os.path.join(MODEL_CACHE_DIR, model_id.replace("/", "--"))
+    if os.path.isfile(os.path.join(path, "config.json")):
+        return path, True
+    return model_id, False
+
+
+def in_background(fn, *args, **kwargs):
+    """Загрузка в отдельном потоке параллельно с весами модели; результат — future."""
+    pool = ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(fn, *args, **kwargs)
+    pool.shutdown(wait=False)
+    return future
+
+
+# Ядра и потоки torch (общий cpu-placement.env): {PREFIX}_CPUS, {PREFIX}_NUM_THREADS, {PREFIX}_INTEROP_THREADS,
+# иначе CPU_AFFINITY / TORCH_NUM_THREADS / TORCH_INTEROP_THREADS; пустые значения — умолчания.
+def parse_cpus(spec):
+    """"0-3,8" -> [0, 1, 2, 3, 8]."""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if part:
+            lo, _, hi = part.partition("-")
+            cpus.update(range(int(lo), int(hi or lo) + 1))
+    return sorted(cpus)
+
+
+def configure_cpu(prefix, default_threads=None):
+    """Вызывается в начале initialize(): потоки torch и фоновые потоки создаются уже на выбранных ядрах."""
+    import torch
+
+    cpus = parse_cpus(os.environ.get(f"{prefix}_CPUS") or os.environ.get("CPU_AFFINITY") or "")
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    threads = (os.environ.get(f"{prefix}_NUM_THREADS") or (len(cpus) if cpus else None)
+               or os.environ.get("TORCH_NUM_THREADS") or default_threads)
+    if threads:
+        torch.set_num_threads(int(threads))
+    interop = os.environ.get(f"{prefix}_INTEROP_THREADS") or os.environ.get("TORCH_INTEROP_THREADS")
+    if interop:
+        try:
+            torch.set_num_interop_threads(int(interop))
+        except RuntimeError:  # inter-op пул уже запущен: задаётся один раз на процесс
+            pb_utils.Logger.log_warn(f"[{prefix.lower()}] inter-op threads already fixed at {torch.get_num_interop_threads()}")
+    pb_utils.Logger.log_info(
+        f"[{prefix.lower()}] cpus={cpus or 'all'} intra-op={torch.get_num_threads()} inter-op={torch.get_num_interop_threads()}"
+    )
+
+
+def pad(seqs, pad_id):
+    """Последовательности id разной длины -> (input_ids, attention_mask) int64."""
+    import torch
+
+    width = max(len(s) for s in seqs)
+    ids = np.full((len(seqs), width), pad_id, dtype=np.int64)
+    mask = np.zeros((len(seqs), width), dtype=np.int64)
+    for i, s in enumerate(seqs):
+        ids[i, :len(s)] = s
+        mask[i, :len(s)] = 1
+    return torch.from_numpy(ids), torch.from_numpy(mask)
+
+
+# --------- custom metrics ----------
+# Одно имя — одно описание и тип: в moderation-triton семейства model_execute_* регистрируют все модели
+# одного сервера, различаются только метки model и version.
+_COUNTER, _GAUGE = "counter", "gauge"
+METRICS = {
+    "executions": ("model_execute_total", _COUNTER, "Вызовы execute()"),
+    "sequences": ("model_execute_sequences_total", _COUNTER, "Элементы батча (тексты, пары) во всех вызовах"),
+    "tokens": ("model_execute_tokens_total", _COUNTER, "Токены входа без паддинга"),
+    "padded_tokens": ("model_execute_padded_tokens_total", _COUNTER, "Токены входа с паддингом (batch * max_len)"),
+    "truncated": ("model_execute_truncated_total", _COUNTER, "Элементы, обрезанные по max_length"),
+    "tokenize_seconds": ("model_execute_tokenize_seconds_total", _COUNTER, "Время токенизации"),
+    "forward_seconds": ("model_execute_forward_seconds_total", _COUNTER, "Время прямого прохода модели"),
+    "pretokenized": ("model_execute_pretokenized_total", _COUNTER, "Тексты, пришедшие готовыми INPUT_IDS"),
+    "generated_tokens": ("model_execute_generated_tokens_total", _COUNTER, "Сгенерированные токены"),
+    "submodel_seconds": ("moderation_submodel_seconds_total", _COUNTER,
+                         "Время ожидания всех подмоделей (они идут параллельно)"),
+    "escalated": ("moderation_escalated_total", _COUNTER, "Тексты, отправленные каскадом в xlmr_toxicity"),
+    "batch_size": ("model_execute_batch_size", _GAUGE, "Размер последнего батча"),
+    "max_tokens": ("model_execute_max_tokens", _GAUGE, "Самый длинный элемент последнего батча, токенов"),
+    "padding_ratio": ("model_execute_padding_ratio", _GAUGE, "Доля паддинга в последнем батче"),
+    "tokens_per_second": ("model_execute_tokens_per_second", _GAUGE,
+                          "Токенов/с в последнем forward (входа; у генерации — сгенерированных)"),
+    "rss_bytes": ("model_resident_memory_bytes", _GAUGE, "Резидентная память процесса модели после загрузки"),
+}
+# execute() энкодера: батч по кускам, токенизация и forward
+ENCODER_METRICS = (
+    "executions", "sequences", "tokens", "padded_tokens", "truncated", "tokenize_seconds", "forward_seconds",
+    "batch_size", "max_tokens", "padding_ratio", "tokens_per_second",
+)
+
+_families = {}  # семейство живёт, пока на него есть ссылка; одно на процесс
+
+
+def _family(key):
+    name, kind, description = METRICS[key]
+    if name not in _families:
+        kind = pb_utils.MetricFamily.COUNTER if kind == _COUNTER else pb_utils.MetricFamily.GAUGE
+        _families[name] = pb_utils.MetricFamily(name=name, description=description, kind=kind)
+    return _families[name]
+
+
+class ExecuteMetrics:
+    """Состав батча и время execute() через custom metrics Triton (в 24.05 — только COUNTER и GAUGE)."""
+
+    def __init__(self, args, keys=ENCODER_METRICS):
+        labels = {"model": args["model_name"], "version": args["model_version"]}
+        self._m = {key: _family(key).Metric(labels=labels) for key in keys}
+
+    def increment(self, **values):
+        for key, value in values.items():
+            self._m[key].increment(value)
+
+    def set(self, **values):
+        for key, value in values.items():
+            self._m[key].set(value)
+
+    def observe(self, masks, max_length, tokenize_sec, forward_sec, generated_tokens=None, **counters):
+        """
+        masks — attention_mask каждого куска батча; tokenize_sec — ожидание токенизации, не закрытое forward.
+        generated_tokens — у генерации: tokens_per_second считается по ним, а не по входу.
+        counters — прочие счётчики модели (pretokenized=...).
+        """
+        import torch
+
+        lengths = torch.cat([mask.sum(dim=1) for mask in masks])
+        batch = len(lengths)
+        tokens = int(lengths.sum())
+        padded = sum(mask.numel() for mask in masks)
+        rate_tokens = tokens
+        if generated_tokens is not None:
+            counters["generated_tokens"] = generated_tokens
+            rate_tokens = generated_tokens
+        self.increment(
+            executions=1,
+            sequences=batch,
+            tokens=tokens,
+            padded_tokens=padded,
+            truncated=int((lengths >= max_length).sum()),
+            tokenize_seconds=tokenize_sec,
+            forward_seconds=forward_sec,
+            **counters,
+        )
+        self.set(
+            batch_size=batch,
+            max_tokens=max(mask.shape[1] for mask in masks),
+            padding_ratio=1.0 - tokens / padded if padded else 0.0,
+            tokens_per_second=rate_tokens / forward_sec if forward_sec > 0 else 0.0,
+        )
+
+
+# --------- энкодеры ----------
+# Батч execute() режется на куски по PIPELINE_CHUNK элементов (близких по длине): пока модель считает кусок k,
+# фоновый поток токенизирует кусок k+1 (быстрый токенизатор сам параллелит батч на Rust). 0 — весь батч одним forward.
+# Батч не больше куска идёт одним forward, как с 0.
+PIPELINE_CHUNK = int(os.environ.get("PIPELINE_CHUNK", "16"))
+
+
+def decode_strings(values):
+    return [x.decode("utf-8") if isinstance(x, (bytes, bytearray)) else str(x) for x in values]
+
+
+def read_texts_or_ids(request):
+    """Элементы запроса: str из TEXT или np.ndarray id из INPUT_IDS (+ ATTENTION_MASK), если клиент токенизировал сам."""
+    ids = pb_utils.get_input_tensor_by_name(request, "INPUT_IDS")
+    if ids is not None:
+        ids = np.atleast_2d(ids.as_numpy()).astype(np.int64)
+        mask = pb_utils.get_input_tensor_by_name(request, "ATTENTION_MASK")
+        mask = np.atleast_2d(mask.as_numpy()).astype(bool) if mask is not None else np.ones(ids.shape, dtype=bool)
+        return [row[m] for row, m in zip(ids, mask)]
+    text = pb_utils.get_input_tensor_by_name(request, "TEXT")
+    if text is None:
+        raise ValueError("expected TEXT or INPUT_IDS")
+    return decode_strings(text.as_numpy().reshape(-1))
+
+
+def truncate(ids, max_length):
+    # как truncation=True у токенизатора: последний (служебный) токен сохраняется
+    if len(ids) <= max_length:
+        return ids
+    return np.concatenate([ids[:max_length - 1], ids[-1:]])
+
+
+class EncoderModel:
+    """
+    execute() энкодера: элементы всех запросов — один батч, токенизация кусков в фоне
+    параллельно с forward, ошибка чтения запроса — только в его ответе.
+    Модель задаёт OUTPUT_NAME, в initialize() — self.device, self.max_length, self.metrics
+    и start_tokenizer(), и реализует _forward(input_ids, attention_mask) -> np.ndarray.
+    """
+
+    OUTPUT_NAME = None
+
+    @property
+    def tokenizer(self):
+        # грузится в фоне с initialize(); первый execute() дожидается его
+        return self._tokenizer.result()
+
+    def start_tokenizer(self, load, *args, **kwargs):
+        self._tokenizer = in_background(load, *args, **kwargs)
+        self._tokenize_pool = ThreadPoolExecutor(max_workers=1)
+
+    def _read_request(self, request):
+        return read_texts_or_ids(request)
+
+    def _length(self, item):
+        return len(item)
+
+    def _encode(self, items):
+        """Кусок батча -> (input_ids, attention_mask): тексты токенизируются, готовые id только обрезаются."""
+        texts = [x for x in items if isinstance(x, str)]
+        encoded = iter(self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"] if texts else ())
+        seqs = [next(encoded) if isinstance(x, str) else truncate(x, self.max_length) for x in items]
+        return pad(seqs, self.tokenizer.pad_token_id)
+
+    def _counters(self, items):
+        """Счётчики ExecuteMetrics сверх общих."""
+        return {"pretokenized": sum(not isinstance(x, str) for x in items)}
+
+    def _empty_output(self):
+        return np.empty((0,), dtype=np.float32)
+
+    def _pipeline(self, items):
+        """_forward() по кускам батча с токенизацией следующего куска в фоне; результат — в исходном порядке."""
+        order = sorted(range(len(items)), key=lambda i: self._length(items[i]))
+        step = PIPELINE_CHUNK or len(items)
+        futures = [self._tokenize_pool.submit(self._encode, [items[i] for i in order[s:s + step]])
+                   for s in range(0, len(order), step)]
+        outputs, masks, wait_sec, forward_sec = [], [], 0.0, 0.0
+        for future in futures:
+            t0 = time.perf_counter()
+            input_ids, attention_mask = future.result()
+            t1 = time.perf_counter()
+            outputs.append(self._forward(input_ids.to(self.device), attention_mask.to(self.device)))
+            wait_sec += t1 - t0
+            forward_sec += time.perf_counter() - t1
+            masks.append(attention_mask)
+        merged = np.concatenate(outputs)
+        result = np.empty_like(merged)
+        result[order] = merged
+        self.metrics.observe(masks, self.max_length, wait_sec, forward_sec, **self._counters(items))
+        return result
+
+    def execute(self, requests):
+        import torch
+
+        items, sizes, errors = [], [], []
+        for request in requests:
+            try:
+                part, error = self._read_request(request), None
+            except ValueError as e:
+                part, error = [], pb_utils.TritonError(str(e))
+            items.extend(part)
+            sizes.append(len(part))
+            errors.append(error)
+
+        if items:
+            with torch.no_grad():
+                outputs = self._pipeline(items)
+        else:
+            outputs = self._empty_output()
+
+        responses = []
+        offset = 0
+        for n, error in zip(sizes, errors):
+            if error is not None:
+                responses.append(pb_utils.InferenceResponse(output_tensors=[], error=error))
+                continue
+            chunk = outputs[offset:offset + n]
+            offset += n
+            responses.append(pb_utils.InferenceResponse(output_tensors=[pb_utils.Tensor(self.OUTPUT_NAME, chunk)]))
+        return responses
+
+    def finalize(self):
+        self._tokenize_pool.shutdown(wait=False)
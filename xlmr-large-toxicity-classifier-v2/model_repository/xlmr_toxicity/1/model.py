@@ -1,24 +1,33 @@
-import os
+import time
 import math
 import numpy as np
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
 import triton_python_backend_utils as pb_utils
+from triton_common import ENCODER_METRICS, EncoderModel, ExecuteMetrics, configure_cpu, resolve_checkpoint
 
 _MODEL_NAME = "textdetox/xlmr-large-toxicity-classifier-v2"
 
+
 def _sigmoid(x):
     return 1 / (1 + torch.exp(-x))
 
-class TritonPythonModel:
+class TritonPythonModel(EncoderModel):
+    OUTPUT_NAME = "P_TOXIC"
+
     def initialize(self, args):
+        configure_cpu("XLMR")
        
         self.device = torch.device("cpu")
 
        
-        self.tokenizer = AutoTokenizer.from_pretrained(_MODEL_NAME)
-        self.model = AutoModelForSequenceClassification.from_pretrained(_MODEL_NAME)
+        t0 = time.perf_counter()
+        checkpoint, local = resolve_checkpoint(_MODEL_NAME)
+        self.start_tokenizer(AutoTokenizer.from_pretrained, checkpoint, local_files_only=local)
+        self.model = AutoModelForSequenceClassification.from_pretrained(
+            checkpoint, local_files_only=local, low_cpu_mem_usage=True, torch_dtype=torch.float32
+        )
         self.model.eval().to(self.device)
 
        
@@ -40,60 +49,14 @@ class TritonPythonModel:
        
         self.max_length = 256
         self.return_full_probs = False 
-
-    def execute(self, requests):
-        responses = []
-
-       
-        all_texts = []
-        sizes = []
-        for request in requests:
-            t = pb_utils.get_input_tensor_by_name(request, "TEXT")
-            arr = t.as_numpy().reshape(-1)
-            texts = [x.decode("utf-8") if isinstance(x, (bytes, bytearray)) else str(x) for x in arr]
-            all_texts.extend(texts)
-            sizes.append(len(texts))
-
-        if len(all_texts) == 0:
-           
-            for request in requests:
-                out = np.empty((0,), dtype=np.float32)
-                responses.append(pb_utils.InferenceResponse(output_tensors=[pb_utils.Tensor("P_TOXIC", out)]))
-            return responses
-
-       
-        with torch.no_grad():
-            enc = self.tokenizer(
-                all_texts,
-                padding=True,
-                truncation=True,
-                max_length=self.max_length,
-                return_tensors="pt"
-            )
-            enc = {k: v.to(self.device) for k, v in enc.items()}
-            out = self.model(**enc)
-            logits = out.logits 
-
-            if self.num_labels == 1:
-               
-                probs_toxic = _sigmoid(logits.squeeze(-1)) 
-            else:
-               
-                probs = torch.softmax(logits, dim=-1) 
-                idx = max(0, min(self.toxic_idx, self.num_labels - 1))
-                probs_toxic = probs[:, idx] 
-
-            scores = probs_toxic.detach().cpu().numpy().astype(np.float32) 
-
-       
-        offset = 0
-        for request, n in zip(requests, sizes):
-            chunk = scores[offset:offset + n]
-            offset += n
-            out_tensor = pb_utils.Tensor("P_TOXIC", chunk)
-            responses.append(pb_utils.InferenceResponse(output_tensors=[out_tensor]))
-
-        return responses
-
-    def finalize(self):
-        pass
+        self.metrics = ExecuteMetrics(args, ENCODER_METRICS + ("pretokenized",))
+
+    def _forward(self, input_ids, attention_mask):
+        logits = self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+        if self.num_labels == 1:
+            probs_toxic = _sigmoid(logits.squeeze(-1))
+        else:
+            probs = torch.softmax(logits, dim=-1)
+            idx = max(0, min(self.toxic_idx, self.num_labels - 1))
+            probs_toxic = probs[:, idx]
+        return probs_toxic.detach().cpu().numpy().astype(np.float32)